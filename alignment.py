@@ -0,0 +1,338 @@
+"""Keypoint-based alignment scoring.
+
+A keypoint detector finds the 17 COCO body keypoints in a photo. With
+MoveNet that takes a few milliseconds on CPU. Joint angles are computed from
+the keypoints with NumPy and compared against every pose template in one
+vectorized pass. The result is a deterministic 0-100 alignment score and
+specific corrections, which the vision model then only has to phrase.
+
+The detector is optional: drop a MoveNet single-pose TFLite file at
+movenet_singlepose.tflite (or point YOGA_KEYPOINT_MODEL at one) to enable it.
+"""
+import os
+import threading
+
+import numpy as np
+
+KEYPOINT_MODEL_PATH = 'movenet_singlepose.tflite'
+
+# COCO keypoint order, as output by MoveNet
+KEYPOINT_NAMES = [
+    'nose', 'left_eye', 'right_eye', 'left_ear', 'right_ear',
+    'left_shoulder', 'right_shoulder', 'left_elbow', 'right_elbow',
+    'left_wrist', 'right_wrist', 'left_hip', 'right_hip',
+    'left_knee', 'right_knee', 'left_ankle', 'right_ankle',
+]
+KEYPOINT_INDEX = {name: i for i, name in enumerate(KEYPOINT_NAMES)}
+
+# (angle name, first keypoint, vertex keypoint, last keypoint)
+ANGLE_DEFINITIONS = [
+    ('left_elbow', 'left_shoulder', 'left_elbow', 'left_wrist'),
+    ('right_elbow', 'right_shoulder', 'right_elbow', 'right_wrist'),
+    ('left_shoulder', 'left_hip', 'left_shoulder', 'left_elbow'),
+    ('right_shoulder', 'right_hip', 'right_shoulder', 'right_elbow'),
+    ('left_hip', 'left_shoulder', 'left_hip', 'left_knee'),
+    ('right_hip', 'right_shoulder', 'right_hip', 'right_knee'),
+    ('left_knee', 'left_hip', 'left_knee', 'left_ankle'),
+    ('right_knee', 'right_hip', 'right_knee', 'right_ankle'),
+]
+ANGLE_NAMES = [name for name, _, _, _ in ANGLE_DEFINITIONS]
+
+# Target joint angles in degrees and the tolerance that still scores full
+# marks. Joints a pose leaves free are omitted. Asymmetric poses are written
+# with the left leg leading; the mirrored side is scored automatically.
+POSE_TEMPLATES = {
+    "Downward Dog": {
+        'left_elbow': (175, 10), 'right_elbow': (175, 10),
+        'left_shoulder': (170, 15), 'right_shoulder': (170, 15),
+        'left_hip': (70, 20), 'right_hip': (70, 20),
+        'left_knee': (175, 15), 'right_knee': (175, 15),
+    },
+    "Tree Pose": {
+        'left_hip': (175, 10), 'left_knee': (175, 10),
+        'right_hip': (125, 25), 'right_knee': (45, 20),
+    },
+    "Warrior I": {
+        'left_elbow': (175, 15), 'right_elbow': (175, 15),
+        'left_shoulder': (170, 20), 'right_shoulder': (170, 20),
+        'left_hip': (100, 20), 'left_knee': (95, 15),
+        'right_hip': (150, 20), 'right_knee': (170, 15),
+    },
+    "Warrior II": {
+        'left_elbow': (175, 10), 'right_elbow': (175, 10),
+        'left_shoulder': (90, 15), 'right_shoulder': (90, 15),
+        'left_hip': (100, 20), 'left_knee': (95, 15),
+        'right_hip': (135, 20), 'right_knee': (175, 10),
+    },
+    "Triangle Pose": {
+        'left_elbow': (175, 10), 'right_elbow': (175, 10),
+        'left_shoulder': (95, 20), 'right_shoulder': (95, 20),
+        'left_hip': (60, 20), 'left_knee': (175, 10),
+        'right_hip': (130, 20), 'right_knee': (175, 10),
+    },
+    "Cobra Pose": {
+        'left_elbow': (150, 25), 'right_elbow': (150, 25),
+        'left_shoulder': (30, 20), 'right_shoulder': (30, 20),
+        'left_hip': (150, 20), 'right_hip': (150, 20),
+        'left_knee': (175, 10), 'right_knee': (175, 10),
+    },
+    "Child's Pose": {
+        'left_shoulder': (160, 25), 'right_shoulder': (160, 25),
+        'left_hip': (40, 20), 'right_hip': (40, 20),
+        'left_knee': (35, 20), 'right_knee': (35, 20),
+    },
+    "Plank Pose": {
+        'left_elbow': (175, 10), 'right_elbow': (175, 10),
+        'left_shoulder': (80, 15), 'right_shoulder': (80, 15),
+        'left_hip': (175, 10), 'right_hip': (175, 10),
+        'left_knee': (175, 10), 'right_knee': (175, 10),
+    },
+    "Chair Pose": {
+        'left_elbow': (175, 15), 'right_elbow': (175, 15),
+        'left_shoulder': (170, 20), 'right_shoulder': (170, 20),
+        'left_hip': (90, 20), 'right_hip': (90, 20),
+        'left_knee': (100, 20), 'right_knee': (100, 20),
+    },
+    "Bridge Pose": {
+        'left_elbow': (175, 15), 'right_elbow': (175, 15),
+        'left_shoulder': (40, 25), 'right_shoulder': (40, 25),
+        'left_hip': (160, 15), 'right_hip': (160, 15),
+        'left_knee': (90, 15), 'right_knee': (90, 15),
+    },
+}
+
+# How to phrase a correction when the angle is below / above the target
+CORRECTION_VERBS = {
+    'elbow': ("Straighten", "Bend"),
+    'knee': ("Straighten", "Bend"),
+    'hip': ("Open", "Fold deeper at"),
+    'shoulder': ("Raise the arm from", "Lower the arm at"),
+}
+
+
+def mirror_angle_name(name):
+    if name.startswith('left_'):
+        return 'right_' + name[5:]
+    return 'left_' + name[6:]
+
+
+def joint_angles(keypoints, min_score=0.3):
+    """Joint angles in degrees from (..., 17, 3) keypoints of (y, x, score)
+
+    Works on any leading batch shape in one pass. Angles whose three
+    keypoints are not all detected with at least min_score are NaN.
+    """
+    keypoints = np.asarray(keypoints, dtype=np.float32)
+    first = np.array([KEYPOINT_INDEX[a] for _, a, _, _ in ANGLE_DEFINITIONS])
+    vertex = np.array([KEYPOINT_INDEX[b] for _, _, b, _ in ANGLE_DEFINITIONS])
+    last = np.array([KEYPOINT_INDEX[c] for _, _, _, c in ANGLE_DEFINITIONS])
+
+    u = keypoints[..., first, :2] - keypoints[..., vertex, :2]
+    v = keypoints[..., last, :2] - keypoints[..., vertex, :2]
+    norms = np.linalg.norm(u, axis=-1) * np.linalg.norm(v, axis=-1)
+    cosine = np.sum(u * v, axis=-1) / np.maximum(norms, 1e-6)
+    angles = np.degrees(np.arccos(np.clip(cosine, -1.0, 1.0)))
+
+    scores = keypoints[..., :, 2]
+    visible = np.minimum(np.minimum(scores[..., first], scores[..., vertex]), scores[..., last]) >= min_score
+    return np.where(visible & (norms > 1e-6), angles, np.nan)
+
+
+class AlignmentScorer:
+    """Score joint angles against every pose template at once
+
+    Templates become a (poses, 2 sides, angles) target array with NaN for
+    free joints, so scoring N people against all poses is a single
+    broadcasted comparison. A joint within tolerance scores 1, falling
+    linearly to 0 at falloff degrees beyond it.
+    """
+
+    def __init__(self, templates=None, falloff=45.0, min_visible=0.5, max_corrections=3):
+        self.templates = templates or POSE_TEMPLATES
+        self.falloff = falloff
+        self.min_visible = min_visible
+        self.max_corrections = max_corrections
+        self.pose_names = list(self.templates)
+        targets = np.full((len(self.pose_names), 2, len(ANGLE_NAMES)), np.nan, dtype=np.float32)
+        tolerances = np.zeros_like(targets)
+        for p, pose in enumerate(self.pose_names):
+            for name, (target, tolerance) in self.templates[pose].items():
+                for side, angle_name in enumerate((name, mirror_angle_name(name))):
+                    j = ANGLE_NAMES.index(angle_name)
+                    targets[p, side, j] = target
+                    tolerances[p, side, j] = tolerance
+        self.targets = targets
+        self.tolerances = tolerances
+
+    def score_matrix(self, angles):
+        """Per-joint scores and deviations for (N, angles) input against every template
+
+        Returns (pose_scores (N, poses), then joint_scores, deviations and
+        tolerances (N, poses, angles)) using, per pose, whichever side
+        matches better. Pose scores are NaN when too few of the template's
+        joints are visible.
+        """
+        angles = np.atleast_2d(np.asarray(angles, dtype=np.float32))
+        deviations = angles[:, None, None, :] - self.targets[None]
+        excess = np.maximum(np.abs(deviations) - self.tolerances[None], 0.0)
+        joint_scores = np.clip(1.0 - excess / self.falloff, 0.0, 1.0)
+
+        constrained = ~np.isnan(self.targets)[None]
+        scored = constrained & ~np.isnan(joint_scores)
+        counts = scored.sum(axis=-1)
+        with np.errstate(invalid='ignore'):
+            side_scores = np.where(scored, joint_scores, 0.0).sum(axis=-1) / counts
+        enough = counts >= self.min_visible * constrained.sum(axis=-1)
+        side_scores = np.where(enough, side_scores, np.nan)
+
+        # Pick the better-matching side per pose (NaN sides lose)
+        side = np.argmax(np.nan_to_num(side_scores, nan=-1.0), axis=-1)
+        pick = side[..., None, None]
+        pose_scores = np.take_along_axis(side_scores, side[..., None], axis=-1)[..., 0]
+        joint_scores = np.take_along_axis(joint_scores, pick, axis=2)[:, :, 0]
+        deviations = np.take_along_axis(deviations, pick, axis=2)[:, :, 0]
+        tolerances = np.take_along_axis(np.broadcast_to(self.tolerances, excess.shape), pick, axis=2)[:, :, 0]
+        return pose_scores, joint_scores, deviations, tolerances
+
+    def template_index(self, pose_name):
+        """Index of the template for a pose name such as "Warrior II (Virabhadrasana II)", or None"""
+        if not pose_name:
+            return None
+        lowered = pose_name.lower()
+        # Longest names first so "Warrior II" is not matched as "Warrior I"
+        for name in sorted(self.pose_names, key=len, reverse=True):
+            if name.lower() in lowered:
+                return self.pose_names.index(name)
+        return None
+
+    def corrections(self, angles, deviations, tolerances):
+        """Plain-language fixes for the joints furthest outside tolerance"""
+        fixes = []
+        for j, name in enumerate(ANGLE_NAMES):
+            deviation, tolerance = deviations[j], tolerances[j]
+            if np.isnan(deviation) or abs(deviation) <= tolerance:
+                continue
+            target = angles[j] - deviation
+            low_verb, high_verb = CORRECTION_VERBS[name.split('_', 1)[1]]
+            verb = low_verb if deviation < 0 else high_verb
+            fixes.append((abs(deviation) - tolerance, (
+                f"{verb} your {name.replace('_', ' ')}: "
+                f"about {angles[j]:.0f}°, aim for {target:.0f}°"
+            )))
+        fixes.sort(key=lambda fix: -fix[0])
+        return [text for _, text in fixes[:self.max_corrections]]
+
+    def score(self, keypoints, pose_name=None):
+        """Structured alignment feedback for one person's keypoints
+
+        Scores against pose_name's template, or the best-matching template
+        when pose_name is None or has no template. Returns None if too few
+        joints are visible to judge any pose.
+        """
+        return self.score_batch(np.asarray(keypoints)[None], [pose_name])[0]
+
+    def score_batch(self, keypoints, pose_names=None):
+        """score() for a (N, 17, 3) batch in one vectorized pass"""
+        angles = joint_angles(keypoints)
+        pose_scores, joint_scores, deviations, tolerances = self.score_matrix(angles)
+        pose_names = pose_names or [None] * len(angles)
+        results = []
+        for i, requested in enumerate(pose_names):
+            if np.all(np.isnan(pose_scores[i])):
+                results.append(None)
+                continue
+            best = int(np.nanargmax(pose_scores[i]))
+            index = self.template_index(requested)
+            if index is None or np.isnan(pose_scores[i, index]):
+                index = best
+            constrained = ~np.isnan(deviations[i, index])
+            results.append({
+                'pose_name': self.pose_names[index],
+                'score': round(float(pose_scores[i, index]) * 100, 1),
+                'best_match': self.pose_names[best],
+                'best_match_score': round(float(pose_scores[i, best]) * 100, 1),
+                'angles': {
+                    name: round(float(angles[i, j]), 1)
+                    for j, name in enumerate(ANGLE_NAMES) if not np.isnan(angles[i, j])
+                },
+                'joint_scores': {
+                    name: round(float(joint_scores[i, index, j]) * 100, 1)
+                    for j, name in enumerate(ANGLE_NAMES) if constrained[j]
+                },
+                'corrections': self.corrections(angles[i], deviations[i, index], tolerances[i, index]),
+            })
+        return results
+
+
+def describe_alignment(alignment):
+    """Render alignment feedback as prompt notes for the vision model to phrase"""
+    angles = ", ".join(f"{name.replace('_', ' ')} {angle:.0f}°" for name, angle in alignment['angles'].items())
+    lines = [
+        f"Measured joint angles from keypoint detection: {angles}.",
+        f"Closest reference template: {alignment['best_match']} "
+        f"(alignment score {alignment['best_match_score']:.0f}/100).",
+    ]
+    if alignment['corrections']:
+        lines.append("Measured corrections: " + "; ".join(alignment['corrections']) + ".")
+    lines.append("Base the alignment analysis and adjustments on these measurements where they apply.")
+    return "\n".join(lines)
+
+
+class KeypointDetector:
+    """Interface for single-person keypoint detectors
+
+    detect() takes an RGB uint8 array and returns a (17, 3) array of
+    (y, x, score) in pixel coordinates, in KEYPOINT_NAMES order.
+    """
+
+    def detect(self, rgb_array):
+        raise NotImplementedError
+
+    def detect_batch(self, rgb_arrays):
+        return np.stack([self.detect(rgb_array) for rgb_array in rgb_arrays])
+
+
+class MoveNetDetector(KeypointDetector):
+    """MoveNet single-pose (Lightning or Thunder) TFLite model on CPU"""
+
+    def __init__(self, model_path=KEYPOINT_MODEL_PATH, num_threads=None):
+        from model_export import load_interpreter_class
+
+        self.interpreter = load_interpreter_class()(model_path=model_path, num_threads=num_threads or os.cpu_count() or 1)
+        self.interpreter.allocate_tensors()
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_detail = self.interpreter.get_output_details()[0]
+        self.input_size = int(self.input_detail['shape'][1])
+        self._lock = threading.Lock()
+
+    def detect(self, rgb_array):
+        import cv2
+
+        height, width = rgb_array.shape[:2]
+        # MoveNet expects a square input; pad rather than stretch the body
+        side = max(height, width)
+        top, left = (side - height) // 2, (side - width) // 2
+        padded = cv2.copyMakeBorder(
+            np.ascontiguousarray(rgb_array[..., :3]), top, side - height - top, left, side - width - left,
+            cv2.BORDER_CONSTANT, value=0
+        )
+        resized = cv2.resize(padded, (self.input_size, self.input_size), interpolation=cv2.INTER_AREA)
+        batch = resized[None].astype(self.input_detail['dtype'])
+
+        with self._lock:
+            self.interpreter.set_tensor(self.input_detail['index'], batch)
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self.output_detail['index']).reshape(-1, 17, 3)[0]
+
+        keypoints = output.astype(np.float32).copy()
+        keypoints[:, 0] = keypoints[:, 0] * side - top
+        keypoints[:, 1] = keypoints[:, 1] * side - left
+        return keypoints
+
+
+def load_keypoint_detector(model_path=None, num_threads=None):
+    """The MoveNet detector from YOGA_KEYPOINT_MODEL, or None if no model file exists"""
+    model_path = model_path or os.getenv("YOGA_KEYPOINT_MODEL", KEYPOINT_MODEL_PATH)
+    if not model_path or not os.path.exists(model_path):
+        return None
+    return MoveNetDetector(model_path, num_threads)
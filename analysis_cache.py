@@ -0,0 +1,227 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import PIL.Image
+
+
+def content_digest(data):
+    """Return a stable SHA-256 digest of raw bytes or text"""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def image_digest(image):
+    """Return a stable SHA-256 digest of the decoded image pixels
+
+    Accepts a file path, raw bytes, a file-like object or a PIL image, so the
+    same photo re-encoded or re-uploaded maps to the same key.
+    """
+    if isinstance(image, (bytes, bytearray)):
+        image = io.BytesIO(image)
+    if not isinstance(image, PIL.Image.Image):
+        image = PIL.Image.open(image)
+    image = image.convert("RGB")
+    digest = hashlib.sha256()
+    digest.update(f"{image.width}x{image.height}:".encode("ascii"))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def source_digest(image):
+    """Return a SHA-256 digest of an image's encoded bytes without decoding it
+
+    Cheap enough to check the cache before any image work. A PIL image has
+    no encoded bytes, so it falls back to image_digest.
+    """
+    if isinstance(image, PIL.Image.Image):
+        return image_digest(image)
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return content_digest(bytes(image))
+    digest = hashlib.sha256()
+    if hasattr(image, "read"):
+        if hasattr(image, "seek"):
+            image.seek(0)
+        digest.update(image.read())
+        if hasattr(image, "seek"):
+            image.seek(0)
+        return digest.hexdigest()
+    with open(image, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class AnalysisCache:
+    """Two-tier cache for analysis results: in-memory LRU backed by JSON files on disk"""
+
+    def __init__(self, cache_dir="cache/analysis", memory_size=256,
+                 max_disk_bytes=256 * 1024 * 1024, ttl_seconds=7 * 24 * 3600, rescan_every=1000):
+        self.cache_dir = cache_dir
+        self.memory_size = memory_size
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+        # Writes keep a running total of the disk tier size; a full directory
+        # scan only happens when it goes over the limit, on the first write,
+        # and every rescan_every writes to pick up other processes' entries
+        self.rescan_every = rescan_every
+        self._disk_bytes = None
+        self._writes_since_scan = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _expired(self, created):
+        return self.ttl_seconds is not None and time.time() - created > self.ttl_seconds
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created, value = entry
+                if not self._expired(created):
+                    self._memory.move_to_end(key)
+                    self.hits["memory"] += 1
+                    return value
+                del self._memory[key]
+
+        value = self._read_disk(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits["disk"] += 1
+            self._remember(key, value, time.time())
+        return value
+
+    def set(self, key, value):
+        """Store value under key in both tiers"""
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+        self._write_disk(key, value, now)
+
+    def _remember(self, key, value, created):
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error reading cache entry {key}: {e}")
+            return None
+        if self._expired(entry.get("created", 0)):
+            self._remove(path)
+            return None
+        return entry.get("value")
+
+    def _write_disk(self, key, value, created):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            old_size = os.path.getsize(path)
+        except OSError:
+            old_size = 0
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"created": created, "value": value}, f)
+            new_size = os.path.getsize(tmp_path)
+            # Atomic rename so concurrent readers never see a partial entry
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Error writing cache entry {key}: {e}")
+            self._remove(tmp_path)
+            return
+
+        with self._lock:
+            self._writes_since_scan += 1
+            scan = self._disk_bytes is None or self._writes_since_scan >= self.rescan_every
+            if not scan:
+                self._disk_bytes += new_size - old_size
+                scan = self._disk_bytes > self.max_disk_bytes
+        if scan:
+            self.evict()
+
+    def evict(self, low_water=0.9):
+        """Drop expired disk entries, then the oldest ones until under the size limit
+
+        Eviction goes down to low_water of the limit, so the next scan is
+        many writes away rather than on the very next one.
+        """
+        if not self.cache_dir:
+            return
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if self._expired(stat.st_mtime):
+                self._remove(path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_disk_bytes:
+            for _, size, path in sorted(entries):
+                if total <= self.max_disk_bytes * low_water:
+                    break
+                self._remove(path)
+                total -= size
+        with self._lock:
+            self._disk_bytes = total
+            self._writes_since_scan = 0
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def clear(self):
+        """Remove every entry from both tiers"""
+        with self._lock:
+            self._memory.clear()
+            self._disk_bytes = None
+        if self.cache_dir:
+            for name in os.listdir(self.cache_dir):
+                self._remove(os.path.join(self.cache_dir, name))
+
+    def stats(self):
+        """Return hit/miss counters and the current memory tier size"""
+        with self._lock:
+            hits = self.hits["memory"] + self.hits["disk"]
+            lookups = hits + self.misses
+            return {
+                "memory_hits": self.hits["memory"],
+                "disk_hits": self.hits["disk"],
+                "misses": self.misses,
+                "hit_ratio": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+            }
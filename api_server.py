@@ -0,0 +1,372 @@
+"""HTTP API for pose analysis and chat.
+
+Usage:
+    python api_server.py [--host 127.0.0.1] [--port 8000] [--workers 1]
+
+Endpoints:
+    POST /analyze        one image, as the raw request body or a multipart "image" field
+    POST /analyze/batch  up to YOGA_API_MAX_BATCH images as multipart "images" fields
+    POST /chat           JSON {"question", "analysis", "history"}; the answer streams as text
+    GET  /healthz        readiness, classifier state and queue depth
+    GET  /metrics        Prometheus metrics
+
+An ASGI app (Starlette, served by uvicorn). The event loop only parses
+requests and writes responses. Analysis runs on a bounded worker pool over the
+shared resources.py instances, and each chat answer streams from a thread of
+its own. Once YOGA_API_MAX_PENDING jobs (analyses and open chat streams) are
+running or queued, further requests get 503 with Retry-After right away
+instead of waiting in an unbounded queue, so a load balancer can retry them on
+another node. Batch images are analyzed at batch priority, behind interactive
+requests for the same provider keys (see scheduler.py). Each uvicorn worker
+process has its own models and pool.
+
+With YOGA_VISION_PROVIDERS=stub and YOGA_CHAT_PROVIDERS=stub the server runs
+entirely offline.
+"""
+import argparse
+import asyncio
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import PIL.Image
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+import resources
+from scheduler import BATCH, INTERACTIVE, scheduler
+from telemetry import telemetry
+
+MAX_UPLOAD_BYTES = int(os.getenv("YOGA_API_MAX_UPLOAD_BYTES", 10 * 1024 * 1024))
+MAX_BATCH = int(os.getenv("YOGA_API_MAX_BATCH", "16"))
+RETRY_AFTER_SECONDS = 2
+
+
+class Overloaded(Exception):
+    """The worker pool has no room for more jobs"""
+
+
+class WorkerPool:
+    """Bounded thread pool for the blocking model work
+
+    At most max_pending jobs are admitted, running or queued. reserve()
+    raises Overloaded beyond that, so excess requests are refused up front.
+    A job's slot is released when the job finishes, not when the request
+    stops waiting for it, so clients that disconnect cannot make room for
+    more work while theirs is still running.
+    """
+
+    def __init__(self, workers=16, max_pending=64):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api-worker")
+        self._lock = threading.Lock()
+
+    def reserve(self, slots=1):
+        with self._lock:
+            if self.pending + slots > self.max_pending:
+                self.rejected += 1
+                raise Overloaded(f"{self.pending} of {self.max_pending} jobs already pending")
+            self.pending += slots
+
+    def release(self, slots=1):
+        with self._lock:
+            self.pending -= slots
+
+    def submit(self, fn, *args):
+        """Run fn(*args) on a worker thread in one slot the caller reserved; returns an awaitable
+
+        The slot passes to the job and is released when the job is done.
+        """
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self.release()
+            raise
+        future.add_done_callback(lambda _: self.release())
+        return asyncio.wrap_future(future)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self.pending,
+                "rejected": self.rejected,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def analyze_item(data, priority):
+    """Analyze one uploaded image on a worker thread; unreadable images get an error entry"""
+    try:
+        # Check the upload is an image before spending a model call on it
+        PIL.Image.open(io.BytesIO(data)).verify()
+    except Exception as e:
+        return {'error': f"Unreadable image: {e}"}
+    with scheduler.priority(priority):
+        return resources.get_yoga_analysis().analyze_image(data)
+
+
+async def read_images(request, field, limit):
+    """Image bytes from multipart field, or the raw body when a single image is expected"""
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > MAX_UPLOAD_BYTES * limit:
+        raise HTTPException(413, f"Request is larger than {MAX_UPLOAD_BYTES * limit} bytes")
+
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        async with request.form(max_files=limit, max_fields=limit) as form:
+            images = [await upload.read() for upload in form.getlist(field) if hasattr(upload, "read")]
+    elif limit == 1:
+        body = bytearray()
+        async for chunk in request.stream():
+            body.extend(chunk)
+            if len(body) > MAX_UPLOAD_BYTES:
+                break
+        images = [bytes(body)] if body else []
+    else:
+        raise HTTPException(400, f"Send the images as multipart/form-data \"{field}\" fields")
+
+    if not images:
+        raise HTTPException(400, f"No image in the request; send it as the body or a \"{field}\" field")
+    if len(images) > limit:
+        raise HTTPException(400, f"At most {limit} images per request")
+    if any(len(data) > MAX_UPLOAD_BYTES for data in images):
+        raise HTTPException(413, f"Images must be at most {MAX_UPLOAD_BYTES} bytes")
+    return images
+
+
+async def analyze(request):
+    data, = await read_images(request, "image", 1)
+    pool = request.app.state.pool
+    pool.reserve()
+    result = await pool.submit(analyze_item, data, INTERACTIVE)
+    if 'error' in result:
+        raise HTTPException(400, result['error'])
+    # analyze_image reports provider failures in the result rather than raising
+    status = 502 if result.get('pose_name') == "Analysis Failed" else 200
+    return JSONResponse(result, status_code=status)
+
+
+async def analyze_batch(request):
+    pool = request.app.state.pool
+    # A batch bigger than the pool could never be admitted, however long the client waits
+    images = await read_images(request, "images", min(MAX_BATCH, pool.max_pending))
+    pool.reserve(len(images))
+    results = await asyncio.gather(*[pool.submit(analyze_item, data, BATCH) for data in images])
+    return JSONResponse({'results': results})
+
+
+async def chat(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(400, "Expected a JSON body")
+    if not isinstance(body, dict):
+        raise HTTPException(400, "Expected a JSON object")
+    question = str(body.get('question') or "").strip()
+    analysis = body.get('analysis')
+    if not question or not analysis:
+        raise HTTPException(400, "Both \"question\" and \"analysis\" are required")
+    history = body.get('history') or []
+
+    pool = request.app.state.pool
+    pool.reserve()
+    try:
+        chunks = resources.get_chat_handler().stream_response(question, analysis, history)
+    except Exception:
+        pool.release()
+        raise
+    # The reservation is held until the whole answer has been sent
+    return ReleasingStreamingResponse(stream_in_thread(chunks), pool.release, media_type="text/plain; charset=utf-8")
+
+
+class ReleasingStreamingResponse(StreamingResponse):
+    """StreamingResponse that calls release once it ends, however it ends
+
+    A client can disconnect before the body is first read, so a finally in
+    the body generator is not enough: it only runs once the generator starts.
+    """
+
+    def __init__(self, content, release, **kwargs):
+        super().__init__(content, **kwargs)
+        self.release = release
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            try:
+                # Stops the streaming thread if the client left mid-answer
+                await self.body_iterator.aclose()
+            finally:
+                self.release()
+
+
+async def stream_in_thread(chunks):
+    """Iterate a blocking generator on a thread of its own, yielding its items here
+
+    The whole generator runs on one thread. Stepping it on pool workers
+    deadlocked: requests waiting on a coalesced answer held every worker
+    while the request producing that answer queued for one to read its next
+    token. The thread stops at its next item once the client goes away.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    done = object()
+    stopped = threading.Event()
+
+    def put(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            # The event loop has shut down; nobody is listening any more
+            stopped.set()
+
+    def pump():
+        try:
+            for chunk in chunks:
+                if stopped.is_set():
+                    break
+                put(chunk)
+        except Exception as e:
+            put(e)
+        finally:
+            chunks.close()
+            put(done)
+
+    threading.Thread(target=pump, name="api-stream", daemon=True).start()
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+
+
+async def healthz(request):
+    pool = request.app.state.pool
+    analysis = resources.get_yoga_analysis()
+    stats = pool.stats()
+    full = stats['pending'] >= stats['max_pending']
+    return JSONResponse({
+        'status': "busy" if full else "ok",
+        'classifier_ready': analysis.is_ready(),
+        'classifier_error': str(analysis.model_error) if analysis.model_error else None,
+        'pool': stats,
+        'scheduler': scheduler.stats(),
+    }, status_code=503 if full else 200)
+
+
+async def metrics(request):
+    return PlainTextResponse(telemetry.export_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+async def http_error(request, exc):
+    return JSONResponse({'error': exc.detail}, status_code=exc.status_code, headers=exc.headers)
+
+
+async def overloaded(request, exc):
+    telemetry.increment("api_rejected_total")
+    return JSONResponse(
+        {'error': f"Server is busy: {exc}"},
+        status_code=503,
+        headers={'Retry-After': str(RETRY_AFTER_SECONDS)}
+    )
+
+
+ROUTES = [
+    Route('/analyze', analyze, methods=['POST']),
+    Route('/analyze/batch', analyze_batch, methods=['POST']),
+    Route('/chat', chat, methods=['POST']),
+    Route('/healthz', healthz, methods=['GET']),
+    Route('/metrics', metrics, methods=['GET']),
+]
+ROUTE_PATHS = {route.path for route in ROUTES}
+
+
+class RequestMetrics:
+    """ASGI middleware recording request counts by status and latency per route
+
+    Spans are not used here: their parent tracking is per thread, and every
+    request shares the event loop thread.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Unknown paths share one label so scanners cannot grow the metric set
+            path = scope['path'] if scope['path'] in ROUTE_PATHS else "other"
+            telemetry.increment("api_requests_total", path=path, status=status[0])
+            telemetry.record_duration("api_request", time.perf_counter() - start, path=path)
+
+
+def create_app(workers=None, max_pending=None):
+    """Build the ASGI app; pool sizes default to YOGA_API_WORKERS and YOGA_API_MAX_PENDING"""
+    pool = WorkerPool(
+        workers=workers or int(os.getenv("YOGA_API_WORKERS", "16")),
+        max_pending=max_pending or int(os.getenv("YOGA_API_MAX_PENDING", "64")),
+    )
+
+    @asynccontextmanager
+    async def lifespan(app):
+        # Build the shared instances before taking traffic; the classifier keeps loading in the background
+        await asyncio.get_running_loop().run_in_executor(None, resources.get_chat_handler)
+        await asyncio.get_running_loop().run_in_executor(None, resources.get_yoga_analysis)
+        telemetry.register_collector("api_pool", pool.stats)
+        yield
+        pool.shutdown()
+
+    app = Starlette(
+        routes=ROUTES,
+        exception_handlers={HTTPException: http_error, Overloaded: overloaded},
+        lifespan=lifespan,
+    )
+    app.state.pool = pool
+    return RequestMetrics(app)
+
+
+app = create_app()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='yoga-api', description="Serve pose analysis and chat over HTTP")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=1, help="Server processes, each with its own models")
+    args = parser.parse_args(argv)
+
+    import uvicorn
+    uvicorn.run('api_server:app', host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == '__main__':
+    main()
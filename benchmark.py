@@ -0,0 +1,366 @@
+"""Reproducible benchmarks for the analysis and chat pipeline.
+
+Usage:
+    python benchmark.py [--suites preprocess,classify,...] [--output bench.json]
+                        [--baseline baseline.json] [--save-baseline] [--latency 0.05]
+
+Every suite runs on deterministic synthetic inputs (seeded images, a
+generated analysis corpus, fixed questions), so runs on the same machine are
+comparable. The remote model calls go to the local stub providers, with
+--latency seconds of injected delay per call, so analyze and chat measure
+this code rather than the network.
+
+Each benchmark reports throughput, p50/p95/p99 latency and the peak Python
+heap from tracemalloc (TensorFlow's native allocations are not included;
+max_rss_mb in the environment block covers the whole process). Results are
+written as JSON. With --baseline they are compared to an earlier run, and
+the exit status is 1 if any benchmark regressed past --tolerance.
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import PIL.Image
+
+SUITES = ('preprocess', 'classify', 'extract', 'analyze', 'chat')
+IMAGE_SIZES = [(640, 480), (1280, 960), (3024, 4032)]
+CHAT_QUESTIONS = [
+    "How can I improve my alignment?",
+    "Is this pose safe for my knees?",
+    "What are the benefits of this pose?",
+    "What common mistakes should I avoid?",
+    "How do I make this pose easier?",
+    "Which muscles does this pose strengthen?",
+]
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def measure(fn, iterations, warmup=2, items_per_call=1, memory_iterations=3):
+    """Time fn() over iterations calls and trace peak heap use over a few more
+
+    Memory is traced in a separate pass because tracemalloc slows
+    allocation-heavy code enough to distort the latency numbers.
+    """
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        call_start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - call_start)
+    total = time.perf_counter() - start
+
+    tracemalloc.start()
+    try:
+        for _ in range(memory_iterations):
+            fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'iterations': iterations,
+        'items_per_call': items_per_call,
+        'throughput_per_s': iterations * items_per_call / total if total else 0.0,
+        'mean_ms': total / iterations * 1000,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'peak_heap_mb': peak / (1024 * 1024),
+    }
+
+
+def synthetic_image(rng, size, image_format='JPEG'):
+    """Encode a smooth random image; pure noise would make JPEG unrealistically large"""
+    width, height = size
+    small = rng.integers(0, 256, (max(1, height // 32), max(1, width // 32), 3), dtype=np.uint8)
+    img = PIL.Image.fromarray(small).resize((width, height), PIL.Image.Resampling.BILINEAR)
+    buffer = io.BytesIO()
+    img.save(buffer, format=image_format, quality=90)
+    return buffer.getvalue()
+
+
+def analysis_corpus(count, seed):
+    """Generate analysis texts in the formats the vision model actually returns"""
+    from model_generation import POSE_LABELS
+    from providers import StubVisionProvider
+
+    rng = random.Random(seed)
+    filler = (
+        "Keep the breath steady and lengthen through the spine while the shoulders stay relaxed. "
+        "Press evenly through the hands and feet and keep the gaze soft."
+    )
+    templates = [
+        "Pose: {pose}\n",
+        "**1. Pose Identification and Classification:**\nPose: **{pose}**\n",
+        "## Pose Identification\nThe pose is identified as: {pose}\n",
+        "Asana: {pose}\n",
+        "This image shows {pose}, a common standing pose.\n",
+    ]
+    body = StubVisionProvider().analysis_text({'data': b'benchmark'}).split('\n', 2)[2]
+    corpus = []
+    for _ in range(count):
+        header = rng.choice(templates).format(pose=rng.choice(POSE_LABELS))
+        corpus.append(header + body + (filler + "\n") * rng.randint(0, 20))
+    return corpus
+
+
+def bench_preprocess(args, rng):
+    from image_processor import ImageProcessor
+
+    processor = ImageProcessor()
+    results = {}
+    for size in IMAGE_SIZES:
+        image = synthetic_image(rng, size)
+        label = f"{size[0]}x{size[1]}"
+        results[f'preprocess_image[{label}]'] = measure(
+            lambda: processor.preprocess_image(image), args.iterations)
+        results[f'normalize_image[{label}]'] = measure(
+            lambda: processor.normalize_image(image), args.iterations)
+    images = [synthetic_image(rng, IMAGE_SIZES[0]) for _ in range(16)]
+    results['preprocess_images[640x480,batch=16]'] = measure(
+        lambda: processor.preprocess_images(images), max(1, args.iterations // 4), items_per_call=len(images))
+    return results
+
+
+def bench_classify(args, rng):
+    from model_generation import create_default_model
+    from yoga_analysis import YogaPoseAnalysis
+
+    # A freshly built default model, so the numbers don't depend on a saved checkpoint
+    analysis = YogaPoseAnalysis(load_classifier=False)
+    analysis.pose_classifier = create_default_model()
+    analysis._load_started = True
+    analysis.model_ready.set()
+
+    frames = rng.integers(0, 256, (max(args.batch_sizes), 224, 224, 3), dtype=np.uint8)
+    results = {}
+    for batch_size in args.batch_sizes:
+        batch = list(frames[:batch_size])
+        results[f'classify_batch[batch={batch_size}]'] = measure(
+            lambda: analysis.classify_batch(batch, batch_size=batch_size),
+            max(1, args.iterations // 2), items_per_call=batch_size, memory_iterations=1)
+
+    if args.tflite and os.path.exists(args.tflite):
+        from model_export import TFLiteClassifier
+        analysis.pose_classifier = TFLiteClassifier(args.tflite)
+        for batch_size in args.batch_sizes:
+            batch = list(frames[:batch_size])
+            results[f'classify_batch[tflite,batch={batch_size}]'] = measure(
+                lambda: analysis.classify_batch(batch, batch_size=batch_size),
+                max(1, args.iterations // 2), items_per_call=batch_size, memory_iterations=1)
+    return results
+
+
+def bench_extract(args, rng):
+    from yoga_analysis import extract_pose_name, parse_sections
+
+    corpus = analysis_corpus(args.corpus_size, args.seed)
+
+    def extract_all():
+        for text in corpus:
+            extract_pose_name(text)
+
+    def parse_all():
+        for text in corpus:
+            parse_sections(text)
+
+    iterations = max(1, args.iterations // 4)
+    return {
+        f'extract_pose_name[corpus={len(corpus)}]': measure(extract_all, iterations, items_per_call=len(corpus)),
+        f'parse_sections[corpus={len(corpus)}]': measure(parse_all, iterations, items_per_call=len(corpus)),
+    }
+
+
+def bench_analyze(args, rng):
+    from analysis_cache import AnalysisCache
+    from yoga_analysis import YogaPoseAnalysis
+
+    analysis = YogaPoseAnalysis(load_classifier=False)
+    cache_dir = tempfile.mkdtemp(prefix='yoga_bench_')
+    analysis.analysis_cache = AnalysisCache(cache_dir=cache_dir)
+    # Distinct images so every uncached call reaches the provider
+    images = [synthetic_image(rng, IMAGE_SIZES[1]) for _ in range(args.iterations + 8)]
+    position = itertools.count()
+
+    def analyze_uncached():
+        analysis.analysis_cache.clear()
+        analysis.analyze_image(images[next(position) % len(images)])
+
+    def stream_uncached():
+        analysis.analysis_cache.clear()
+        for _ in analysis.stream_analysis(images[next(position) % len(images)]):
+            pass
+
+    cached_image = images[0]
+    analysis.analyze_image(cached_image)
+    results = {
+        'analyze_image[uncached]': measure(analyze_uncached, args.iterations),
+        'stream_analysis[uncached]': measure(stream_uncached, args.iterations),
+    }
+    analysis.analyze_image(cached_image)
+    results['analyze_image[cached]'] = measure(lambda: analysis.analyze_image(cached_image), args.iterations)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    return results
+
+
+def bench_chat(args, rng):
+    from chat_handler3 import YogaChatHandler
+    from providers import StubVisionProvider
+
+    handler = YogaChatHandler()
+    analysis_text = StubVisionProvider().analysis_text({'data': b'benchmark'})
+    summary = handler.summarize_analysis(analysis_text)
+    history = []
+    for question in CHAT_QUESTIONS[:3]:
+        history += [{'role': 'user', 'content': question}, {'role': 'assistant', 'content': analysis_text[:400]}]
+    questions = itertools.count()
+
+    def ask_uncached():
+        handler.response_cache.clear()
+        handler.get_response(CHAT_QUESTIONS[next(questions) % len(CHAT_QUESTIONS)], summary, history)
+
+    def stream_uncached():
+        handler.response_cache.clear()
+        for _ in handler.stream_response(CHAT_QUESTIONS[next(questions) % len(CHAT_QUESTIONS)], summary, history):
+            pass
+
+    results = {
+        'get_response[uncached]': measure(ask_uncached, args.iterations),
+        'stream_response[uncached]': measure(stream_uncached, args.iterations),
+    }
+    handler.get_response(CHAT_QUESTIONS[0], summary)
+    results['get_response[cached]'] = measure(
+        lambda: handler.get_response(CHAT_QUESTIONS[0], summary), args.iterations)
+    handler.response_cache.clear()
+    return results
+
+
+BENCHMARKS = {
+    'preprocess': bench_preprocess,
+    'classify': bench_classify,
+    'extract': bench_extract,
+    'analyze': bench_analyze,
+    'chat': bench_chat,
+}
+
+
+def environment(args):
+    """Describe the machine and settings, so results are only compared like for like"""
+    info = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'seed': args.seed,
+        'stub_latency_s': args.latency,
+    }
+    if 'tensorflow' in sys.modules:
+        info['tensorflow'] = sys.modules['tensorflow'].__version__
+    try:
+        import resource
+        # ru_maxrss is kilobytes on Linux and bytes on macOS
+        scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+        info['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    except ImportError:
+        pass
+    return info
+
+
+def compare(results, baseline, tolerance):
+    """Return (name, metric, baseline, current) for every regression beyond tolerance"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get('benchmarks', {}).get(name)
+        if previous is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms'):
+            if previous[metric] and current[metric] > previous[metric] * (1 + tolerance):
+                regressions.append((name, metric, previous[metric], current[metric]))
+        if current['throughput_per_s'] < previous['throughput_per_s'] * (1 - tolerance):
+            regressions.append((name, 'throughput_per_s', previous['throughput_per_s'], current['throughput_per_s']))
+    return regressions
+
+
+def print_table(results):
+    print(f"{'benchmark':48} {'items/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'heap MB':>8}")
+    for name, r in results.items():
+        print(f"{name:48} {r['throughput_per_s']:10.1f} {r['p50_ms']:9.2f} {r['p95_ms']:9.2f} "
+              f"{r['p99_ms']:9.2f} {r['peak_heap_mb']:8.1f}")
+
+
+def run(args):
+    # Route every model call to the local stubs before any provider is built
+    os.environ['YOGA_VISION_PROVIDERS'] = 'stub'
+    os.environ['YOGA_CHAT_PROVIDERS'] = 'stub'
+    os.environ['YOGA_STUB_LATENCY'] = str(args.latency)
+
+    results = {}
+    for suite in args.suites:
+        print(f"Running {suite} benchmarks...")
+        results.update(BENCHMARKS[suite](args, np.random.default_rng(args.seed)))
+    return {'environment': environment(args), 'benchmarks': results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='yoga-benchmark', description="Benchmark the analysis and chat pipeline")
+    parser.add_argument('--suites', default=','.join(SUITES), help=f"Comma-separated subset of {', '.join(SUITES)}")
+    parser.add_argument('--iterations', type=int, default=40, help="Timed calls per benchmark")
+    parser.add_argument('--batch-sizes', default='1,8,32', help="Classifier batch sizes")
+    parser.add_argument('--tflite', default='yoga_pose_model.tflite',
+                        help="Also benchmark this exported TFLite classifier if it exists")
+    parser.add_argument('--corpus-size', type=int, default=2000, help="Analysis texts for the extraction benchmarks")
+    parser.add_argument('--latency', type=float, default=float(os.getenv('YOGA_STUB_LATENCY', '0')),
+                        help="Injected stub provider latency in seconds")
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--output', default='benchmark_results.json', help="Where to write the JSON results")
+    parser.add_argument('--baseline', help="Earlier results JSON to compare against")
+    parser.add_argument('--save-baseline', action='store_true', help="Also write these results to --baseline")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed fractional slowdown before failing")
+    args = parser.parse_args(argv)
+    args.suites = [suite.strip() for suite in args.suites.split(',') if suite.strip()]
+    args.batch_sizes = [int(size) for size in args.batch_sizes.split(',')]
+    unknown = set(args.suites) - set(SUITES)
+    if unknown:
+        parser.error(f"Unknown suites: {', '.join(sorted(unknown))}")
+
+    report = run(args)
+    print_table(report['benchmarks'])
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote results to {args.output}")
+
+    if not args.baseline:
+        return 0
+    if args.save_baseline or not os.path.exists(args.baseline):
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare(report['benchmarks'], baseline, args.tolerance)
+    for name, metric, previous, current in regressions:
+        print(f"REGRESSION {name} {metric}: {previous:.2f} -> {current:.2f}")
+    if not regressions:
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+import re
+
+# Which analysis sections answer which kinds of question
+SECTION_KEYWORDS = {
+    'identification': ['what pose', 'which pose', 'name', 'called', 'sanskrit'],
+    'alignment': ['align', 'posture', 'form', 'position', 'straight', 'angle', 'spine', 'hips', 'shoulder'],
+    'adjustments': ['adjust', 'correct', 'fix', 'improve', 'modify', 'better', 'easier', 'deeper', 'how do i', 'how can i'],
+    'safety': ['safe', 'risk', 'hurt', 'pain', 'injur', 'knee', 'back', 'neck', 'wrist', 'pregnan', 'avoid', 'contraindicat'],
+    'benefits': ['benefit', 'good for', 'help', 'why', 'strength', 'flexib'],
+    'mistakes': ['mistake', 'wrong', 'error', 'avoid', 'common'],
+}
+
+# Sections used when the question matches none of the keywords
+DEFAULT_SECTIONS = ['identification', 'alignment', 'adjustments']
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token for English text)"""
+    return (len(text) + 3) // 4
+
+
+def compact_text(text, max_words):
+    """Strip markdown, fold bullet lists into one line and cap the word count"""
+    lines = []
+    for line in text.splitlines():
+        line = re.sub(r'^\s*(?:(?:[>*#\-]+|\d+[.)])\s*)+', '', line)
+        line = line.replace('**', '').replace('__', '').strip()
+        if line:
+            # Bullet items become clauses; lines that are sentences already stay as-is
+            lines.append(line if line[-1] in '.!?;:' else line + ';')
+    words = ' '.join(lines).rstrip(';').split()
+    if len(words) <= max_words:
+        return ' '.join(words)
+    return ' '.join(words[:max_words]) + ' ...'
+
+
+class ChatContextBuilder:
+    """Turn a pose analysis into a compact, question-specific chat context"""
+
+    def __init__(self, section_words=60, brief_section_words=20, history_token_budget=400):
+        self.section_words = section_words
+        self.brief_section_words = brief_section_words
+        self.history_token_budget = history_token_budget
+
+    def summarize(self, analysis):
+        """Build the structured summary once per image
+
+        Accepts an analysis result dict (with 'sections') or raw analysis text.
+        """
+        from yoga_analysis import extract_pose_name, parse_sections
+
+        if isinstance(analysis, dict):
+            text = analysis.get('full_analysis', "")
+            pose_name = analysis.get('pose_name') or extract_pose_name(text)
+            sections = analysis.get('sections') or parse_sections(text)
+        else:
+            text = analysis or ""
+            pose_name = extract_pose_name(text)
+            sections = parse_sections(text)
+
+        return {
+            'pose_name': pose_name,
+            'sections': {key: compact_text(value, self.section_words) for key, value in sections.items()},
+            'brief': {key: compact_text(value, self.brief_section_words) for key, value in sections.items()},
+        }
+
+    def select_sections(self, summary, user_query):
+        """Return the section keys relevant to the question"""
+        query = user_query.lower()
+        selected = [
+            key for key, keywords in SECTION_KEYWORDS.items()
+            if key in summary['sections'] and any(keyword in query for keyword in keywords)
+        ]
+        return selected
+
+    def context_sections(self, summary, user_query):
+        """Return the section keys build_context renders for this question"""
+        selected = self.select_sections(summary, user_query)
+        if selected:
+            return selected
+        # Nothing specific asked: a one-line overview of the main sections
+        return [key for key in DEFAULT_SECTIONS if key in summary['brief']]
+
+    def build_context(self, summary, user_query):
+        """Render the summary sections relevant to this question as prompt context"""
+        lines = [f"Pose: {summary['pose_name']}"]
+        selected = self.select_sections(summary, user_query)
+        if selected:
+            for key in selected:
+                lines.append(f"{key.title()}: {summary['sections'][key]}")
+        else:
+            for key in self.context_sections(summary, user_query):
+                lines.append(f"{key.title()}: {summary['brief'][key]}")
+        return '\n'.join(lines)
+
+    def trim_history(self, history, token_budget=None):
+        """Keep the most recent chat turns that fit within the token budget"""
+        token_budget = self.history_token_budget if token_budget is None else token_budget
+        kept, used = [], 0
+        for message in reversed(history or []):
+            tokens = estimate_tokens(message['content'])
+            if used + tokens > token_budget:
+                break
+            kept.append({'role': message['role'], 'content': message['content']})
+            used += tokens
+        kept.reverse()
+        return kept
@@ -1,74 +1,269 @@
-from groq import Groq
-import os
-from dotenv import load_dotenv
-
-class YogaChatHandler:
-    def __init__(self):
-        load_dotenv()
-        self.GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-        if self.GROQ_API_KEY:
-            self.groq_client = Groq(api_key=self.GROQ_API_KEY)
-
-    def count_words(self, text):
-        """Count words in text"""
-        return len(text.split())
-
-    def get_response(self, user_query, yoga_context):
-        try:
-            messages = [
-                {
-                    "role": "system",
-                    "content": """
-                    You are an experienced yoga instructor providing concise guidance.
-                    Key instructions:
-                    - Limit responses to maximum 200 words
-                    - Be direct and specific
-                    - Focus on the most relevant information
-                    - Only include essential details
-                    - Skip general advice unless specifically asked
-                    - Maintain a supportive but concise tone
-                    - If the question can be answered briefly, do so
-                    """
-                },
-                {
-                    "role": "user",
-                    "content": f"""
-                    Context: {yoga_context}
-                    
-                    Question: {user_query}
-                    
-                    Remember to provide a focused response in 200 words or less.
-                    """
-                }
-            ]
-
-            chat_completion = self.groq_client.chat.completions.create(
-                messages=messages,
-                model="llama3-8b-8192",
-                max_tokens=300,  # Reduced token limit
-                temperature=0.7,
-                top_p=0.9
-            )
-
-            response = chat_completion.choices[0].message.content
-
-            # Add disclaimer only if response is about practice or safety
-            if any(word in user_query.lower() for word in ['practice', 'safe', 'risk', 'hurt', 'pain', 'modify']):
-                disclaimer = (
-                    "\n\n---\n"
-                    "*Note: Please practice with proper instruction and consult a qualified instructor for personalized guidance.*"
-                )
-                response += disclaimer
-
-            # Verify response length
-            if self.count_words(response) > 200:
-                # Truncate to last complete sentence before 200 words
-                words = response.split()
-                truncated = ' '.join(words[:200])
-                last_sentence = truncated.rsplit('.', 1)[0] + '.'
-                return last_sentence
-
-            return response
-
-        except Exception as e:
-            return f"Unable to generate response: {str(e)}"
\ No newline at end of file
+import os
+import re
+import threading
+import time
+from contextlib import nullcontext
+from dotenv import load_dotenv
+from chat_context import ChatContextBuilder, estimate_tokens
+from providers import build_chat_providers, policy_from_env
+from response_cache import ResponseCache
+from scheduler import scheduler
+from telemetry import span, telemetry
+
+SYSTEM_PROMPT = """You are an experienced yoga instructor providing concise guidance.
+Key instructions:
+- Limit responses to maximum 200 words
+- Be direct and specific
+- Focus on the most relevant information
+- Only include essential details
+- Skip general advice unless specifically asked
+- Maintain a supportive but concise tone
+- If the question can be answered briefly, do so"""
+
+# Placeholder pose names: answers for these say nothing about a specific pose
+UNIDENTIFIED_POSES = ("pose name not identified", "analysis failed")
+
+class YogaChatHandler:
+    MAX_WORDS = 200
+
+    def __init__(self):
+        load_dotenv()
+        self.GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+        self.chat_providers = build_chat_providers(self.GROQ_API_KEY)
+        self.chat_policy = policy_from_env("YOGA_CHAT", timeout=20)
+        self.scheduler = scheduler
+        self.context_builder = ChatContextBuilder()
+        similarity = os.getenv("YOGA_CHAT_CACHE_SIMILARITY")
+        # Near-duplicate matching is opt-in; by default only the exact question hits
+        self.response_cache = ResponseCache(similarity_threshold=float(similarity) if similarity else None)
+        self.last_usage = None
+        self.usage_totals = {"calls": 0, "prompt_tokens": 0, "prompt_tokens_estimate": 0}
+        self._usage_lock = threading.Lock()
+        telemetry.register_collector("response_cache", self.response_cache.stats)
+        telemetry.register_collector("chat_usage", lambda: dict(self.usage_totals))
+
+    def warmup(self):
+        """Create the provider clients ahead of the first question"""
+        for provider in self.chat_providers:
+            provider.warmup()
+
+    def count_words(self, text):
+        """Count words in text"""
+        return len(text.split())
+
+    def summarize_analysis(self, analysis):
+        """Compact an analysis into the structured summary used as chat context"""
+        return self.context_builder.summarize(analysis)
+
+    def resolve_context(self, yoga_context):
+        """Return the summary for yoga_context, summarizing raw analysis text if needed"""
+        if isinstance(yoga_context, dict) and 'brief' in yoga_context:
+            return yoga_context
+        return self.summarize_analysis(yoga_context)
+
+    def build_messages(self, user_query, yoga_context, history=None, context=None):
+        """Build the chat messages for a question about the analyzed pose
+
+        yoga_context is a summary from summarize_analysis, or raw analysis
+        text which is summarized on the fly. Only the sections relevant to the
+        question are sent, plus as much recent history as fits the budget.
+        """
+        yoga_context = self.resolve_context(yoga_context)
+        if context is None:
+            context = self.context_builder.build_context(yoga_context, user_query)
+        # Prompts are unindented: leading whitespace is billed as prompt tokens too
+        system_message = {"role": "system", "content": SYSTEM_PROMPT}
+        user_message = {
+            "role": "user",
+            "content": (
+                f"Context:\n{context}\n\n"
+                f"Question: {user_query}\n\n"
+                "Remember to provide a focused response in 200 words or less."
+            )
+        }
+        return [system_message] + self.context_builder.trim_history(history) + [user_message]
+
+    def get_disclaimer(self, user_query):
+        """Return the safety disclaimer if the question is about practice or safety"""
+        if any(word in user_query.lower() for word in ['practice', 'safe', 'risk', 'hurt', 'pain', 'modify']):
+            return (
+                "\n\n---\n"
+                "*Note: Please practice with proper instruction and consult a qualified instructor for personalized guidance.*"
+            )
+        return ""
+
+    def create_completion(self, messages):
+        """Get (answer, prompt tokens) from the chat providers under the call policy"""
+        with span("chat_generate"):
+            return self.scheduler.run(
+                self.chat_policy, self.chat_providers,
+                lambda provider: provider.complete(messages, max_tokens=300, temperature=0.7, top_p=0.9)
+            )
+
+    def open_stream(self, messages):
+        """Start a streamed answer; yields (text delta, prompt tokens or None)"""
+        return self.scheduler.run(
+            self.chat_policy, self.chat_providers,
+            lambda provider: provider.stream(messages, max_tokens=300, temperature=0.7, top_p=0.9),
+            stream=True
+        )
+
+    def is_cacheable(self, pose_name, history):
+        """Answers can be shared only when they depend on nothing but the pose, sections and question
+
+        Follow-up questions depend on the conversation, and answers for an
+        unidentified pose are not about any particular pose.
+        """
+        pose = (pose_name or "").strip().lower()
+        return not history and bool(pose) and pose not in UNIDENTIFIED_POSES
+
+    def flight_key(self, pose_name, user_query, sections):
+        """In-flight requests with the same key as a cached answer would share it"""
+        return ('chat',) + self.response_cache.key(pose_name, user_query, sections)
+
+    def generate_response(self, messages, pose_name, user_query, sections=None):
+        """Ask the model and record usage; the raw answer is cached when sections are given"""
+        response, prompt_tokens = self.create_completion(messages)
+        self.record_usage(messages, prompt_tokens)
+        if sections is not None and response.strip():
+            self.response_cache.set(pose_name, user_query, response, sections)
+        return response
+
+    def record_usage(self, messages, prompt_tokens=None):
+        """Record the prompt size of a call: the local estimate and Groq's count if known"""
+        estimate = sum(estimate_tokens(message["content"]) for message in messages)
+        usage = {"prompt_tokens_estimate": estimate, "prompt_tokens": prompt_tokens}
+        with self._usage_lock:
+            self.last_usage = usage
+            self.usage_totals["calls"] += 1
+            self.usage_totals["prompt_tokens_estimate"] += estimate
+            self.usage_totals["prompt_tokens"] += prompt_tokens or estimate
+        telemetry.increment("chat_prompt_tokens_total", prompt_tokens or estimate)
+        return usage
+
+    def finalize_response(self, response, user_query):
+        """Apply the word limit and disclaimer to a raw model answer"""
+        with span("truncate"):
+            # Add disclaimer only if response is about practice or safety
+            disclaimer = self.get_disclaimer(user_query)
+            return self.truncate(response, self.MAX_WORDS - self.count_words(disclaimer)) + disclaimer
+
+    def truncate(self, response, word_budget):
+        """Cut response to word_budget words, ending at the last complete sentence if it was cut"""
+        capped = self.cap_words(response, word_budget)
+        if len(capped) == len(response):
+            return response
+        return capped.rsplit('.', 1)[0] + '.'
+
+    def get_response(self, user_query, yoga_context, history=None):
+        try:
+            with span("chat"):
+                yoga_context = self.resolve_context(yoga_context)
+                pose_name = yoga_context['pose_name']
+                context = self.context_builder.build_context(yoga_context, user_query)
+                sections = self.context_builder.context_sections(yoga_context, user_query)
+                if not self.is_cacheable(pose_name, history):
+                    messages = self.build_messages(user_query, yoga_context, history, context)
+                    return self.finalize_response(self.generate_response(messages, pose_name, user_query), user_query)
+
+                # Cached answers are stored raw so the disclaimer rule still follows this question
+                cached = self.response_cache.get(pose_name, user_query, sections)
+                if cached is not None:
+                    return self.finalize_response(cached, user_query)
+
+                messages = self.build_messages(user_query, yoga_context, history, context)
+                response = self.scheduler.coalesce(
+                    self.flight_key(pose_name, user_query, sections),
+                    lambda: self.generate_response(messages, pose_name, user_query, sections)
+                )
+                return self.finalize_response(response, user_query)
+
+        except Exception as e:
+            return f"Unable to generate response: {str(e)}"
+
+    def cap_words(self, text, word_budget):
+        """Cut text after its word_budget-th word, keeping the original spacing"""
+        words = list(re.finditer(r"\S+", text))
+        if len(words) <= word_budget:
+            return text
+        return text[:words[word_budget - 1].end()] if word_budget > 0 else ""
+
+    def stream_response(self, user_query, yoga_context, history=None):
+        """Yield the response text piece by piece as tokens arrive
+
+        Text is released a sentence at a time, so that an answer that runs
+        past the word limit ends at its last complete sentence, exactly as
+        finalize_response cuts it. The disclaimer is yielded last.
+        """
+        try:
+            disclaimer = self.get_disclaimer(user_query)
+            word_budget = self.MAX_WORDS - self.count_words(disclaimer)
+            yoga_context = self.resolve_context(yoga_context)
+            pose_name = yoga_context['pose_name']
+            context = self.context_builder.build_context(yoga_context, user_query)
+            sections = self.context_builder.context_sections(yoga_context, user_query)
+            cacheable = self.is_cacheable(pose_name, history)
+
+            cached = self.response_cache.get(pose_name, user_query, sections) if cacheable else None
+            if cached is not None:
+                yield self.truncate(cached, word_budget)
+                if disclaimer:
+                    yield disclaimer
+                return
+
+            if cacheable:
+                in_flight = self.scheduler.flight(self.flight_key(pose_name, user_query, sections))
+            else:
+                in_flight = nullcontext((None, True))
+            with in_flight as (flight, leader):
+                if not leader:
+                    # The same question is already being answered: wait for it
+                    shared = self.scheduler.shared_result(flight)
+                    if shared is not None:
+                        yield self.truncate(shared, word_budget)
+                        if disclaimer:
+                            yield disclaimer
+                        return
+
+                messages = self.build_messages(user_query, yoga_context, history, context)
+                start = time.perf_counter()
+                stream = self.open_stream(messages)
+
+                emitted = ""
+                text = ""
+                prompt_tokens = None
+                try:
+                    for delta, chunk_prompt_tokens in stream:
+                        if chunk_prompt_tokens is not None:
+                            prompt_tokens = chunk_prompt_tokens
+                        if not delta:
+                            continue
+                        if not text:
+                            telemetry.record_duration("chat_first_token", time.perf_counter() - start)
+                        text += delta
+                        if self.count_words(text) > word_budget:
+                            # Over the limit: stop generating and end at the last full sentence
+                            text = self.truncate(text, word_budget)
+                            break
+                        # Hold back the unfinished sentence in case the answer gets cut inside it
+                        sentence_end = text.rfind('.') + 1
+                        if sentence_end > len(emitted):
+                            yield text[len(emitted):sentence_end]
+                            emitted = text[:sentence_end]
+                finally:
+                    stream.close()
+                if len(text) > len(emitted):
+                    yield text[len(emitted):]
+
+                telemetry.record_duration("chat_stream", time.perf_counter() - start)
+                self.record_usage(messages, prompt_tokens)
+                if cacheable and text.strip():
+                    self.response_cache.set(pose_name, user_query, text, sections)
+                    if leader:
+                        flight.set_result(text)
+            if disclaimer:
+                yield disclaimer
+
+        except Exception as e:
+            telemetry.record_error("chat_stream", e)
+            yield f"Unable to generate response: {str(e)}"
\ No newline at end of file
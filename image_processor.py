@@ -1,51 +1,287 @@
-import numpy as np
-import PIL.Image
-import os
-import requests
-import io
-
-class ImageProcessor:
-    def __init__(self):
-        self.temp_dir = "temp"
-        os.makedirs(self.temp_dir, exist_ok=True)
-
-    def save_uploaded_file(self, uploaded_file):
-        """Save uploaded file and return path"""
-        image_path = os.path.join(self.temp_dir, "temp_uploaded_image.png")
-        with open(image_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        return image_path
-
-    def download_image(self, image_url):
-        """Download image from URL and return path"""
-        try:
-            response = requests.get(image_url)
-            if response.status_code == 200:
-                image_path = os.path.join(self.temp_dir, "temp_url_image.png")
-                img = PIL.Image.open(io.BytesIO(response.content))
-                img.save(image_path)
-                return image_path
-        except Exception as e:
-            print(f"Error downloading image: {e}")
-            return None
-
-    def preprocess_image(self, image_path):
-        """Preprocess image for model input"""
-        try:
-            img = PIL.Image.open(image_path)
-            img_resized = img.resize((224, 224))
-            img_array = np.array(img_resized)
-            img_normalized = img_array / 255.0
-            img_input = np.expand_dims(img_normalized, axis=0)
-            return img_input
-        except Exception as e:
-            print(f"Error preprocessing image: {e}")
-            return None
-
-    def cleanup(self):
-        """Clean up temporary files"""
-        for file in os.listdir(self.temp_dir):
-            try:
-                os.remove(os.path.join(self.temp_dir, file))
-            except Exception as e:
-                print(f"Error cleaning up file {file}: {e}")
\ No newline at end of file
+import numpy as np
+import PIL.Image
+import PIL.ImageOps
+import os
+import requests
+import io
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from telemetry import span, telemetry
+
+class ImageProcessor:
+    def __init__(self, timeout=(5, 15), max_download_bytes=20 * 1024 * 1024,
+                 pool_size=16, session=None, temp_max_age=3600,
+                 temp_max_bytes=200 * 1024 * 1024, temp_min_age=60, temp_cleanup_interval=60,
+                 normalize_max_side=1024, normalize_format="JPEG", normalize_quality=85):
+        self.temp_dir = "temp"
+        os.makedirs(self.temp_dir, exist_ok=True)
+        # Bounds for spilled temp files, enforced by cleanup(). Files younger
+        # than temp_min_age may still be in use and are never evicted for size.
+        self.temp_max_age = temp_max_age
+        self.temp_max_bytes = temp_max_bytes
+        self.temp_min_age = temp_min_age
+        self.temp_cleanup_interval = temp_cleanup_interval
+        self._last_cleanup = None
+        self._written_since_cleanup = 0
+        self._cleanup_lock = threading.Lock()
+        # (connect, read) timeout in seconds; the read value also bounds the whole body
+        self.timeout = timeout
+        self.max_download_bytes = max_download_bytes
+        self.pool_size = pool_size
+        self.session = session or self.create_session(pool_size)
+        # Size and encoding used for images sent to the vision model
+        self.normalize_max_side = normalize_max_side
+        self.normalize_format = normalize_format
+        self.normalize_quality = normalize_quality
+        self.normalization_totals = {"images": 0, "original_bytes": 0, "normalized_bytes": 0, "seconds": 0.0}
+        self._totals_lock = threading.Lock()
+        telemetry.register_collector("image_normalization", self.normalization_stats)
+
+    def create_session(self, pool_size):
+        """Create an HTTP session with a shared, bounded connection pool"""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def load_image(self, image):
+        """Open an image from a path, raw bytes, a file-like buffer or a PIL image"""
+        if isinstance(image, PIL.Image.Image):
+            return image
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            return PIL.Image.open(io.BytesIO(image))
+        if hasattr(image, "read") and hasattr(image, "seek"):
+            image.seek(0)
+        return PIL.Image.open(image)
+
+    def write_temp_file(self, data, prefix, suffix=".png"):
+        """Write bytes to a unique temp file and return its path"""
+        fd, image_path = tempfile.mkstemp(prefix=prefix, suffix=suffix, dir=self.temp_dir)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        self.maybe_cleanup(len(data))
+        return image_path
+
+    def maybe_cleanup(self, written=0):
+        """Run cleanup() every temp_cleanup_interval seconds, or sooner after a tenth of temp_max_bytes was written"""
+        now = time.monotonic()
+        with self._cleanup_lock:
+            self._written_since_cleanup += written
+            due = (self._last_cleanup is None
+                   or now - self._last_cleanup >= self.temp_cleanup_interval
+                   or self._written_since_cleanup > self.temp_max_bytes / 10)
+            if not due:
+                return
+            self._last_cleanup = now
+            self._written_since_cleanup = 0
+        self.cleanup()
+
+    def save_uploaded_file(self, uploaded_file):
+        """Save uploaded file to a unique temp path and return the path"""
+        suffix = os.path.splitext(getattr(uploaded_file, "name", ""))[1] or ".png"
+        with span("upload_save"):
+            return self.write_temp_file(uploaded_file.getbuffer(), "upload_", suffix)
+
+    def fetch_image_bytes(self, image_url):
+        """Stream an image body into memory, enforcing the timeout and size limit"""
+        connect_timeout, read_timeout = self.timeout
+        deadline = time.monotonic() + connect_timeout + read_timeout
+        with span("download"), self.session.get(image_url, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+            # Refuse error pages and other non-images before reading the body
+            if content_type and not content_type.startswith("image/") and content_type != "application/octet-stream":
+                raise ValueError(f"URL returned {content_type}, not an image")
+            declared_size = int(response.headers.get("Content-Length") or 0)
+            if declared_size > self.max_download_bytes:
+                raise ValueError(f"Image is larger than {self.max_download_bytes} bytes")
+
+            body = bytearray()
+            for chunk in self._iter_body(response):
+                body.extend(chunk)
+                if len(body) > self.max_download_bytes:
+                    raise ValueError(f"Image is larger than {self.max_download_bytes} bytes")
+                # Per-read timeouts alone let a slow host trickle data forever
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Download took longer than {connect_timeout + read_timeout}s")
+        telemetry.increment("download_bytes_total", len(body))
+
+        # Check the body is a readable image without decoding every pixel
+        with span("verify"):
+            PIL.Image.open(io.BytesIO(body)).verify()
+        return bytes(body)
+
+    def _iter_body(self, response, chunk_size=64 * 1024):
+        """Yield body chunks as soon as any data arrives"""
+        if not hasattr(response.raw, "read1"):
+            # urllib3 < 2 has no read1; fall back to fixed-size reads
+            yield from response.iter_content(chunk_size=chunk_size)
+            return
+        while True:
+            chunk = response.raw.read1(chunk_size, decode_content=True)
+            if not chunk:
+                return
+            yield chunk
+
+    def download_image_bytes(self, image_url):
+        """Download image from URL and return its bytes without touching disk"""
+        try:
+            return self.fetch_image_bytes(image_url)
+        except Exception as e:
+            print(f"Error downloading image {image_url}: {e}")
+            return None
+
+    def download_image(self, image_url):
+        """Download image from URL to a unique temp path and return the path"""
+        image_bytes = self.download_image_bytes(image_url)
+        if image_bytes is None:
+            return None
+        try:
+            image_format = PIL.Image.open(io.BytesIO(image_bytes)).format or "png"
+            # Keep the original encoding instead of decoding and re-encoding as PNG
+            return self.write_temp_file(image_bytes, "url_", f".{image_format.lower()}")
+        except Exception as e:
+            print(f"Error saving downloaded image: {e}")
+            telemetry.record_error("download_save", e)
+            return None
+
+    def download_many(self, image_urls, max_workers=None):
+        """Download several images concurrently over the shared connection pool
+
+        Returns the image bytes for each URL in input order, or None for URLs
+        that failed.
+        """
+        with ThreadPoolExecutor(max_workers=max_workers or self.pool_size) as executor:
+            return list(executor.map(self.download_image_bytes, image_urls))
+
+    def orient_and_downscale(self, img, max_side):
+        """Apply EXIF orientation and shrink so the longest side is at most max_side"""
+        if img.format == "JPEG":
+            # Let the JPEG decoder skip detail we are about to throw away
+            img.draft("RGB", (max_side, max_side))
+        img = PIL.ImageOps.exif_transpose(img)
+        if max(img.size) > max_side:
+            img.thumbnail((max_side, max_side), PIL.Image.Resampling.LANCZOS)
+        return img
+
+    def source_size(self, image):
+        """Best-effort encoded size in bytes of an image source, or None"""
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            return len(image)
+        if isinstance(image, (str, os.PathLike)):
+            return os.path.getsize(image)
+        if hasattr(image, "getbuffer"):
+            return image.getbuffer().nbytes
+        return None
+
+    def normalize_image(self, image, max_side=None, image_format=None, quality=None):
+        """Orient, downscale and re-encode an image compactly for model calls
+
+        Returns (blob, stats) where blob is {'mime_type': ..., 'data': ...},
+        the inline image format the Gemini SDK accepts, and stats reports the
+        byte savings and time spent.
+        """
+        start = time.perf_counter()
+        max_side = max_side or self.normalize_max_side
+        image_format = (image_format or self.normalize_format).upper()
+        quality = quality or self.normalize_quality
+
+        original_bytes = self.source_size(image)
+        with span("decode"):
+            img = self.load_image(image)
+            original_size = img.size
+            img = self.orient_and_downscale(img, max_side)
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+
+        with span("encode", format=image_format):
+            buffer = io.BytesIO()
+            img.save(buffer, format=image_format, quality=quality, optimize=True)
+            data = buffer.getvalue()
+        telemetry.increment("normalized_bytes_total", len(data))
+        telemetry.increment("normalize_original_bytes_total", original_bytes or len(data))
+
+        stats = {
+            "original_bytes": original_bytes,
+            "normalized_bytes": len(data),
+            "saved_bytes": original_bytes - len(data) if original_bytes is not None else None,
+            "original_size": original_size,
+            "normalized_size": img.size,
+            "seconds": time.perf_counter() - start,
+        }
+        with self._totals_lock:
+            self.normalization_totals["images"] += 1
+            self.normalization_totals["original_bytes"] += original_bytes or len(data)
+            self.normalization_totals["normalized_bytes"] += len(data)
+            self.normalization_totals["seconds"] += stats["seconds"]
+        telemetry.record_duration("normalize", stats["seconds"], format=image_format)
+        return {"mime_type": PIL.Image.MIME[image_format], "data": data}, stats
+
+    def normalization_stats(self):
+        """Totals over every normalize_image call, with the bytes saved"""
+        with self._totals_lock:
+            totals = dict(self.normalization_totals)
+        totals["saved_bytes"] = totals["original_bytes"] - totals["normalized_bytes"]
+        totals["saved_ratio"] = totals["saved_bytes"] / totals["original_bytes"] if totals["original_bytes"] else 0.0
+        return totals
+
+    def preprocess_image(self, image_path):
+        """Preprocess image for model input"""
+        return self.preprocess_images([image_path])
+
+    def preprocess_images(self, images, target_size=(224, 224)):
+        """Preprocess a batch of images or uint8 RGB arrays into one model input array"""
+        try:
+            with span("preprocess", batch_size=len(images)):
+                batch = np.empty((len(images), target_size[1], target_size[0], 3), dtype=np.uint8)
+                for i, image in enumerate(images):
+                    if isinstance(image, np.ndarray):
+                        img = PIL.Image.fromarray(image)
+                    else:
+                        img = self.orient_and_downscale(self.load_image(image), max(target_size))
+                    batch[i] = np.asarray(img.convert("RGB").resize(target_size))
+                # Normalize the whole batch in a single vectorized pass
+                return batch.astype(np.float32) / 255.0
+        except Exception as e:
+            print(f"Error preprocessing image: {e}")
+            return None
+
+    def cleanup(self, max_age=None, max_total_bytes=None):
+        """Remove temp files older than max_age, then the oldest until under max_total_bytes
+
+        Files younger than temp_min_age are kept even over max_total_bytes,
+        since another request may have just written one to hand to the SDK.
+        """
+        max_age = self.temp_max_age if max_age is None else max_age
+        max_total_bytes = self.temp_max_bytes if max_total_bytes is None else max_total_bytes
+        now = time.time()
+        files = []
+        for file in os.listdir(self.temp_dir):
+            path = os.path.join(self.temp_dir, file)
+            try:
+                stat = os.stat(path)
+                if now - stat.st_mtime > max_age:
+                    os.remove(path)
+                else:
+                    files.append((stat.st_mtime, stat.st_size, path))
+            except FileNotFoundError:
+                # Removed concurrently by another session
+                continue
+            except Exception as e:
+                print(f"Error cleaning up file {file}: {e}")
+
+        total_bytes = sum(size for _, size, _ in files)
+        for mtime, size, path in sorted(files):
+            if total_bytes <= max_total_bytes or now - mtime < self.temp_min_age:
+                break
+            try:
+                os.remove(path)
+                total_bytes -= size
+            except FileNotFoundError:
+                total_bytes -= size
+            except Exception as e:
+                print(f"Error cleaning up file {path}: {e}")
\ No newline at end of file
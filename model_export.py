@@ -0,0 +1,268 @@
+"""Export the pose classifier as an inference-only SavedModel or TFLite model.
+
+Usage:
+    python model_export.py [--model yoga_pose_model.h5] [--saved-model DIR]
+                           [--tflite yoga_pose_model.tflite] [--quantize {none,float16,int8}]
+                           [--calibration-images DIR_OR_MANIFEST]
+
+The exported graph drops Dropout and folds each head BatchNormalization into
+the Dense layer after it, so inference is three matrix multiplies on top of
+MobileNetV2. The TFLite converter folds the convolution BatchNorms inside
+MobileNetV2 itself. int8 quantization is calibrated on sample images.
+Inputs and outputs stay float32, so the quantized model is a drop-in
+replacement for the Keras one. The sha256 of the source model and labels.json
+is written next to the export (yoga_pose_model.tflite.json), and the app
+only serves an export whose digests match the installed files.
+
+TFLiteClassifier runs the exported file on CPU. It uses the standalone
+tflite_runtime (or ai_edge_litert) interpreter when one is installed, which
+avoids loading the full TensorFlow, and otherwise falls back to tf.lite.
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+from model_generation import LABELS_PATH, MODEL_PATH
+
+TFLITE_PATH = 'yoga_pose_model.tflite'
+
+
+def fold_batchnorm(batchnorm, dense):
+    """Return (kernel, bias) of a Dense layer with the BatchNorm before it folded in
+
+    BatchNorm at inference is y = scale * x + shift per feature, so
+    dense(batchnorm(x)) = (scale[:, None] * kernel) x + (shift @ kernel + bias).
+    """
+    gamma, beta, mean, variance = [np.asarray(w, dtype=np.float64) for w in batchnorm.get_weights()]
+    scale = gamma / np.sqrt(variance + batchnorm.epsilon)
+    shift = beta - mean * scale
+    kernel, bias = [np.asarray(w, dtype=np.float64) for w in dense.get_weights()]
+    return (scale[:, None] * kernel).astype(np.float32), (shift @ kernel + bias).astype(np.float32)
+
+
+def build_inference_model(model):
+    """Rebuild the classifier without Dropout and with the head BatchNorms folded"""
+    import tensorflow as tf
+
+    layers = [layer for layer in model.layers if not isinstance(layer, tf.keras.layers.Dropout)]
+    inputs = tf.keras.Input(shape=model.input_shape[1:])
+    x = inputs
+    pending_batchnorm = None
+    for layer in layers:
+        if isinstance(layer, tf.keras.layers.BatchNormalization):
+            if pending_batchnorm is not None:
+                raise ValueError("Cannot fold two consecutive BatchNormalization layers")
+            pending_batchnorm = layer
+            continue
+        if pending_batchnorm is None:
+            x = layer(x, training=False)
+            continue
+        if not isinstance(layer, tf.keras.layers.Dense):
+            raise ValueError(f"Cannot fold BatchNormalization into {layer.__class__.__name__}")
+        folded = tf.keras.layers.Dense(layer.units, activation=layer.activation, name=f"{layer.name}_folded")
+        x = folded(x)
+        folded.set_weights(fold_batchnorm(pending_batchnorm, layer))
+        pending_batchnorm = None
+    if pending_batchnorm is not None:
+        # A trailing BatchNorm has nothing to fold into; keep it
+        x = pending_batchnorm(x, training=False)
+    return tf.keras.Model(inputs, x, name=f"{model.name}_inference")
+
+
+def load_calibration_batches(source, limit=100, target_size=(224, 224)):
+    """Preprocessed single-image batches from an image directory or manifest"""
+    from image_processor import ImageProcessor
+    from yoga_batch import list_images
+
+    processor = ImageProcessor()
+    batches = []
+    for path in list_images(source)[:limit]:
+        batch = processor.preprocess_images([path], target_size)
+        if batch is not None:
+            batches.append(batch)
+    if not batches:
+        raise ValueError(f"No readable calibration images in {source}")
+    return batches
+
+
+def export_saved_model(model, export_dir):
+    """Write an inference-only SavedModel"""
+    import tensorflow as tf
+
+    if hasattr(model, 'export'):
+        model.export(export_dir)
+    else:
+        tf.saved_model.save(model, export_dir)
+    return export_dir
+
+
+def export_tflite(model, output_path=TFLITE_PATH, quantize=None, calibration_batches=None):
+    """Convert the model to TFLite, optionally with float16 or int8 weights
+
+    int8 quantizes weights and activations, using calibration_batches to
+    choose the activation ranges. Those should be real pose photos; random
+    inputs give ranges that do not match real images.
+    """
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantize == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantize == 'int8':
+        if not calibration_batches:
+            raise ValueError("int8 quantization needs calibration images")
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([batch] for batch in calibration_batches)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    elif quantize:
+        raise ValueError(f"Unknown quantization: {quantize}")
+
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+    return output_path
+
+
+def file_digest(path):
+    """sha256 of a file's contents, or None if it does not exist"""
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def export_metadata_path(export_path):
+    return export_path + '.json'
+
+
+def write_export_metadata(export_path, model_path=MODEL_PATH, labels_path=LABELS_PATH):
+    """Record which model and label map export_path was exported from"""
+    with open(export_metadata_path(export_path), 'w', encoding='utf-8') as f:
+        json.dump({
+            'model_sha256': file_digest(model_path),
+            'labels_sha256': file_digest(labels_path),
+        }, f, indent=2)
+
+
+def is_current_export(export_path, model_path=MODEL_PATH, labels_path=LABELS_PATH):
+    """True if export_path was exported from the model and label map installed now
+
+    Compares content digests recorded by write_export_metadata, since file
+    times do not survive git checkouts or image builds. A missing model file
+    is not compared, so a deployment can ship only the export and its labels.
+    """
+    try:
+        with open(export_metadata_path(export_path), 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if os.path.exists(model_path) and file_digest(model_path) != metadata.get('model_sha256'):
+        return False
+    return file_digest(labels_path) == metadata.get('labels_sha256')
+
+
+def load_interpreter_class():
+    """The lightest available TFLite interpreter class"""
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class TFLiteClassifier:
+    """CPU runtime for an exported TFLite classifier
+
+    Exposes predict_on_batch like a Keras model, so classify_batch works
+    with either. The interpreter is not thread-safe, so calls are serialized.
+    """
+
+    def __init__(self, model_path=TFLITE_PATH, num_threads=None):
+        self.model_path = model_path
+        self.num_threads = num_threads or os.cpu_count() or 1
+        self.interpreter = load_interpreter_class()(model_path=model_path, num_threads=self.num_threads)
+        self.interpreter.allocate_tensors()
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_detail = self.interpreter.get_output_details()[0]
+        # Same attribute as a Keras model, for the label map check
+        self.output_shape = tuple(int(d) for d in self.output_detail['shape'])
+        self._batch_size = int(self.input_detail['shape'][0])
+        self._lock = threading.Lock()
+
+    def predict_on_batch(self, batch):
+        batch = np.asarray(batch, dtype=self.input_detail['dtype'])
+        with self._lock:
+            if batch.shape[0] != self._batch_size:
+                self.interpreter.resize_tensor_input(self.input_detail['index'], batch.shape)
+                self.interpreter.allocate_tensors()
+                self._batch_size = batch.shape[0]
+            self.interpreter.set_tensor(self.input_detail['index'], batch)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self.output_detail['index']).copy()
+
+
+def compare_predictions(reference, candidate, batches):
+    """Return (top-1 agreement, max absolute probability difference) over batches"""
+    agree, total, max_diff = 0, 0, 0.0
+    for batch in batches:
+        expected = np.asarray(reference.predict_on_batch(batch))
+        actual = np.asarray(candidate.predict_on_batch(batch))
+        agree += int(np.sum(expected.argmax(axis=1) == actual.argmax(axis=1)))
+        total += len(batch)
+        max_diff = max(max_diff, float(np.max(np.abs(expected - actual))))
+    return agree / total, max_diff
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='yoga-export', description="Export the pose classifier for inference")
+    parser.add_argument('--model', default=MODEL_PATH, help="Trained Keras model to export")
+    parser.add_argument('--saved-model', help="Also write an inference-only SavedModel to this directory")
+    parser.add_argument('--tflite', default=TFLITE_PATH, help="TFLite output path")
+    parser.add_argument('--quantize', choices=('none', 'float16', 'int8'), default='none')
+    parser.add_argument('--calibration-images', help="Image directory or manifest used for int8 calibration")
+    parser.add_argument('--calibration-count', type=int, default=100, help="Calibration images to use")
+    args = parser.parse_args(argv)
+
+    import tensorflow as tf
+
+    model = tf.keras.models.load_model(args.model)
+    inference_model = build_inference_model(model)
+
+    calibration_batches = None
+    if args.calibration_images:
+        calibration_batches = load_calibration_batches(args.calibration_images, args.calibration_count)
+    elif args.quantize == 'int8':
+        parser.error("--quantize int8 needs --calibration-images")
+
+    check_batches = calibration_batches or [
+        np.random.default_rng(0).random((1,) + tuple(model.input_shape[1:]), dtype=np.float32) for _ in range(8)
+    ]
+    agreement, max_diff = compare_predictions(model, inference_model, check_batches)
+    print(f"Folded model: top-1 agreement {agreement:.1%}, max probability difference {max_diff:.2e}")
+
+    if args.saved_model:
+        export_saved_model(inference_model, args.saved_model)
+        print(f"Wrote SavedModel to {args.saved_model}")
+
+    quantize = None if args.quantize == 'none' else args.quantize
+    export_tflite(inference_model, args.tflite, quantize, calibration_batches)
+    write_export_metadata(args.tflite, args.model)
+    agreement, max_diff = compare_predictions(model, TFLiteClassifier(args.tflite), check_batches)
+    size_mb = os.path.getsize(args.tflite) / (1024 * 1024)
+    print(f"Wrote {args.tflite} ({size_mb:.1f} MB, {args.quantize}): "
+          f"top-1 agreement {agreement:.1%}, max probability difference {max_diff:.2e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,67 +1,104 @@
-import tensorflow as tf
-from tensorflow import keras
-
-
-def create_default_model(img_shape=(224, 224, 3), num_classes=10):
-    """
-    Create default yoga pose classification model using transfer learning
-    
-    Args:
-        img_shape (tuple): Shape of input images
-        num_classes (int): Number of yoga pose classes to predict
-    
-    Returns:
-        model: Compiled tensorflow model
-    """
-    # Use MobileNetV2 as base model for transfer learning
-    base_model = tf.keras.applications.MobileNetV2(
-        input_shape=img_shape,
-        include_top=False,
-        weights='imagenet'
-    )
-    
-    # Freeze the base model layers
-    base_model.trainable = False
-    
-    model = tf.keras.Sequential([
-        # Base model
-        base_model,
-        
-        # Global average pooling
-        tf.keras.layers.GlobalAveragePooling2D(),
-        
-        # Dense layers for pose classification
-        tf.keras.layers.Dense(512, activation='relu'),
-        tf.keras.layers.BatchNormalization(),
-        tf.keras.layers.Dropout(0.3),
-        
-        tf.keras.layers.Dense(256, activation='relu'),
-        tf.keras.layers.BatchNormalization(),
-        tf.keras.layers.Dropout(0.3),
-        
-        # Output layer for pose classification
-        tf.keras.layers.Dense(num_classes, activation='softmax')
-    ])
-    
-    # Compile model
-    model.compile(
-        optimizer=tf.keras.optimizers.Adam(learning_rate=0.001),
-        loss='categorical_crossentropy',
-        metrics=['accuracy']
-    )
-    
-    return model
-
-def save_default_model():
-    """
-    Create and save default yoga pose classification model
-    """
-    model = create_default_model()
-    
-    # Save model
-    model.save('yoga_pose_model.h5')
-    print("Default yoga pose classification model created and saved successfully!")
-
-# Allow direct execution to create model
-if __name__ == "__main__":
+import json
+import os
+
+# Class labels in the order of the classifier's output units
+POSE_LABELS = [
+    "Downward Dog",
+    "Tree Pose",
+    "Warrior I",
+    "Warrior II",
+    "Triangle Pose",
+    "Cobra Pose",
+    "Child's Pose",
+    "Plank Pose",
+    "Chair Pose",
+    "Bridge Pose",
+]
+
+# Where the app loads the trained classifier from
+MODEL_PATH = 'yoga_pose_model.h5'
+
+# Label map written next to a trained model by train_model.py
+LABELS_PATH = 'labels.json'
+
+def load_pose_labels(path=LABELS_PATH):
+    """
+    Load the class labels of the trained classifier
+    
+    Args:
+        path (str): Label map written by train_model.py
+    
+    Returns:
+        list: Labels in output unit order, or POSE_LABELS if there is no label map
+    """
+    if not path or not os.path.exists(path):
+        return list(POSE_LABELS)
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)['labels']
+
+def create_default_model(img_shape=(224, 224, 3), num_classes=len(POSE_LABELS)):
+    """
+    Create default yoga pose classification model using transfer learning
+    
+    Args:
+        img_shape (tuple): Shape of input images
+        num_classes (int): Number of yoga pose classes to predict
+    
+    Returns:
+        model: Compiled tensorflow model
+    """
+    # Imported here so importing POSE_LABELS does not load TensorFlow
+    import tensorflow as tf
+
+    # Use MobileNetV2 as base model for transfer learning
+    base_model = tf.keras.applications.MobileNetV2(
+        input_shape=img_shape,
+        include_top=False,
+        weights='imagenet'
+    )
+    
+    # Freeze the base model layers
+    base_model.trainable = False
+    
+    model = tf.keras.Sequential([
+        # Base model
+        base_model,
+        
+        # Global average pooling
+        tf.keras.layers.GlobalAveragePooling2D(),
+        
+        # Dense layers for pose classification
+        tf.keras.layers.Dense(512, activation='relu'),
+        tf.keras.layers.BatchNormalization(),
+        tf.keras.layers.Dropout(0.3),
+        
+        tf.keras.layers.Dense(256, activation='relu'),
+        tf.keras.layers.BatchNormalization(),
+        tf.keras.layers.Dropout(0.3),
+        
+        # Output layer for pose classification
+        tf.keras.layers.Dense(num_classes, activation='softmax')
+    ])
+    
+    # Compile model
+    model.compile(
+        optimizer=tf.keras.optimizers.Adam(learning_rate=0.001),
+        loss='categorical_crossentropy',
+        metrics=['accuracy']
+    )
+    
+    return model
+
+def save_default_model():
+    """
+    Create and save default yoga pose classification model
+    """
+    model = create_default_model()
+    
+    # Save model
+    model.save(MODEL_PATH)
+    print("Default yoga pose classification model created and saved successfully!")
+
+# Allow direct execution to create model
+if __name__ == "__main__":
     save_default_model()
\ No newline at end of file
@@ -0,0 +1,290 @@
+"""Nearest-neighbor pose lookup against a reference library.
+
+Usage:
+    python pose_index.py build REFERENCE_DIR [--index-dir cache/pose_index]
+    python pose_index.py add REFERENCE_DIR [--index-dir cache/pose_index]
+    python pose_index.py search IMAGE [--top-k 5]
+
+REFERENCE_DIR has the same layout as training data: one subdirectory of
+images per pose label. A guidance.md file in a pose's subdirectory is stored
+as that pose's reference guidance, to be reused instead of generating
+new prose.
+
+Embeddings are the MobileNetV2 pooled features (the classifier's
+GlobalAveragePooling2D output), L2-normalized, so cosine similarity is a
+dot product. They live in one .npy file that is memory-mapped read-only.
+Opening the index is instant, and worker processes share the pages through
+the OS cache instead of each holding a copy.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+INDEX_DIR = os.path.join('cache', 'pose_index')
+EMBEDDING_DIM = 1280
+
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class PoseIndex:
+    """Memory-mapped cosine index of reference pose embeddings
+
+    embeddings.npy is preallocated with spare rows. add() writes into the
+    spare rows and then atomically rewrites entries.json. Readers only use
+    as many rows as entries.json lists, so they never see a half-written row.
+    Capacity doubles when it runs out. Readers notice additions from other
+    processes by the entries.json mtime. Writers take a lock file in the
+    index directory, so processes adding at the same time append in turn.
+    """
+
+    def __init__(self, index_dir=INDEX_DIR, dim=EMBEDDING_DIM, search_chunk=65536):
+        self.index_dir = index_dir
+        self.dim = dim
+        self.search_chunk = search_chunk
+        self.embeddings_path = os.path.join(index_dir, 'embeddings.npy')
+        self.entries_path = os.path.join(index_dir, 'entries.json')
+        self.lock_path = os.path.join(index_dir, '.lock')
+        self.entries = []
+        self.guidance = {}
+        self._embeddings = None
+        self._loaded_mtime = None
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def refresh(self, force=False):
+        """Reload the entry list and remap the embeddings if another process added rows"""
+        try:
+            mtime = os.stat(self.entries_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if mtime == self._loaded_mtime and not force:
+                return
+            with open(self.entries_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            self.dim = meta['dim']
+            self.entries = meta['entries']
+            self.guidance = meta.get('guidance', {})
+            self._embeddings = np.load(self.embeddings_path, mmap_mode='r')
+            self._loaded_mtime = mtime
+
+    @contextmanager
+    def _write_lock(self):
+        """Hold the index lock file exclusively, across threads and processes"""
+        os.makedirs(self.index_dir, exist_ok=True)
+        with open(self.lock_path, 'a+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        time.sleep(0.05)
+            try:
+                # Re-read under the lock: coarse mtimes can hide another writer's update
+                self.refresh(force=True)
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _write_entries(self):
+        os.makedirs(self.index_dir, exist_ok=True)
+        tmp_path = self.entries_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'dim': self.dim, 'entries': self.entries, 'guidance': self.guidance}, f)
+        os.replace(tmp_path, self.entries_path)
+        self._loaded_mtime = os.stat(self.entries_path).st_mtime_ns
+
+    def _ensure_capacity(self, rows):
+        """Return a writable memmap with room for rows entries, growing the file if needed"""
+        from numpy.lib.format import open_memmap
+
+        os.makedirs(self.index_dir, exist_ok=True)
+        if os.path.exists(self.embeddings_path):
+            current = open_memmap(self.embeddings_path, mode='r+')
+            if current.shape[0] >= rows:
+                return current
+            capacity = max(rows, current.shape[0] * 2)
+        else:
+            current = None
+            capacity = max(rows, 1024)
+
+        tmp_path = self.embeddings_path + '.tmp.npy'
+        grown = open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(capacity, self.dim))
+        if current is not None:
+            grown[:len(self.entries)] = current[:len(self.entries)]
+        grown.flush()
+        del grown, current
+        os.replace(tmp_path, self.embeddings_path)
+        return open_memmap(self.embeddings_path, mode='r+')
+
+    def add(self, embeddings, entries):
+        """Append embeddings with one metadata dict (at least a 'pose') per row"""
+        embeddings = normalize_rows(embeddings)
+        if embeddings.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dimensional embeddings, got {embeddings.shape[1]}")
+        if len(embeddings) != len(entries):
+            raise ValueError("Need one entry per embedding")
+        with self._write_lock(), self._lock:
+            # Drop our read-only map first; Windows cannot replace a mapped file
+            self._embeddings = None
+            start = len(self.entries)
+            writable = self._ensure_capacity(start + len(embeddings))
+            writable[start:start + len(embeddings)] = embeddings
+            writable.flush()
+            del writable
+            self.entries = self.entries + list(entries)
+            self._write_entries()
+            self._embeddings = np.load(self.embeddings_path, mmap_mode='r')
+        return start
+
+    def set_guidance(self, pose, guidance):
+        """Store reusable reference guidance text for a pose"""
+        with self._write_lock(), self._lock:
+            self.guidance = dict(self.guidance)
+            self.guidance[pose] = guidance
+            self._write_entries()
+
+    def search(self, queries, top_k=5):
+        """Top-k cosine matches for each query embedding
+
+        Returns one list of (entry, similarity) pairs per query, best first.
+        Rows are scored in chunks, so memory stays bounded however large
+        the mapped index is.
+        """
+        self.refresh()
+        queries = normalize_rows(queries)
+        with self._lock:
+            count, embeddings, entries = len(self.entries), self._embeddings, self.entries
+        if count == 0:
+            return [[] for _ in queries]
+        top_k = min(top_k, count)
+
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, count, self.search_chunk):
+            scores = queries @ embeddings[start:min(count, start + self.search_chunk)].T
+            k = min(top_k, scores.shape[1])
+            rows = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, rows, axis=1)], axis=1)
+            best_rows = np.concatenate([best_rows, rows + start], axis=1)
+            if best_scores.shape[1] > top_k:
+                keep = np.argpartition(-best_scores, top_k - 1, axis=1)[:, :top_k]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+
+        order = np.argsort(-best_scores, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        return [
+            [(entries[row], float(score)) for row, score in zip(rows, scores)]
+            for rows, scores in zip(best_rows, best_scores)
+        ]
+
+    def vote(self, matches):
+        """Pick the pose with the highest summed similarity among the matches"""
+        totals = {}
+        for entry, score in matches:
+            totals[entry['pose']] = totals.get(entry['pose'], 0.0) + score
+        if not totals:
+            return None, 0.0
+        pose = max(totals, key=totals.get)
+        best = max(score for entry, score in matches if entry['pose'] == pose)
+        return pose, best
+
+
+def add_reference_dir(index, yoga_analysis, reference_dir, batch_size=32):
+    """Embed and index a reference directory; images already indexed are skipped"""
+    from train_model import list_labeled_images
+
+    labels, samples = list_labeled_images(reference_dir)
+    indexed = {entry.get('source') for entry in index.entries}
+    pending = [(path, labels[label]) for path, label in samples if os.path.abspath(path) not in indexed]
+    added = 0
+    for start in range(0, len(pending), batch_size):
+        chunk = pending[start:start + batch_size]
+        try:
+            embeddings = yoga_analysis.embed_batch([path for path, _ in chunk])
+        except ValueError:
+            # One unreadable image fails the whole batch; embed one by one to skip it
+            readable, rows = [], []
+            for path, pose in chunk:
+                try:
+                    rows.append(yoga_analysis.embed_batch([path]))
+                    readable.append((path, pose))
+                except ValueError:
+                    print(f"Skipping unreadable image {path}")
+            if not readable:
+                continue
+            chunk, embeddings = readable, np.concatenate(rows)
+        index.add(embeddings, [{'pose': pose, 'source': os.path.abspath(path)} for path, pose in chunk])
+        added += len(chunk)
+
+    for label in labels:
+        guidance_path = os.path.join(reference_dir, label, 'guidance.md')
+        if os.path.exists(guidance_path):
+            with open(guidance_path, 'r', encoding='utf-8') as f:
+                index.set_guidance(label, f.read().strip())
+    return added
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='yoga-pose-index', description="Reference pose embedding index")
+    parser.add_argument('command', choices=('build', 'add', 'search'))
+    parser.add_argument('path', help="Reference directory (build/add) or image (search)")
+    parser.add_argument('--index-dir', default=INDEX_DIR)
+    parser.add_argument('--top-k', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    from yoga_analysis import YogaPoseAnalysis
+
+    if args.command == 'build':
+        for name in ('embeddings.npy', 'entries.json'):
+            path = os.path.join(args.index_dir, name)
+            if os.path.exists(path):
+                os.remove(path)
+    index = PoseIndex(args.index_dir)
+    yoga_analysis = YogaPoseAnalysis(load_classifier=False)
+
+    if args.command == 'search':
+        matches = index.search(yoga_analysis.embed_batch([args.path]), top_k=args.top_k)[0]
+        for entry, score in matches:
+            print(f"{score:.3f}  {entry['pose']}  {entry.get('source', '')}")
+        pose, score = index.vote(matches)
+        print(f"Best match: {pose} ({score:.3f})")
+        return
+
+    added = add_reference_dir(index, yoga_analysis, args.path)
+    print(f"Indexed {added} new images; {len(index)} references in {args.index_dir}")
+
+
+if __name__ == '__main__':
+    main()
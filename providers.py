@@ -0,0 +1,517 @@
+import copy
+import hashlib
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+
+class ProviderError(Exception):
+    """A model provider call failed"""
+
+
+class ProviderTimeout(ProviderError):
+    """A model provider call missed its deadline"""
+
+
+class ProviderBusy(ProviderTimeout):
+    """Too much work is queued for a provider's rate limit to start the call in time"""
+
+
+RETRYABLE_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504)
+RETRYABLE_ERROR_NAMES = ('RateLimit', 'Timeout', 'Connection', 'ServiceUnavailable',
+                         'ResourceExhausted', 'InternalServerError', 'DeadlineExceeded')
+
+# Calls run on these threads so a caller can stop waiting at its deadline.
+# A call that misses its deadline keeps running until the SDK gives up, so
+# vision and chat each get their own pool: a hung vision provider cannot
+# use up the threads chat calls need.
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def call_executor(name, max_workers=16):
+    """The thread pool shared by every policy with this name"""
+    with _executors_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-call")
+            _executors[name] = executor
+        return executor
+
+def is_retryable(error):
+    """True for timeouts, rate limits and server-side errors"""
+    if isinstance(error, ProviderBusy):
+        # The queue is already full; waiting again only adds to it
+        return False
+    if isinstance(error, ProviderTimeout):
+        return True
+    if isinstance(error, ProviderError):
+        return False
+    status = getattr(error, 'status_code', None) or getattr(error, 'code', None)
+    if isinstance(status, int) and status in RETRYABLE_STATUS_CODES:
+        return True
+    return any(name in type(error).__name__ for name in RETRYABLE_ERROR_NAMES)
+
+
+def is_rate_limit(error):
+    """True for a provider's 429 / quota exhausted response"""
+    status = getattr(error, 'status_code', None) or getattr(error, 'code', None)
+    if status == 429:
+        return True
+    return any(name in type(error).__name__ for name in ('RateLimit', 'ResourceExhausted'))
+
+
+class CallPolicy:
+    """Deadline, retry and hedging rules for calls to a list of providers
+
+    Each attempt has its own timeout, and the whole call has one overall
+    deadline that callers with a local fallback can rely on. It defaults to
+    timeout, so a provider that hangs goes straight to that fallback; set a
+    longer deadline to also try the next provider after a hang. Retryable failures are retried with exponential
+    backoff and jitter while the deadline allows; once the primary provider
+    has used up its retries, the next provider in the list is tried. A timed
+    out attempt is not retried unless retry_timeouts is set, since the
+    abandoned call is still running and a provider that just hung is likely
+    to hang again. With hedge_delay set, a request that has not finished
+    after hedge_delay seconds is also sent to the next provider, and
+    whichever answers first wins.
+
+    admit, if given, is called as admit(index, remaining_seconds) before each
+    attempt of calls[index] starts, and may block (see scheduler.py). Time
+    spent there counts against the overall deadline.
+    """
+
+    def __init__(self, timeout=30.0, retries=2, backoff=0.5, max_backoff=8.0, hedge_delay=None,
+                 deadline=None, retry_timeouts=False, name="provider"):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge_delay = hedge_delay
+        self.deadline = deadline or timeout
+        self.retry_timeouts = retry_timeouts
+        self.name = name
+        self.executor = call_executor(name)
+
+    def with_deadline(self, deadline):
+        """A copy of this policy with a different overall deadline"""
+        policy = copy.copy(self)
+        policy.deadline = deadline
+        return policy
+
+    def sleep_before_retry(self, attempt, remaining):
+        delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+        time.sleep(min(delay * random.uniform(0.5, 1.0), max(0.0, remaining)))
+
+    def run_with_deadline(self, call, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        future = self.executor.submit(call)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise ProviderTimeout(f"Provider call exceeded {timeout:.1f}s deadline")
+
+    def run_hedged(self, calls, admit=None, timeout=None):
+        """Start calls[0], add the next call every hedge_delay seconds, return the first success"""
+        timeout = self.timeout if timeout is None else timeout
+        end = time.monotonic() + timeout
+
+        def submit(index):
+            if admit is not None:
+                admit(index, end - time.monotonic())
+            return self.executor.submit(calls[index])
+
+        pending = {submit(0)}
+        next_call = 1
+        last_error = None
+        while pending or next_call < len(calls):
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            if not pending:
+                # Everything started so far failed: hedge immediately
+                pending.add(submit(next_call))
+                next_call += 1
+                continue
+            wait_for = min(self.hedge_delay, remaining) if next_call < len(calls) else remaining
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+                last_error = future.exception()
+            if not done and next_call < len(calls):
+                pending.add(submit(next_call))
+                next_call += 1
+        if last_error is not None and not pending:
+            raise last_error
+        raise ProviderTimeout(f"No provider answered within {timeout:.1f}s")
+
+    def should_retry(self, error):
+        if isinstance(error, ProviderTimeout) and not self.retry_timeouts:
+            return False
+        return is_retryable(error)
+
+    def call(self, calls, admit=None):
+        """Run one zero-argument callable per provider under this policy"""
+        calls = list(calls)
+        if not calls:
+            raise ProviderError("No providers configured")
+        hedging = self.hedge_delay is not None and len(calls) > 1
+        candidates = [(0, calls)] if hedging else [(index, [call]) for index, call in enumerate(calls)]
+
+        end = time.monotonic() + self.deadline
+        last_error = None
+        for first, candidate in candidates:
+            for attempt in range(self.retries + 1):
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    if len(candidate) > 1:
+                        return self.run_hedged(candidate, admit, min(self.timeout, remaining))
+                    if admit is not None:
+                        admit(first, remaining)
+                    return self.run_with_deadline(candidate[0], min(self.timeout, end - time.monotonic()))
+                except Exception as e:
+                    last_error = e
+                    if not self.should_retry(e):
+                        break
+                    if attempt < self.retries:
+                        self.sleep_before_retry(attempt, end - time.monotonic())
+        if time.monotonic() >= end and not isinstance(last_error, ProviderTimeout):
+            # Out of time: report it as a timeout so callers take their fallback
+            raise ProviderTimeout(f"No provider answered within the {self.deadline:.1f}s deadline")
+        raise last_error
+
+    def open_stream(self, factories, admit=None):
+        """Start a stream under this policy and return an iterator over its chunks
+
+        factories are zero-argument callables returning iterators, one per
+        provider. The retries and hedging cover the wait for the first chunk.
+        Every later chunk must also arrive before the overall deadline runs
+        out, or the iterator raises ProviderTimeout, so a stream that stalls
+        halfway cannot hang its reader.
+        """
+        end = time.monotonic() + self.deadline
+
+        def starter(factory):
+            def start():
+                iterator = iter(factory())
+                try:
+                    return next(iterator), iterator
+                except StopIteration:
+                    return None
+            return start
+
+        return self.read_stream(self.call([starter(factory) for factory in factories], admit), end)
+
+    def read_stream(self, started, end):
+        """Yield the first chunk and then the rest, each within the time left before end
+
+        started is (first chunk, iterator), or None for an empty stream.
+        """
+        if started is None:
+            return
+        first, iterator = started
+        done = object()
+        try:
+            yield first
+            while True:
+                future = self.executor.submit(next, iterator, done)
+                try:
+                    chunk = future.result(timeout=max(0.0, end - time.monotonic()))
+                except FutureTimeoutError:
+                    # Still running on the executor thread, so it cannot be closed here
+                    iterator = None
+                    raise ProviderTimeout(f"Stream stalled past its {self.deadline:.1f}s deadline")
+                if chunk is done:
+                    return
+                yield chunk
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+def key_fingerprint(api_key):
+    """Short, non-reversible label for an API key, safe to show in metrics"""
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:8]
+
+
+class VisionProvider:
+    """Interface for models that analyze a pose image from a prompt"""
+
+    name = "vision"
+
+    def rate_key(self):
+        """Identity the provider's rate limit is counted against"""
+        return self.name
+
+    def model_id(self):
+        """Provider and model, for keys of cached outputs"""
+        return f"{self.name}:{getattr(self, 'model_name', '')}"
+
+    def generate(self, prompt, image_blob):
+        """Return the analysis text for the image"""
+        raise NotImplementedError
+
+    def stream(self, prompt, image_blob):
+        """Return an iterator of analysis text chunks"""
+        yield self.generate(prompt, image_blob)
+
+    def warmup(self):
+        """Create any client objects ahead of the first call"""
+
+
+class ChatProvider:
+    """Interface for chat completion models"""
+
+    name = "chat"
+
+    def rate_key(self):
+        """Identity the provider's rate limit is counted against"""
+        return self.name
+
+    def model_id(self):
+        """Provider and model, for keys of cached outputs"""
+        return f"{self.name}:{getattr(self, 'model_name', '')}"
+
+    def complete(self, messages, max_tokens=300, temperature=0.7, top_p=0.9):
+        """Return (answer text, prompt token count or None)"""
+        raise NotImplementedError
+
+    def stream(self, messages, max_tokens=300, temperature=0.7, top_p=0.9):
+        """Return an iterator of (text delta, prompt token count or None)"""
+        text, prompt_tokens = self.complete(messages, max_tokens, temperature, top_p)
+        yield text, prompt_tokens
+
+    def warmup(self):
+        """Create any client objects ahead of the first call"""
+
+
+class GeminiVisionProvider(VisionProvider):
+    name = "gemini"
+
+    def __init__(self, api_key, model_name='gemini-1.5-flash'):
+        self.api_key = api_key
+        self.model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+
+    def get_model(self):
+        """Import and configure the Gemini SDK on first use"""
+        if not self.api_key:
+            raise ProviderError("GEMINI_API_KEY is not set")
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    import google.generativeai as genai
+                    genai.configure(api_key=self.api_key)
+                    self._model = genai.GenerativeModel(self.model_name)
+        return self._model
+
+    def rate_key(self):
+        return f"{self.name}:{key_fingerprint(self.api_key)}"
+
+    def warmup(self):
+        if self.api_key:
+            self.get_model()
+
+    def generate(self, prompt, image_blob):
+        response = self.get_model().generate_content([prompt, image_blob])
+        return response.text if response and response.parts else ""
+
+    def stream(self, prompt, image_blob):
+        response = self.get_model().generate_content([prompt, image_blob], stream=True)
+        for chunk in response:
+            yield chunk.text if chunk.parts else ""
+
+
+class GroqChatProvider(ChatProvider):
+    name = "groq"
+
+    def __init__(self, api_key, model_name='llama3-8b-8192'):
+        self.api_key = api_key
+        self.model_name = model_name
+        self._client = None
+        self._lock = threading.Lock()
+
+    def get_client(self):
+        """Import the Groq SDK and create the client on first use"""
+        if not self.api_key:
+            raise ProviderError("GROQ_API_KEY is not set")
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from groq import Groq
+                    self._client = Groq(api_key=self.api_key)
+        return self._client
+
+    def rate_key(self):
+        return f"{self.name}:{key_fingerprint(self.api_key)}"
+
+    def warmup(self):
+        if self.api_key:
+            self.get_client()
+
+    def complete(self, messages, max_tokens=300, temperature=0.7, top_p=0.9):
+        chat_completion = self.get_client().chat.completions.create(
+            messages=messages,
+            model=self.model_name,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p
+        )
+        usage = getattr(chat_completion, "usage", None)
+        return chat_completion.choices[0].message.content, getattr(usage, "prompt_tokens", None)
+
+    def stream(self, messages, max_tokens=300, temperature=0.7, top_p=0.9):
+        stream = self.get_client().chat.completions.create(
+            messages=messages,
+            model=self.model_name,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            stream=True
+        )
+        try:
+            for chunk in stream:
+                # Groq reports usage on the final chunk of a stream
+                usage = getattr(getattr(chunk, "x_groq", None), "usage", None)
+                prompt_tokens = usage.prompt_tokens if usage is not None else None
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                yield delta or "", prompt_tokens
+        finally:
+            if hasattr(stream, "close"):
+                stream.close()
+
+
+class StubVisionProvider(VisionProvider):
+    """Deterministic offline stand-in for the vision model
+
+    The pose is chosen from the image bytes, so the same image always gets
+    the same analysis. latency adds a fixed delay before the first chunk.
+    """
+
+    name = "stub"
+
+    def __init__(self, latency=0.0, chunk_delay=0.0):
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+
+    def analysis_text(self, image_blob):
+        from model_generation import POSE_LABELS
+        digest = hashlib.sha256(image_blob['data']).hexdigest()
+        pose = POSE_LABELS[int(digest[:8], 16) % len(POSE_LABELS)]
+        return (
+            "**1. Pose Identification and Classification:**\n"
+            f"Pose: {pose}\n"
+            f"This looks like {pose}, a foundational posture.\n\n"
+            "**2. Alignment Analysis:**\n"
+            "Spine is long and shoulders are relaxed. Hips are level.\n\n"
+            "**3. Suggested Adjustments and Corrections:**\n"
+            "* Engage the core.\n"
+            "* Spread weight evenly through the feet.\n\n"
+            "**4. Safety Considerations and Precautions:**\n"
+            "Keep knees soft and avoid locking joints. Stop if you feel pain.\n\n"
+            "**5. Benefits of the Pose:**\n"
+            "Builds strength, balance and focus.\n\n"
+            "**6. Common Mistakes to Avoid:**\n"
+            "Holding the breath and collapsing the lower back.\n"
+        )
+
+    def generate(self, prompt, image_blob):
+        time.sleep(self.latency)
+        return self.analysis_text(image_blob)
+
+    def stream(self, prompt, image_blob):
+        time.sleep(self.latency)
+        for line in self.analysis_text(image_blob).splitlines(keepends=True):
+            time.sleep(self.chunk_delay)
+            yield line
+
+
+class StubChatProvider(ChatProvider):
+    """Deterministic offline stand-in for the chat model"""
+
+    name = "stub"
+
+    def __init__(self, latency=0.0, chunk_delay=0.0):
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+
+    def answer(self, messages):
+        question = messages[-1]["content"].split("Question:", 1)[-1].split("\n", 1)[0].strip()
+        return (
+            f"Regarding \"{question}\": keep a steady breath, move slowly into the pose "
+            "and back off if anything feels sharp or painful."
+        )
+
+    def complete(self, messages, max_tokens=300, temperature=0.7, top_p=0.9):
+        time.sleep(self.latency)
+        from chat_context import estimate_tokens
+        return self.answer(messages), sum(estimate_tokens(m["content"]) for m in messages)
+
+    def stream(self, messages, max_tokens=300, temperature=0.7, top_p=0.9):
+        time.sleep(self.latency)
+        for word in self.answer(messages).split(" "):
+            time.sleep(self.chunk_delay)
+            yield word + " ", None
+
+
+def _provider_specs(env_name, default):
+    """Parse "name[:model],..." from an environment variable"""
+    specs = []
+    for spec in os.getenv(env_name, default).split(","):
+        spec = spec.strip()
+        if spec:
+            name, _, model = spec.partition(":")
+            specs.append((name.strip().lower(), model.strip() or None))
+    return specs
+
+
+def build_vision_providers(api_key):
+    """Vision providers from YOGA_VISION_PROVIDERS (default "gemini"), in priority order"""
+    stub_latency = float(os.getenv("YOGA_STUB_LATENCY", "0"))
+    providers = []
+    for name, model in _provider_specs("YOGA_VISION_PROVIDERS", "gemini"):
+        if name == "gemini":
+            providers.append(GeminiVisionProvider(api_key, model or 'gemini-1.5-flash'))
+        elif name == "stub":
+            providers.append(StubVisionProvider(latency=stub_latency))
+        else:
+            raise ProviderError(f"Unknown vision provider: {name}")
+    return providers
+
+
+def build_chat_providers(api_key):
+    """Chat providers from YOGA_CHAT_PROVIDERS (default "groq"), in priority order"""
+    stub_latency = float(os.getenv("YOGA_STUB_LATENCY", "0"))
+    providers = []
+    for name, model in _provider_specs("YOGA_CHAT_PROVIDERS", "groq"):
+        if name == "groq":
+            providers.append(GroqChatProvider(api_key, model or 'llama3-8b-8192'))
+        elif name == "stub":
+            providers.append(StubChatProvider(latency=stub_latency))
+        else:
+            raise ProviderError(f"Unknown chat provider: {name}")
+    return providers
+
+
+def policy_from_env(prefix, timeout):
+    """CallPolicy configured from <prefix>_TIMEOUT, _DEADLINE, _RETRIES, _RETRY_TIMEOUTS and _HEDGE_DELAY"""
+    hedge_delay = os.getenv(f"{prefix}_HEDGE_DELAY")
+    deadline = os.getenv(f"{prefix}_DEADLINE")
+    return CallPolicy(
+        timeout=float(os.getenv(f"{prefix}_TIMEOUT", timeout)),
+        retries=int(os.getenv(f"{prefix}_RETRIES", "2")),
+        hedge_delay=float(hedge_delay) if hedge_delay else None,
+        deadline=float(deadline) if deadline else None,
+        retry_timeouts=os.getenv(f"{prefix}_RETRY_TIMEOUTS", "").lower() in ("1", "true", "yes"),
+        name=prefix.lower(),
+    )
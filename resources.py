@@ -0,0 +1,79 @@
+import threading
+
+
+class ResourceRegistry:
+    """Build expensive shared objects once per process and hand out the same instance
+
+    Streamlit re-executes the app script on every interaction, but imported
+    modules stay loaded, so instances held here survive reruns and are shared
+    by every session in the process.
+    """
+
+    def __init__(self):
+        self._instances = {}
+        self._locks = {}
+        self._registry_lock = threading.Lock()
+
+    def get(self, name, factory):
+        """Return the instance registered under name, building it with factory on first use"""
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+
+        with self._registry_lock:
+            lock = self._locks.setdefault(name, threading.Lock())
+        # Per-resource lock so a slow model load does not block other resources
+        with lock:
+            instance = self._instances.get(name)
+            if instance is None:
+                instance = factory()
+                self._instances[name] = instance
+        return instance
+
+    def reset(self, name=None):
+        """Forget one or all instances so the next get() rebuilds them"""
+        with self._registry_lock:
+            if name is None:
+                self._instances.clear()
+            else:
+                self._instances.pop(name, None)
+
+
+registry = ResourceRegistry()
+
+
+def get_image_processor():
+    """Shared ImageProcessor instance"""
+    from image_processor import ImageProcessor
+    return registry.get("image_processor", ImageProcessor)
+
+
+def get_yoga_analysis():
+    """Shared YogaPoseAnalysis instance with the pose classifier loaded once"""
+    from yoga_analysis import YogaPoseAnalysis
+    return registry.get(
+        "yoga_analysis",
+        lambda: YogaPoseAnalysis(image_processor=get_image_processor(), load_in_background=True)
+    )
+
+
+def get_chat_handler():
+    """Shared YogaChatHandler instance"""
+    from chat_handler3 import YogaChatHandler
+    return registry.get("chat_handler", YogaChatHandler)
+
+
+def warmup():
+    """Build every shared resource and block until the classifier is loaded and warm
+
+    Intended for container preloading, e.g. ``python resources.py`` at image
+    build time so the classifier file exists before the first request.
+    """
+    get_image_processor()
+    get_chat_handler().warmup()
+    get_yoga_analysis().warmup()
+
+
+if __name__ == "__main__":
+    warmup()
+    print("Shared resources loaded and warmed up.")
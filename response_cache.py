@@ -0,0 +1,150 @@
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+# Words that flip or retarget a question while barely moving its n-gram
+# vector ("is it safe" / "is it unsafe", "my knees" / "my wrists"). Similar
+# questions only share an answer when they agree on all of these. "t" is
+# what is left of don't, can't and isn't once punctuation is stripped.
+NEGATION_WORDS = {
+    "no", "not", "never", "without", "avoid", "unsafe", "t", "cannot", "nor",
+}
+BODY_PART_WORDS = {
+    "head", "neck", "shoulder", "shoulders", "arm", "arms", "elbow", "elbows",
+    "wrist", "wrists", "hand", "hands", "chest", "back", "spine", "core",
+    "abs", "hip", "hips", "glute", "glutes", "thigh", "thighs", "hamstring",
+    "hamstrings", "quad", "quads", "knee", "knees", "calf", "calves",
+    "ankle", "ankles", "foot", "feet", "toe", "toes", "pelvis", "sacrum",
+}
+
+
+def normalize_question(question):
+    """Lowercase, drop punctuation and collapse whitespace"""
+    question = re.sub(r"[^a-z0-9\s]", " ", question.lower())
+    return " ".join(question.split())
+
+
+def ngram_vector(text, n=3):
+    """Character n-gram counts of the padded words, L2-normalized"""
+    counts = Counter()
+    for word in text.split():
+        padded = f" {word} "
+        for i in range(max(1, len(padded) - n + 1)):
+            counts[padded[i:i + n]] += 1
+    norm = math.sqrt(sum(c * c for c in counts.values())) or 1.0
+    return {gram: c / norm for gram, c in counts.items()}
+
+
+def guard_words(question):
+    """The negation and body-part words of a normalized question"""
+    return frozenset(word for word in question.split() if word in NEGATION_WORDS or word in BODY_PART_WORDS)
+
+
+def cosine_similarity(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(weight * b.get(gram, 0.0) for gram, weight in a.items())
+
+
+class ResponseCache:
+    """LRU + TTL cache of chat answers keyed by (pose name, sections, normalized question)
+
+    sections are the analysis sections the question selects as prompt
+    context (see ChatContextBuilder.context_sections), so the same question
+    about the same pose shares an answer across users and images, but not
+    with a question that was answered from different parts of the analysis.
+    With similarity_threshold set, questions that are not an exact match can
+    still hit when their character n-gram cosine similarity to a cached
+    question with the same pose and sections reaches it, and they use the
+    same negation and body-part words. Cached values are the raw model
+    answers, so per-question post-processing such as the disclaimer is
+    applied on read.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=24 * 3600, similarity_threshold=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = {"exact": 0, "similar": 0}
+        self.misses = 0
+
+    def key(self, pose_name, question, sections=()):
+        """Exact-match key for a question about a pose answered from these sections"""
+        return ((pose_name or "").strip().lower(), tuple(sections), normalize_question(question))
+
+    def _expired(self, created):
+        return self.ttl_seconds is not None and time.time() - created > self.ttl_seconds
+
+    def get(self, pose_name, question, sections=()):
+        """Return the cached answer for this question about this pose, or None"""
+        key = self.key(pose_name, question, sections)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry["created"]):
+                    self._entries.move_to_end(key)
+                    self.hits["exact"] += 1
+                    return entry["response"]
+                del self._entries[key]
+
+            match = self._find_similar(key) if self.similarity_threshold else None
+            if match is not None:
+                self._entries.move_to_end(match)
+                self.hits["similar"] += 1
+                return self._entries[match]["response"]
+
+            self.misses += 1
+            return None
+
+    def _find_similar(self, key):
+        question = key[2]
+        vector = ngram_vector(question)
+        guards = guard_words(question)
+        best_key, best_score = None, self.similarity_threshold
+        expired = []
+        for other_key, entry in self._entries.items():
+            if other_key[:2] != key[:2] or guard_words(other_key[2]) != guards:
+                continue
+            if self._expired(entry["created"]):
+                expired.append(other_key)
+                continue
+            score = cosine_similarity(vector, entry["vector"])
+            if score >= best_score:
+                best_key, best_score = other_key, score
+        for other_key in expired:
+            del self._entries[other_key]
+        return best_key
+
+    def set(self, pose_name, question, response, sections=()):
+        """Cache the raw answer to a question about a pose"""
+        key = self.key(pose_name, question, sections)
+        with self._lock:
+            self._entries[key] = {
+                "response": response,
+                "created": time.time(),
+                "vector": ngram_vector(key[2]),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return hit/miss counters and the number of cached answers"""
+        with self._lock:
+            hits = self.hits["exact"] + self.hits["similar"]
+            lookups = hits + self.misses
+            return {
+                "exact_hits": self.hits["exact"],
+                "similar_hits": self.hits["similar"],
+                "misses": self.misses,
+                "hit_ratio": hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+            }
@@ -0,0 +1,309 @@
+"""Shared scheduling of model provider calls.
+
+All vision and chat requests, from the app, the batch runner and the API
+server alike, go through the module-level scheduler, which:
+
+* coalesces identical in-flight work (single-flight): a request for an image
+  digest, or a pose and question, that is already being answered waits for
+  that answer instead of calling the provider a second time;
+* rate limits each provider API key with a token bucket, so a burst queues
+  here instead of coming back from the provider as a storm of 429s;
+* serves queued calls by priority, so interactive requests go ahead of
+  batch jobs waiting on the same key.
+
+Limits come from YOGA_RATE_LIMITS as "provider=requests_per_minute[/burst]",
+comma separated. The defaults match the free tiers of the configured models;
+providers without a limit (the stubs, unless configured) are not throttled.
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+
+from providers import ProviderBusy, is_rate_limit
+from telemetry import telemetry
+
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+# Requests per minute per API key
+DEFAULT_RATE_LIMITS = {"gemini": 15, "groq": 30}
+
+
+def parse_rate_limits(spec):
+    """Parse "name=rpm[/burst],..." into {name: (rpm, burst or None)}"""
+    limits = {}
+    for item in (spec or "").split(","):
+        name, _, value = item.strip().partition("=")
+        if not name or not value:
+            continue
+        rpm, _, burst = value.partition("/")
+        limits[name.strip().lower()] = (float(rpm), float(burst) if burst else None)
+    return limits
+
+
+def rate_limits_from_env():
+    limits = {name: (rpm, None) for name, rpm in DEFAULT_RATE_LIMITS.items()}
+    limits.update(parse_rate_limits(os.getenv("YOGA_RATE_LIMITS")))
+    return limits
+
+
+def retry_after(error):
+    """Seconds the provider asked us to wait, from a Retry-After header if there is one"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """rate tokens per second, holding at most capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def try_take(self, now):
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self, now):
+        """Seconds until a token is available"""
+        self.refill(now)
+        return max(0.0, self.updated - now) + max(0.0, 1 - self.tokens) / self.rate
+
+    def pause(self, now, seconds):
+        """Empty the bucket and stop refilling for seconds"""
+        self.tokens = min(self.tokens, 0)
+        self.updated = max(self.updated, now + seconds)
+
+
+class Scheduler:
+    """Single-flight coalescing plus per-key rate limits with a priority queue
+
+    Callers set their priority with the priority() context manager; it is
+    per thread and defaults to INTERACTIVE. A request waits at most
+    follower_timeout seconds for identical work already in flight before
+    doing the work itself.
+    """
+
+    def __init__(self, rate_limits=None, max_queue=256, batch_wait=600.0, follower_timeout=60.0):
+        self.rate_limits = rate_limits_from_env() if rate_limits is None else rate_limits
+        self.max_queue = max_queue
+        self.batch_wait = batch_wait
+        self.follower_timeout = follower_timeout
+        self._buckets = {}
+        self._queues = {}
+        self._flights = {}
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._local = threading.local()
+        self.totals = {"coalesced": 0, "rate_limited": 0, "rejected": 0, "provider_429": 0}
+
+    @contextmanager
+    def priority(self, priority):
+        """Run the calls made by this thread inside the block at priority"""
+        previous = self.current_priority()
+        self._local.priority = priority
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    def current_priority(self):
+        return getattr(self._local, "priority", INTERACTIVE)
+
+    @contextmanager
+    def flight(self, key):
+        """Join or start the in-flight work for key; yields (future, leader)
+
+        The leader does the work and sets the future's result. Everyone else
+        waits with shared_result(future). A None result means the leader
+        stopped without an answer to share, or is taking too long, so the
+        caller should do the work itself.
+        """
+        with self._cond:
+            future = self._flights.get(key)
+            leader = future is None
+            if leader:
+                future = self._flights[key] = Future()
+            else:
+                self.totals["coalesced"] += 1
+        if not leader:
+            telemetry.increment("coalesced_requests_total", kind=key[0])
+            yield future, False
+            return
+        try:
+            yield future, True
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            raise
+        finally:
+            with self._cond:
+                self._flights.pop(key, None)
+            if not future.done():
+                future.set_result(None)
+
+    def shared_result(self, future):
+        """The leader's result, or None if it has not arrived within follower_timeout"""
+        try:
+            return future.result(timeout=self.follower_timeout)
+        except FutureTimeoutError:
+            telemetry.increment("coalesce_timeouts_total")
+            return None
+
+    def coalesce(self, key, work):
+        """Return work(), sharing one call among identical concurrent requests"""
+        with self.flight(key) as (future, leader):
+            if not leader:
+                result = self.shared_result(future)
+                if result is not None:
+                    return result
+            result = work()
+            if leader:
+                future.set_result(result)
+            return result
+
+    def _bucket(self, provider):
+        """The rate limit bucket for provider's key, or None if it is unlimited"""
+        limit = self.rate_limits.get(provider.name)
+        if limit is None:
+            return None
+        key = provider.rate_key()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            rpm, burst = limit
+            # A full minute's burst would leave later interactive calls waiting up to a minute
+            bucket = self._buckets[key] = TokenBucket(rpm / 60.0, burst or max(1.0, rpm / 4))
+        return bucket
+
+    def _publish_depth(self, key, queue):
+        for priority, name in PRIORITY_NAMES.items():
+            depth = sum(1 for ticket in queue if ticket[0] == priority)
+            telemetry.set_gauge("scheduler_queue_depth", depth, key=key, priority=name)
+
+    def acquire(self, provider, priority=INTERACTIVE, timeout=None):
+        """Wait for a rate limit token for provider, served in priority order
+
+        Raises ProviderBusy if the queue is full or no token comes within
+        timeout seconds. Returns the seconds spent waiting.
+        """
+        start = time.monotonic()
+        with self._cond:
+            bucket = self._bucket(provider)
+            if bucket is None:
+                return 0.0
+            key = provider.rate_key()
+            queue = self._queues.setdefault(key, [])
+            if not queue and bucket.try_take(start):
+                return 0.0
+            if len(queue) >= self.max_queue:
+                self.totals["rejected"] += 1
+                raise ProviderBusy(f"{len(queue)} calls already queued for {provider.name}")
+
+            self.totals["rate_limited"] += 1
+            ticket = (priority, next(self._seq))
+            heapq.heappush(queue, ticket)
+            self._publish_depth(key, queue)
+            # A higher priority ticket may have just taken the head of the queue
+            self._cond.notify_all()
+            try:
+                while True:
+                    now = time.monotonic()
+                    if queue[0] == ticket and bucket.try_take(now):
+                        break
+                    remaining = None if timeout is None else start + timeout - now
+                    if remaining is not None and remaining <= 0:
+                        self.totals["rejected"] += 1
+                        raise ProviderBusy(f"No {provider.name} rate limit token within {timeout:g}s")
+                    wait = bucket.wait_time(now) if queue[0] == ticket else remaining
+                    if remaining is not None:
+                        wait = min(wait, remaining)
+                    self._cond.wait(wait)
+            finally:
+                queue.remove(ticket)
+                heapq.heapify(queue)
+                self._publish_depth(key, queue)
+                # The next ticket in line may now be at the head
+                self._cond.notify_all()
+        waited = time.monotonic() - start
+        telemetry.record_duration("rate_limit_wait", waited, priority=PRIORITY_NAMES.get(priority, priority))
+        return waited
+
+    def back_off(self, provider, error):
+        """The provider answered 429: hold every queued call for its key until the quota recovers"""
+        with self._cond:
+            bucket = self._bucket(provider)
+            self.totals["provider_429"] += 1
+            if bucket is not None:
+                bucket.pause(time.monotonic(), retry_after(error) or 1.0 / bucket.rate)
+        telemetry.increment("provider_rate_limited_total", provider=provider.name)
+
+    def _watch(self, provider, chunks):
+        try:
+            yield from chunks
+        except Exception as e:
+            if is_rate_limit(e):
+                self.back_off(provider, e)
+            raise
+
+    def run(self, policy, providers, call, stream=False):
+        """Run call(provider) for the providers under policy, rate limited
+
+        Each attempt waits for its provider's token before its own timeout
+        starts, within the policy's overall deadline. Batch calls get
+        batch_wait on top of that deadline to queue behind interactive ones.
+        With stream=True, call returns an iterator and this returns
+        policy.open_stream's iterator.
+        """
+        providers = list(providers)
+        priority = self.current_priority()
+        if priority != INTERACTIVE:
+            policy = policy.with_deadline(policy.deadline + self.batch_wait)
+
+        def admit(index, remaining):
+            self.acquire(providers[index], priority, remaining)
+
+        def guarded(provider):
+            def attempt():
+                try:
+                    result = call(provider)
+                except Exception as e:
+                    if is_rate_limit(e):
+                        self.back_off(provider, e)
+                    raise
+                return self._watch(provider, result) if stream else result
+            return attempt
+
+        calls = [guarded(provider) for provider in providers]
+        if stream:
+            return policy.open_stream(calls, admit)
+        return policy.call(calls, admit)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self.totals)
+            stats["queued"] = sum(len(queue) for queue in self._queues.values())
+            stats["in_flight"] = len(self._flights)
+        return stats
+
+
+scheduler = Scheduler()
+telemetry.register_collector("scheduler", scheduler.stats)
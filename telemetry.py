@@ -0,0 +1,287 @@
+import atexit
+import bisect
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in seconds, from cache hits to slow model calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + list((extra or {}).items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+
+class Histogram:
+    """Cumulative bucket counts plus a window of recent samples for percentiles"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, window=1024):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def percentile(self, q):
+        """Percentile (0-100) over the recent window, or None if empty"""
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+class Telemetry:
+    """Process-wide spans, counters, gauges and histograms
+
+    Spans time one pipeline stage and feed the stage_seconds histogram.
+    Finished spans are kept in a short in-memory log and, if jsonl_path is
+    set (YOGA_TELEMETRY_JSONL), appended to that file as JSON lines by a
+    background writer thread, so no caller waits on file I/O.
+    export_prometheus() renders everything in the Prometheus text format.
+    """
+
+    def __init__(self, jsonl_path=None, span_log_size=500):
+        self.jsonl_path = jsonl_path
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.spans = deque(maxlen=span_log_size)
+        self.errors = deque(maxlen=50)
+        self.collectors = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._span_queue = queue.SimpleQueue()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self.gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def record_error(self, stage, error):
+        """Count an error for a stage and keep it for the debug panel
+
+        An exception is counted once, at the first stage that records it,
+        however many enclosing spans it passes through on the way up.
+        """
+        if getattr(error, "_telemetry_recorded", False):
+            return
+        try:
+            error._telemetry_recorded = True
+        except AttributeError:
+            pass
+        self.increment("errors_total", stage=stage)
+        with self._lock:
+            self.errors.append({"time": time.time(), "stage": stage, "error": str(error)})
+
+    def register_collector(self, name, collect):
+        """Register a callable returning a dict of numeric gauges, read at export time"""
+        with self._lock:
+            self.collectors[name] = collect
+
+    @contextmanager
+    def span(self, stage, **labels):
+        """Time a pipeline stage; nested spans share the trace id of the outermost one"""
+        parent = getattr(self._local, "span", None)
+        record = {
+            "trace_id": parent["trace_id"] if parent else uuid.uuid4().hex[:16],
+            "span_id": uuid.uuid4().hex[:8],
+            "parent_id": parent["span_id"] if parent else None,
+            "stage": stage,
+            "start": time.time(),
+            "labels": labels,
+        }
+        self._local.span = record
+        start = time.perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            record["error"] = str(e)
+            self.record_error(stage, e)
+            raise
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            self._local.span = parent
+            self.observe("stage_seconds", record["seconds"], stage=stage)
+            self._finish(record)
+
+    def record_duration(self, stage, seconds, **labels):
+        """Record a stage timed by hand, e.g. one that spans a generator's yields
+
+        Unlike span labels, labels here also label the stage_seconds
+        histogram, so they must take only a few distinct values.
+        """
+        parent = getattr(self._local, "span", None)
+        self.observe("stage_seconds", seconds, stage=stage, **labels)
+        self._finish({
+            "trace_id": parent["trace_id"] if parent else uuid.uuid4().hex[:16],
+            "span_id": uuid.uuid4().hex[:8],
+            "parent_id": parent["span_id"] if parent else None,
+            "stage": stage,
+            "start": time.time() - seconds,
+            "labels": labels,
+            "seconds": seconds,
+        })
+
+    def _finish(self, record):
+        with self._lock:
+            self.spans.append(record)
+        if self.jsonl_path:
+            self._start_writer()
+            self._span_queue.put(record)
+
+    def _start_writer(self):
+        if self._writer is not None:
+            return
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_spans, name="telemetry-writer", daemon=True)
+                self._writer.start()
+                atexit.register(self.close)
+
+    def _write_spans(self):
+        """Append queued span records to jsonl_path through one open handle"""
+        try:
+            f = open(self.jsonl_path, "a", encoding="utf-8")
+        except Exception as e:
+            print(f"Error opening telemetry span file: {e}")
+            return
+        with f:
+            while True:
+                record = self._span_queue.get()
+                if record is None:
+                    return
+                try:
+                    f.write(json.dumps(record, default=str) + "\n")
+                    if self._span_queue.empty():
+                        f.flush()
+                except Exception as e:
+                    print(f"Error writing telemetry span: {e}")
+
+    def close(self, timeout=5.0):
+        """Write out the queued spans and stop the writer thread"""
+        with self._writer_lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            self._span_queue.put(None)
+            writer.join(timeout)
+
+    def collect(self):
+        """Read every registered collector as {collector: {metric: value}}"""
+        with self._lock:
+            collectors = dict(self.collectors)
+        collected = {}
+        for name, collect in collectors.items():
+            try:
+                collected[name] = collect()
+            except Exception as e:
+                print(f"Error collecting {name} metrics: {e}")
+        return collected
+
+    def snapshot(self):
+        """Plain-dict view of all metrics, for the debug panel and JSON export"""
+        with self._lock:
+            stages = {
+                self._stage_name(name, labels): {
+                    "count": histogram.count,
+                    "mean_ms": histogram.sum / histogram.count * 1000 if histogram.count else 0.0,
+                    "p50_ms": (histogram.percentile(50) or 0.0) * 1000,
+                    "p95_ms": (histogram.percentile(95) or 0.0) * 1000,
+                    "p99_ms": (histogram.percentile(99) or 0.0) * 1000,
+                }
+                for (name, labels), histogram in self.histograms.items()
+            }
+            counters = {name + _format_labels(labels): value for (name, labels), value in self.counters.items()}
+            gauges = {name + _format_labels(labels): value for (name, labels), value in self.gauges.items()}
+            errors = list(self.errors)
+        return {
+            "stages": stages,
+            "counters": counters,
+            "gauges": gauges,
+            "collected": self.collect(),
+            "recent_errors": errors,
+        }
+
+    @staticmethod
+    def _stage_name(name, labels):
+        """Debug panel name of a histogram: its stage, plus any other labels"""
+        if name != "stage_seconds":
+            return name + _format_labels(labels)
+        labels = dict(labels)
+        return labels.pop("stage", name) + _format_labels(labels.items())
+
+    def export_prometheus(self, prefix="yoga_"):
+        """Render all metrics in the Prometheus text exposition format"""
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {prefix}{name} {kind}")
+
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                declare(name, "counter")
+                lines.append(f"{prefix}{name}{_format_labels(labels)} {value}")
+            for (name, labels), value in sorted(self.gauges.items()):
+                declare(name, "gauge")
+                lines.append(f"{prefix}{name}{_format_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                declare(name, "histogram")
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{prefix}{name}_bucket{_format_labels(labels, {'le': bound})} {cumulative}")
+                lines.append(f"{prefix}{name}_bucket{_format_labels(labels, {'le': '+Inf'})} {histogram.count}")
+                lines.append(f"{prefix}{name}_sum{_format_labels(labels)} {histogram.sum}")
+                lines.append(f"{prefix}{name}_count{_format_labels(labels)} {histogram.count}")
+        for collector, values in sorted(self.collect().items()):
+            for metric, value in sorted(values.items()):
+                if isinstance(value, (int, float)):
+                    declare(f"{collector}_{metric}", "gauge")
+                    lines.append(f"{prefix}{collector}_{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+            self.spans.clear()
+            self.errors.clear()
+
+
+telemetry = Telemetry(jsonl_path=os.getenv("YOGA_TELEMETRY_JSONL"))
+span = telemetry.span
@@ -0,0 +1,74 @@
+"""Tests for joint angles and template scoring in alignment.py"""
+import numpy as np
+import pytest
+
+from alignment import ANGLE_NAMES, KEYPOINT_INDEX, AlignmentScorer, joint_angles
+
+TEMPLATES = {
+    "Lunge": {'left_knee': (90, 10), 'right_knee': (170, 10)},
+    "Squat": {'left_knee': (90, 10), 'right_knee': (90, 10)},
+}
+
+
+def angles(**values):
+    """An angle vector in ANGLE_NAMES order, NaN for joints not given"""
+    return np.array([values.get(name, np.nan) for name in ANGLE_NAMES], dtype=np.float32)
+
+
+def test_joint_angle_from_keypoints():
+    keypoints = np.zeros((17, 3), dtype=np.float32)
+    keypoints[:, 2] = 0.9
+    keypoints[KEYPOINT_INDEX['left_hip']] = (0.0, 0.0, 0.9)
+    keypoints[KEYPOINT_INDEX['left_knee']] = (1.0, 0.0, 0.9)
+    keypoints[KEYPOINT_INDEX['left_ankle']] = (1.0, 1.0, 0.9)
+    keypoints[KEYPOINT_INDEX['right_ankle']] = (1.0, 1.0, 0.1)
+
+    result = dict(zip(ANGLE_NAMES, joint_angles(keypoints)))
+
+    assert result['left_knee'] == pytest.approx(90.0, abs=0.01)
+    # A keypoint below the confidence threshold leaves its angles unknown
+    assert np.isnan(result['right_knee'])
+
+
+def test_scores_fall_off_beyond_the_tolerance():
+    scorer = AlignmentScorer(TEMPLATES, falloff=40.0)
+    pose_scores, joint_scores, _, _ = scorer.score_matrix(angles(left_knee=90, right_knee=150))
+
+    lunge, squat = scorer.pose_names.index("Lunge"), scorer.pose_names.index("Squat")
+    right_knee = ANGLE_NAMES.index('right_knee')
+    # 20 degrees off a 10 degree tolerance is halfway down a 40 degree falloff
+    assert joint_scores[0, lunge, right_knee] == pytest.approx(0.75)
+    assert pose_scores[0, lunge] == pytest.approx(0.875)
+    assert joint_scores[0, squat, right_knee] == pytest.approx(0.0)
+
+
+def test_mirrored_pose_scores_like_the_template():
+    scorer = AlignmentScorer(TEMPLATES)
+    pose_scores, _, _, _ = scorer.score_matrix(angles(left_knee=170, right_knee=90))
+
+    assert pose_scores[0, scorer.pose_names.index("Lunge")] == pytest.approx(1.0)
+
+
+def test_corrections_name_the_joint_and_direction():
+    scorer = AlignmentScorer(TEMPLATES)
+    values = angles(left_knee=90, right_knee=120)
+    _, _, deviations, tolerances = scorer.score_matrix(values)
+    lunge = scorer.pose_names.index("Lunge")
+
+    assert scorer.corrections(values, deviations[0, lunge], tolerances[0, lunge]) == [
+        "Straighten your right knee: about 120°, aim for 170°"
+    ]
+
+
+def test_too_few_visible_joints_gives_no_score():
+    scorer = AlignmentScorer(TEMPLATES, min_visible=1.0)
+    keypoints = np.zeros((1, 17, 3), dtype=np.float32)
+
+    assert scorer.score_batch(keypoints) == [None]
+
+
+def test_template_lookup_prefers_the_longest_name():
+    scorer = AlignmentScorer()
+
+    assert scorer.pose_names[scorer.template_index("Warrior II (Virabhadrasana II)")] == "Warrior II"
+    assert scorer.template_index("Crow Pose") is None
@@ -0,0 +1,111 @@
+"""Tests for the HTTP API, run offline against the stub providers"""
+import asyncio
+import os
+import threading
+import time
+
+os.environ["YOGA_VISION_PROVIDERS"] = "stub"
+os.environ["YOGA_CHAT_PROVIDERS"] = "stub"
+
+import pytest
+from starlette.testclient import TestClient
+
+import resources
+from api_server import WorkerPool, create_app
+from providers import StubChatProvider, StubVisionProvider
+
+ANALYSIS = StubVisionProvider().analysis_text({'data': b"test image"})
+
+
+def chat_client(workers, max_pending=None, chunk_delay=0.02):
+    """Client for a fresh app whose chat handler streams slowly enough for requests to overlap"""
+    resources.registry.reset()
+    resources.get_chat_handler().chat_providers = [StubChatProvider(chunk_delay=chunk_delay)]
+    return TestClient(create_app(workers=workers, max_pending=max_pending))
+
+
+def ask_concurrently(client, questions, timeout=30):
+    """POST every question to /chat at once; returns (status, text) per question, None if it hung"""
+    answers = [None] * len(questions)
+
+    def ask(index):
+        response = client.post('/chat', json={'question': questions[index], 'analysis': ANALYSIS})
+        answers[index] = (response.status_code, response.text)
+
+    threads = [threading.Thread(target=ask, args=(index,), daemon=True) for index in range(len(questions))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout)
+    return answers
+
+
+def test_identical_chat_questions_do_not_deadlock():
+    # Requests waiting on a coalesced answer used to hold every pool worker
+    # while the request streaming that answer queued for one
+    client = chat_client(workers=2)
+    answers = ask_concurrently(client, ["How do I keep my balance?"] * 4)
+
+    assert None not in answers, "chat requests hung"
+    assert [status for status, _ in answers] == [200] * 4
+    assert len({text for _, text in answers}) == 1
+    assert "balance" in answers[0][1]
+    assert client.app.app.state.pool.stats()['pending'] == 0
+
+
+def test_chat_is_refused_when_the_pool_is_full():
+    client = chat_client(workers=1, max_pending=1, chunk_delay=0.2)
+    answers = ask_concurrently(client, ["Is this safe for my knees?", "How long should I hold it?"])
+
+    assert None not in answers, "chat requests hung"
+    assert sorted(status for status, _ in answers) == [200, 503]
+
+
+def test_chat_requires_question_and_analysis():
+    client = chat_client(workers=1)
+    response = client.post('/chat', json={'question': "Is this safe?"})
+
+    assert response.status_code == 400
+    assert "required" in response.json()['error']
+
+
+def test_chat_releases_its_slot_when_the_handler_cannot_be_built(monkeypatch):
+    client = chat_client(workers=1, max_pending=1)
+    resources.registry.reset()
+    monkeypatch.setenv("YOGA_CHAT_CACHE_SIMILARITY", "not a number")
+    with pytest.raises(ValueError):
+        client.post('/chat', json={'question': "Is this safe?", 'analysis': ANALYSIS})
+
+    assert client.app.app.state.pool.stats()['pending'] == 0
+
+
+def test_pool_slot_is_held_until_the_job_finishes():
+    pool = WorkerPool(workers=1, max_pending=1)
+    finish = threading.Event()
+
+    async def abandon_job():
+        pool.reserve()
+        waiter = asyncio.ensure_future(pool.submit(finish.wait, 5))
+        await asyncio.sleep(0.05)
+        # The client went away, but the job is still running in its slot
+        waiter.cancel()
+        await asyncio.sleep(0.05)
+        return pool.stats()['pending']
+
+    try:
+        assert asyncio.run(abandon_job()) == 1
+    finally:
+        finish.set()
+    deadline = time.monotonic() + 5
+    while pool.stats()['pending'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert pool.stats()['pending'] == 0
+    pool.shutdown()
+
+
+def test_request_latency_is_exported_per_route():
+    client = chat_client(workers=1)
+    client.post('/chat', json={'question': "Is this safe?"})
+    metrics = client.get('/metrics').text
+
+    assert 'yoga_stage_seconds_count{path="/chat",stage="api_request"}' in metrics
@@ -0,0 +1,80 @@
+"""Tests for answer length limits and caching in chat_handler3.py, using a stub chat provider"""
+import os
+
+os.environ["YOGA_CHAT_PROVIDERS"] = "stub"
+
+from chat_handler3 import YogaChatHandler
+from providers import StubChatProvider, StubVisionProvider
+
+ANALYSIS = StubVisionProvider().analysis_text({'data': b"test image"})
+LONG_ANSWER = " ".join(f"Sentence {n} keeps the spine long and the breath slow." for n in range(40))
+
+
+class ScriptedChatProvider(StubChatProvider):
+    """Stub that gives a fixed answer and records whether its stream was closed"""
+
+    def __init__(self, text):
+        super().__init__()
+        self.text = text
+        self.closed = False
+
+    def answer(self, messages):
+        return self.text
+
+    def stream(self, messages, max_tokens=300, temperature=0.7, top_p=0.9):
+        try:
+            yield from super().stream(messages, max_tokens, temperature, top_p)
+        finally:
+            self.closed = True
+
+
+def handler_answering(text):
+    handler = YogaChatHandler()
+    handler.chat_providers = [ScriptedChatProvider(text)]
+    return handler
+
+
+def test_streamed_and_complete_answers_are_cut_alike():
+    question = "How do I practice this safely?"
+    streamed = "".join(handler_answering(LONG_ANSWER).stream_response(question, ANALYSIS))
+    complete = handler_answering(LONG_ANSWER).get_response(question, ANALYSIS)
+
+    assert streamed == complete
+    answer = streamed.split("\n\n---\n")[0]
+    assert answer.endswith("slow.")
+    assert len(streamed.split()) <= YogaChatHandler.MAX_WORDS
+
+
+def test_stream_cut_at_the_word_limit_closes_the_provider_stream():
+    handler = handler_answering(LONG_ANSWER)
+    list(handler.stream_response("What does this pose help with?", ANALYSIS))
+
+    assert handler.chat_providers[0].closed
+
+
+def test_cached_answer_is_replayed_with_the_same_cut():
+    handler = handler_answering(LONG_ANSWER)
+    question = "What does this pose help with?"
+    first = "".join(handler.stream_response(question, ANALYSIS))
+    handler.chat_providers = [ScriptedChatProvider("A different answer.")]
+
+    assert "".join(handler.stream_response(question, ANALYSIS)) == first
+
+
+def test_blank_answer_is_not_cached():
+    handler = handler_answering("")
+    question = "What does this pose help with?"
+    list(handler.stream_response(question, ANALYSIS))
+    handler.chat_providers = [ScriptedChatProvider("Builds balance.")]
+
+    assert "".join(handler.stream_response(question, ANALYSIS)) == "Builds balance. "
+
+
+def test_answer_is_shared_between_analyses_of_the_same_pose():
+    handler = handler_answering("Builds balance.")
+    question = "What does this pose help with?"
+    other_analysis = ANALYSIS.replace("Spine is long", "Spine is slightly rounded")
+    first = "".join(handler.stream_response(question, ANALYSIS))
+    handler.chat_providers = [ScriptedChatProvider("A different answer.")]
+
+    assert "".join(handler.stream_response(question, other_analysis)) == first
@@ -0,0 +1,173 @@
+"""Tests for downloads and temp file cleanup in image_processor.py
+
+Downloads are fetched from a local http.server stand-in for image hosts.
+"""
+import io
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import PIL.Image
+import pytest
+
+from image_processor import ImageProcessor
+
+
+def png_bytes(size=(8, 8)):
+    buffer = io.BytesIO()
+    PIL.Image.new("RGB", size, (200, 30, 30)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class ImageHostHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, body, content_type="image/png", length=None):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body) if length is None else length))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/image.png":
+            self.send_body(png_bytes())
+        elif self.path == "/declared-too-big":
+            self.send_body(b"", length=10 * 1024 * 1024)
+        elif self.path == "/undeclared-too-big":
+            # No Content-Length: the cap has to be enforced while reading
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.wfile.write(b"x" * 64 * 1024)
+            self.close_connection = True
+        elif self.path == "/page.html":
+            self.send_body(b"<html>Not found</html>", content_type="text/html; charset=utf-8")
+        elif self.path == "/slow.png":
+            # Every read gets a byte in time, but the whole body never arrives
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", "100")
+            self.end_headers()
+            for _ in range(20):
+                self.wfile.write(b"x")
+                self.wfile.flush()
+                time.sleep(0.1)
+        else:
+            self.send_error(404)
+
+
+@pytest.fixture
+def image_host():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ImageHostHandler)
+    server.connections = 0
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def processor(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return ImageProcessor(temp_max_bytes=1000, temp_min_age=60, temp_cleanup_interval=60)
+
+
+def age(path, seconds):
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+def test_cleanup_runs_once_per_interval(processor, monkeypatch):
+    scans = []
+    monkeypatch.setattr(processor, "cleanup", lambda: scans.append(1))
+    for _ in range(5):
+        processor.write_temp_file(b"x" * 10, "upload_")
+
+    assert len(scans) == 1
+
+
+def test_heavy_writing_triggers_cleanup_before_the_interval(processor, monkeypatch):
+    scans = []
+    monkeypatch.setattr(processor, "cleanup", lambda: scans.append(1))
+    processor.write_temp_file(b"x", "upload_")
+    processor.write_temp_file(b"x" * 200, "upload_")
+
+    assert len(scans) == 2
+
+
+def test_size_eviction_keeps_young_files(processor):
+    old = processor.write_temp_file(b"x" * 600, "upload_")
+    age(old, 600)
+    fresh = processor.write_temp_file(b"x" * 600, "upload_")
+    processor.cleanup()
+
+    assert not os.path.exists(old)
+    # Still over the size cap, but just written and possibly about to be read
+    assert os.path.exists(fresh)
+
+
+def test_expired_files_are_removed(processor):
+    path = processor.write_temp_file(b"x", "upload_")
+    age(path, 2 * 3600)
+    processor.cleanup()
+
+    assert not os.path.exists(path)
+
+
+@pytest.fixture
+def downloader(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return ImageProcessor(timeout=(1, 0.5), max_download_bytes=32 * 1024)
+
+
+def test_download_returns_the_image_bytes(image_host, downloader):
+    _, url = image_host
+    assert downloader.fetch_image_bytes(f"{url}/image.png") == png_bytes()
+
+
+def test_downloads_reuse_pooled_connections(image_host, downloader):
+    server, url = image_host
+    results = downloader.download_many([f"{url}/image.png"] * 6, max_workers=2)
+
+    assert results == [png_bytes()] * 6
+    assert server.connections <= 2
+
+
+@pytest.mark.parametrize("path", ["/declared-too-big", "/undeclared-too-big"])
+def test_download_over_the_size_cap_is_refused(image_host, downloader, path):
+    _, url = image_host
+    with pytest.raises(ValueError, match="larger than"):
+        downloader.fetch_image_bytes(url + path)
+
+
+def test_download_that_is_not_an_image_is_refused(image_host, downloader):
+    _, url = image_host
+    with pytest.raises(ValueError, match="text/html"):
+        downloader.fetch_image_bytes(f"{url}/page.html")
+
+
+def test_slow_download_is_abandoned_at_the_deadline(image_host, downloader):
+    _, url = image_host
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        downloader.fetch_image_bytes(f"{url}/slow.png")
+    assert time.monotonic() - start < 1.9
+
+
+def test_failed_downloads_are_none_in_input_order(image_host, downloader):
+    _, url = image_host
+    results = downloader.download_many([f"{url}/missing.png", f"{url}/image.png"])
+
+    assert results == [None, png_bytes()]
@@ -0,0 +1,43 @@
+"""Tests for matching a TFLite export to the installed model in model_export.py"""
+import os
+
+from model_export import is_current_export, write_export_metadata
+
+
+def install(tmp_path, model=b"trained weights", labels='["Tree Pose"]'):
+    paths = {name: str(tmp_path / name) for name in ('model.h5', 'labels.json', 'model.tflite')}
+    with open(paths['model.h5'], 'wb') as f:
+        f.write(model)
+    with open(paths['labels.json'], 'w', encoding='utf-8') as f:
+        f.write(labels)
+    with open(paths['model.tflite'], 'wb') as f:
+        f.write(b"exported graph")
+    return paths['model.tflite'], paths['model.h5'], paths['labels.json']
+
+
+def test_export_without_metadata_is_not_current(tmp_path):
+    export, model, labels = install(tmp_path)
+    assert not is_current_export(export, model, labels)
+
+
+def test_export_is_current_whatever_the_file_times(tmp_path):
+    export, model, labels = install(tmp_path)
+    write_export_metadata(export, model, labels)
+    # A checkout or image build can leave the model newer than its export
+    os.utime(export, (0, 0))
+    assert is_current_export(export, model, labels)
+
+
+def test_export_is_not_current_after_retraining(tmp_path):
+    export, model, labels = install(tmp_path)
+    write_export_metadata(export, model, labels)
+    with open(labels, 'w', encoding='utf-8') as f:
+        f.write('["Tree Pose", "Crow Pose"]')
+    assert not is_current_export(export, model, labels)
+
+
+def test_export_without_its_model_file_is_checked_on_labels(tmp_path):
+    export, model, labels = install(tmp_path)
+    write_export_metadata(export, model, labels)
+    os.remove(model)
+    assert is_current_export(export, model, labels)
@@ -0,0 +1,76 @@
+"""Tests for the memory-mapped reference index in pose_index.py"""
+import multiprocessing
+
+import numpy as np
+
+from pose_index import PoseIndex
+
+
+def unit(dim, axis):
+    vector = np.zeros(dim, dtype=np.float32)
+    vector[axis] = 1.0
+    return vector
+
+
+def test_search_returns_the_nearest_entries_best_first(tmp_path):
+    index = PoseIndex(str(tmp_path), dim=4)
+    index.add([unit(4, 0), unit(4, 1), [1, 1, 0, 0]], [{'pose': "Tree Pose"}, {'pose': "Warrior II"}, {'pose': "Tree Pose"}])
+
+    matches, = index.search([[2, 0.1, 0, 0]], top_k=2)
+
+    assert [entry['pose'] for entry, _ in matches] == ["Tree Pose", "Tree Pose"]
+    assert matches[0][1] > matches[1][1]
+    assert index.vote(matches)[0] == "Tree Pose"
+
+
+def test_chunked_search_matches_a_single_pass(tmp_path):
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(50, 8))
+    queries = rng.normal(size=(3, 8))
+    whole = PoseIndex(str(tmp_path / "whole"), dim=8)
+    chunked = PoseIndex(str(tmp_path / "chunked"), dim=8, search_chunk=7)
+    entries = [{'pose': str(row)} for row in range(50)]
+    whole.add(embeddings, entries)
+    chunked.add(embeddings, entries)
+
+    for expected, actual in zip(whole.search(queries, top_k=5), chunked.search(queries, top_k=5)):
+        assert [entry for entry, _ in expected] == [entry for entry, _ in actual]
+
+
+def test_additions_grow_the_file_and_reach_other_readers(tmp_path):
+    writer = PoseIndex(str(tmp_path), dim=4)
+    writer.add(np.tile(unit(4, 0), (1024, 1)), [{'pose': "Tree Pose"}] * 1024)
+    reader = PoseIndex(str(tmp_path), dim=4)
+
+    # Past the preallocated capacity: the embeddings file is regrown
+    writer.add([unit(4, 3)], [{'pose': "Cobra Pose"}])
+
+    matches, = reader.search([unit(4, 3)], top_k=1)
+    assert len(reader) == 1025
+    assert matches[0][0]['pose'] == "Cobra Pose"
+    assert np.load(writer.embeddings_path, mmap_mode='r').shape[0] >= 2048
+
+
+def add_rows(index_dir, axis):
+    index = PoseIndex(index_dir, dim=8)
+    for _ in range(20):
+        index.add(np.tile(unit(8, axis), (3, 1)), [{'pose': str(axis)}] * 3)
+
+
+def test_concurrent_processes_append_in_turn(tmp_path):
+    processes = [multiprocessing.Process(target=add_rows, args=(str(tmp_path), axis)) for axis in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert [process.exitcode for process in processes] == [0, 0, 0, 0]
+
+    index = PoseIndex(str(tmp_path), dim=8)
+    embeddings = np.load(index.embeddings_path, mmap_mode='r')
+    assert len(index) == 240
+    # Every row still holds the embedding its entry was added with
+    assert [int(entry['pose']) for entry in index.entries] == list(np.argmax(embeddings[:240], axis=1))
+
+
+def test_empty_index_has_no_matches(tmp_path):
+    assert PoseIndex(str(tmp_path), dim=4).search([unit(4, 0)]) == [[]]
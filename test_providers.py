@@ -0,0 +1,68 @@
+"""Tests for deadlines, retries and streaming in providers.CallPolicy"""
+import threading
+import time
+
+import pytest
+
+from providers import CallPolicy, ProviderTimeout
+
+
+def test_timed_out_call_is_not_retried():
+    policy = CallPolicy(timeout=0.2, retries=2, name="test")
+    calls = []
+
+    def hang():
+        calls.append(1)
+        time.sleep(1)
+
+    start = time.monotonic()
+    with pytest.raises(ProviderTimeout):
+        policy.call([hang])
+    assert len(calls) == 1
+    assert time.monotonic() - start < 0.5
+
+
+def test_failed_provider_falls_over_within_the_deadline():
+    policy = CallPolicy(timeout=1, retries=1, backoff=0.01, name="test")
+
+    def fail():
+        raise ConnectionError("refused")
+
+    assert policy.call([fail, lambda: "second"]) == "second"
+
+
+def test_stream_yields_every_chunk_and_closes_the_source():
+    policy = CallPolicy(timeout=1, name="test")
+    closed = threading.Event()
+
+    def chunks():
+        try:
+            yield from ["a", "b", "c"]
+        finally:
+            closed.set()
+
+    stream = policy.open_stream([chunks])
+    assert next(stream) == "a"
+    stream.close()
+    assert closed.is_set()
+    assert list(policy.open_stream([chunks])) == ["a", "b", "c"]
+
+
+def test_stalled_stream_times_out():
+    policy = CallPolicy(timeout=0.3, name="test")
+    release = threading.Event()
+
+    def stall():
+        yield "first"
+        release.wait(5)
+        yield "too late"
+
+    stream = policy.open_stream([stall])
+    start = time.monotonic()
+    try:
+        assert next(stream) == "first"
+        with pytest.raises(ProviderTimeout):
+            next(stream)
+    finally:
+        release.set()
+    assert time.monotonic() - start < 1
@@ -0,0 +1,34 @@
+"""Tests for chat answer caching in response_cache.py"""
+from response_cache import ResponseCache
+
+
+def test_same_question_about_the_same_pose_is_shared():
+    cache = ResponseCache()
+    cache.set("Tree Pose", "Is this safe for my knees?", "Keep the knee soft.", ("safety",))
+
+    assert cache.get("tree pose", "is this safe for my knees", ("safety",)) == "Keep the knee soft."
+
+
+def test_answers_from_different_sections_are_not_shared():
+    cache = ResponseCache()
+    cache.set("Tree Pose", "Is this safe?", "Keep the knee soft.", ("safety",))
+
+    assert cache.get("Tree Pose", "Is this safe?", ("safety", "benefits")) is None
+    assert cache.get("Warrior II", "Is this safe?", ("safety",)) is None
+
+
+def test_expired_answer_is_dropped_on_lookup():
+    cache = ResponseCache(ttl_seconds=0)
+    cache.set("Tree Pose", "Is this safe?", "Keep the knee soft.", ("safety",))
+
+    assert cache.get("Tree Pose", "Is this safe?", ("safety",)) is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_similar_question_must_keep_its_negations_and_body_parts():
+    cache = ResponseCache(similarity_threshold=0.6)
+    cache.set("Tree Pose", "Is this pose safe for my knees?", "Keep the knee soft.", ("safety",))
+
+    assert cache.get("Tree Pose", "Is this pose safe for my knee joints?", ("safety",)) is None
+    assert cache.get("Tree Pose", "Is this pose unsafe for my knees?", ("safety",)) is None
+    assert cache.get("Tree Pose", "Is the pose safe for my knees?", ("safety",)) == "Keep the knee soft."
@@ -0,0 +1,128 @@
+"""Tests for single-flight coalescing and rate limiting in scheduler.py"""
+import threading
+import time
+
+import pytest
+
+from providers import CallPolicy, ProviderBusy
+from scheduler import BATCH, INTERACTIVE, Scheduler
+
+
+class LimitedProvider:
+    name = "limited"
+
+    def rate_key(self):
+        return self.name
+
+
+def run_concurrently(fn, count, timeout=10):
+    """Run fn() on count threads at once; returns the results, None for any that hung"""
+    results = [None] * count
+
+    def run(index):
+        results[index] = fn()
+
+    threads = [threading.Thread(target=run, args=(index,), daemon=True) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout)
+    return results
+
+
+def test_coalesce_shares_one_call():
+    scheduler = Scheduler(rate_limits={})
+    calls = []
+
+    def work():
+        calls.append(1)
+        time.sleep(0.2)
+        return "answer"
+
+    results = run_concurrently(lambda: scheduler.coalesce(('test', 'key'), work), 5)
+
+    assert results == ["answer"] * 5
+    assert len(calls) == 1
+    assert scheduler.stats()['coalesced'] == 4
+    assert scheduler.stats()['in_flight'] == 0
+
+
+def test_follower_stops_waiting_after_follower_timeout():
+    scheduler = Scheduler(rate_limits={}, follower_timeout=0.1)
+    leader_may_finish = threading.Event()
+    leader_started = threading.Event()
+
+    def slow():
+        leader_started.set()
+        leader_may_finish.wait(10)
+        return "leader"
+
+    leader = threading.Thread(target=lambda: scheduler.coalesce(('test', 'key'), slow), daemon=True)
+    leader.start()
+    leader_started.wait(5)
+    try:
+        # The follower does the work itself rather than waiting for the stuck leader
+        assert scheduler.coalesce(('test', 'key'), lambda: "follower") == "follower"
+    finally:
+        leader_may_finish.set()
+        leader.join(5)
+
+
+def test_leader_failure_reaches_followers():
+    scheduler = Scheduler(rate_limits={})
+
+    def fail():
+        time.sleep(0.2)
+        raise ValueError("provider down")
+
+    def attempt():
+        try:
+            scheduler.coalesce(('test', 'key'), fail)
+        except ValueError as e:
+            return str(e)
+
+    assert run_concurrently(attempt, 3) == ["provider down"] * 3
+
+
+def test_interactive_calls_go_before_queued_batch_calls():
+    scheduler = Scheduler(rate_limits={"limited": (600, 1)})
+    provider = LimitedProvider()
+    scheduler.acquire(provider)
+    order = []
+
+    def take(priority):
+        scheduler.acquire(provider, priority, timeout=5)
+        order.append(priority)
+
+    batch = threading.Thread(target=take, args=(BATCH,), daemon=True)
+    batch.start()
+    time.sleep(0.02)
+    interactive = threading.Thread(target=take, args=(INTERACTIVE,), daemon=True)
+    interactive.start()
+    batch.join(5)
+    interactive.join(5)
+
+    assert order == [INTERACTIVE, BATCH]
+
+
+def test_acquire_gives_up_at_its_timeout():
+    scheduler = Scheduler(rate_limits={"limited": (1, 1)})
+    provider = LimitedProvider()
+    scheduler.acquire(provider)
+
+    with pytest.raises(ProviderBusy):
+        scheduler.acquire(provider, timeout=0.1)
+
+
+def test_run_falls_back_within_the_policy_deadline():
+    scheduler = Scheduler(rate_limits={})
+    policy = CallPolicy(timeout=0.2, retries=2, name="test")
+    start = time.monotonic()
+
+    def call(provider):
+        time.sleep(2)
+
+    with pytest.raises(Exception):
+        scheduler.run(policy, [LimitedProvider()], call)
+    # A timed-out attempt is not retried, so the caller can fall back right away
+    assert time.monotonic() - start < 1
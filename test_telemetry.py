@@ -0,0 +1,43 @@
+"""Tests for spans, error counting and the span log in telemetry.py"""
+import json
+
+import pytest
+
+from telemetry import Telemetry
+
+
+def test_error_is_counted_once_across_nested_spans():
+    telemetry = Telemetry()
+    with pytest.raises(ValueError):
+        with telemetry.span("analyze"):
+            with telemetry.span("vision_generate"):
+                raise ValueError("provider down")
+
+    counters = telemetry.snapshot()["counters"]
+    assert counters == {'errors_total{stage="vision_generate"}': 1}
+    # Both spans still carry the error in the span log
+    assert [span.get("error") for span in telemetry.spans] == ["provider down", "provider down"]
+
+
+def test_spans_are_written_to_the_jsonl_file(tmp_path):
+    path = tmp_path / "spans.jsonl"
+    telemetry = Telemetry(jsonl_path=str(path))
+    with telemetry.span("analyze"):
+        with telemetry.span("decode"):
+            pass
+    telemetry.close()
+
+    records = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert [record["stage"] for record in records] == ["decode", "analyze"]
+    assert records[0]["parent_id"] == records[1]["span_id"]
+
+
+def test_labelled_durations_are_kept_apart():
+    telemetry = Telemetry()
+    telemetry.record_duration("api_request", 0.1, path="/chat")
+    telemetry.record_duration("api_request", 0.3, path="/analyze")
+
+    stages = telemetry.snapshot()["stages"]
+    assert stages['api_request{path="/chat"}']["count"] == 1
+    assert stages['api_request{path="/analyze"}']["count"] == 1
+    assert 'yoga_stage_seconds_count{path="/chat",stage="api_request"} 1' in telemetry.export_prometheus()
@@ -0,0 +1,95 @@
+"""Tests for frame sampling, pose stability and offline video analysis in webcam.py"""
+import numpy as np
+import pytest
+
+from webcam import PoseFrameAnalyzer, analyze_video_file
+
+
+class StubAnalysis:
+    """Stands in for YogaPoseAnalysis: frames with more red than blue are Tree Pose"""
+
+    def __init__(self):
+        self.feedback_requests = []
+
+    def is_ready(self):
+        return True
+
+    def classify_batch(self, images, top_k=1):
+        results = []
+        for image in images:
+            image = np.asarray(image, dtype=np.float32)
+            red, blue = image[..., 0].mean(), image[..., 2].mean()
+            results.append([("Tree Pose", 0.9) if red > blue else ("Warrior II", 0.9)])
+        return results
+
+    def detect_keypoints(self, image):
+        return None
+
+    def score_alignment(self, keypoints, label):
+        return None
+
+    def analyze_image(self, image):
+        self.feedback_requests.append(image.size)
+        return {'pose_name': "Tree Pose", 'full_analysis': "Stand tall."}
+
+
+def frame(red, blue, size=32):
+    image = np.zeros((size, size, 3), dtype=np.uint8)
+    image[..., 0] = red
+    image[..., 2] = blue
+    return image
+
+
+def test_frames_are_sampled_at_the_target_rate():
+    analyzer = PoseFrameAnalyzer(StubAnalysis(), target_fps=5, feedback_in_background=False)
+    for index in range(30):
+        analyzer.process_array(frame(200, 0), timestamp=index / 30)
+
+    state = analyzer.get_state()
+    assert state['frames_seen'] == 30
+    assert state['frames_classified'] == 5
+
+
+def test_feedback_is_requested_once_the_pose_is_held():
+    analysis = StubAnalysis()
+    analyzer = PoseFrameAnalyzer(analysis, target_fps=10, stable_frames=3, feedback_in_background=False)
+    for index in range(2):
+        analyzer.process_array(frame(200, 0), timestamp=index / 10)
+    assert analyzer.get_state()['stable_pose'] is None
+
+    analyzer.process_array(frame(0, 200), timestamp=0.2)
+    for index in range(3, 6):
+        analyzer.process_array(frame(200, 0), timestamp=index / 10)
+
+    state = analyzer.get_state()
+    assert state['stable_pose'] == "Tree Pose"
+    assert state['feedback']['pose'] == "Tree Pose"
+    assert len(analysis.feedback_requests) == 1
+
+
+def test_video_file_is_analyzed_offline(tmp_path):
+    cv2 = pytest.importorskip("cv2")
+    path = str(tmp_path / "clip.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 10.0, (64, 64))
+    assert writer.isOpened()
+    for index in range(30):
+        # OpenCV frames are BGR: blue for the first second, then red
+        writer.write(frame(200, 0, 64)[:, :, ::-1] if index >= 10 else frame(0, 200, 64)[:, :, ::-1])
+    writer.release()
+
+    analysis = StubAnalysis()
+    states = analyze_video_file(path, analysis, target_fps=5, stable_frames=3)
+
+    assert len(states) == 15
+    assert [state['timestamp'] for state in states[:3]] == pytest.approx([0.0, 0.2, 0.4])
+    assert states[0]['pose'] == "Warrior II"
+    assert states[-1]['stable_pose'] == "Tree Pose"
+    # Feedback for each pose once it had been held for three samples
+    assert [state['feedback']['pose'] for state in states if state['feedback']][-1] == "Tree Pose"
+    assert len(analysis.feedback_requests) == 2
+
+
+def test_missing_video_file_is_an_error(tmp_path):
+    pytest.importorskip("cv2")
+    with pytest.raises(ValueError):
+        analyze_video_file(str(tmp_path / "missing.avi"), StubAnalysis())
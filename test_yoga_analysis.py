@@ -0,0 +1,89 @@
+"""Tests for pose name extraction and section parsing of vision model answers in yoga_analysis.py"""
+from yoga_analysis import AnalysisStreamParser, extract_pose_name, parse_sections
+
+NUMBERED = """**1. Pose Identification and Classification:**
+Pose: Tree Pose
+A standing balance.
+
+**2. Alignment Analysis:**
+Hips are level.
+
+**3. Suggested Adjustments and Corrections:**
+1. Press the foot into the thigh.
+2. Lengthen the spine.
+
+**4. Safety Considerations and Precautions:**
+Keep the standing knee soft.
+
+**5. Benefits of the Pose:**
+Builds balance.
+
+**6. Common Mistakes to Avoid:**
+Resting the foot on the knee.
+"""
+
+
+def test_numbered_sections_are_split():
+    sections = parse_sections(NUMBERED)
+
+    assert list(sections) == ['identification', 'alignment', 'adjustments', 'safety', 'benefits', 'mistakes']
+    assert sections['identification'] == "Pose: Tree Pose\nA standing balance."
+    # A numbered list inside a section is not a heading
+    assert sections['adjustments'] == "1. Press the foot into the thigh.\n2. Lengthen the spine."
+
+
+def test_pose_name_comes_from_the_marker_line():
+    assert extract_pose_name(NUMBERED) == "Tree Pose"
+    assert extract_pose_name("Here's an analysis of the pose:\nPose: **Warrior II**") == "Warrior II"
+    assert extract_pose_name("Nothing useful here.") == "Pose name not identified"
+
+
+def test_preamble_before_the_first_heading_is_dropped():
+    sections = parse_sections("Here's a detailed analysis of the pose:\n\n" + NUMBERED)
+
+    assert sections['identification'] == "Pose: Tree Pose\nA standing balance."
+
+
+def test_unnumbered_markdown_headings_may_skip_sections():
+    text = (
+        "Pose: Chair Pose\n"
+        "### Alignment Analysis\n"
+        "Knees track over the toes.\n"
+        "### Safety Considerations\n"
+        "Avoid with knee injuries.\n"
+        "### Benefits\n"
+        "Strengthens the legs.\n"
+    )
+    sections = parse_sections(text)
+
+    assert sections == {
+        'identification': "Pose: Chair Pose",
+        'alignment': "Knees track over the toes.",
+        'safety': "Avoid with knee injuries.",
+        'benefits': "Strengthens the legs.",
+    }
+
+
+def test_bold_phrase_naming_a_later_section_is_not_a_heading():
+    text = (
+        "**Pose Identification:** Pose: Plank Pose\n"
+        "**Alignment Analysis:**\n"
+        "Shoulders over wrists.\n"
+        "**Benefits:** come later, once the core is engaged.\n"
+    )
+    sections = parse_sections(text)
+
+    assert sections['alignment'] == "Shoulders over wrists.\n**Benefits:** come later, once the core is engaged."
+    assert 'benefits' not in sections
+
+
+def test_streamed_chunks_parse_like_the_whole_text():
+    parser = AnalysisStreamParser()
+    events = []
+    for start in range(0, len(NUMBERED), 7):
+        events.extend(parser.feed(NUMBERED[start:start + 7]))
+    events.extend(parser.finish())
+
+    assert events[0] == ('pose_name', "Tree Pose")
+    assert [event[1] for event in events if event[0] == 'section'] == list(parse_sections(NUMBERED))
+    assert parser.sections == parse_sections(NUMBERED)
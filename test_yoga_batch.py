@@ -0,0 +1,42 @@
+"""Tests for resuming batch runs in yoga_batch.py"""
+import json
+
+from yoga_batch import list_images, load_completed
+
+
+def write_records(path, records):
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+        # A crash can leave a partial last line
+        f.write('{"id": "cut')
+
+
+def test_only_successful_records_are_done(tmp_path):
+    path = tmp_path / "results.jsonl"
+    write_records(path, [
+        {'id': "a.jpg", 'status': 'ok', 'mode': 'local'},
+        {'id': "b.jpg", 'status': 'error', 'mode': 'local', 'error': "unreadable"},
+    ])
+
+    assert load_completed(str(path)) == {"a.jpg"}
+    assert load_completed(str(tmp_path / "missing.jsonl")) == set()
+
+
+def test_remote_rerun_redoes_local_only_records(tmp_path):
+    path = tmp_path / "results.jsonl"
+    write_records(path, [
+        {'id': "a.jpg", 'status': 'ok', 'mode': 'local'},
+        {'id': "b.jpg", 'status': 'ok', 'mode': 'remote', 'remote': {'pose_name': "Tree Pose"}},
+    ])
+
+    assert load_completed(str(path), remote=True) == {"b.jpg"}
+    # A remote result covers a later local-only run too
+    assert load_completed(str(path)) == {"a.jpg", "b.jpg"}
+
+
+def test_manifest_lists_paths_and_urls(tmp_path):
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text("# poses\nimages/a.jpg\n\n{\"url\": \"https://example.com/b.png\"}\n", encoding='utf-8')
+
+    assert list_images(str(manifest)) == ["images/a.jpg", "https://example.com/b.png"]
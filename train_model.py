@@ -0,0 +1,272 @@
+"""Train the local pose classifier on a labeled image directory.
+
+Usage:
+    python train_model.py DATA_DIR [--output-dir models] [--epochs 30] [--install]
+
+DATA_DIR holds one subdirectory per pose, named with the pose label
+("Tree Pose/", "Warrior II/", ...). Images are streamed through a tf.data
+pipeline that decodes in parallel and prefetches. Decoding uses the same
+ImageProcessor preprocessing as inference, so training and serving see the
+same pixels.
+
+Only the dense head is trained; MobileNetV2 stays frozen. Its pooled
+features (the "bottleneck") are therefore computed once per image and kept in
+a cache file, and later runs, including retraining after adding images,
+only run the backbone on images that are new or changed.
+
+Each run writes models/vN/yoga_pose_model.h5 plus labels.json with the label
+order and training metrics. --install also copies both to the paths the app
+loads and removes the app's TFLite export, which would still hold the old
+model; re-run model_export.py to export the new one.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from model_export import TFLITE_PATH, export_metadata_path
+from model_generation import LABELS_PATH, MODEL_PATH, POSE_LABELS, create_default_model
+from yoga_batch import IMAGE_EXTENSIONS
+
+BOTTLENECK_CACHE = os.path.join('cache', 'bottleneck', 'mobilenet_v2_224.npz')
+
+
+def list_labeled_images(data_dir):
+    """Return (labels, [(path, label_index)]) from one subdirectory per label
+
+    Labels the app already knows keep their POSE_LABELS order; any others
+    follow alphabetically.
+    """
+    found = sorted(
+        name for name in os.listdir(data_dir)
+        if os.path.isdir(os.path.join(data_dir, name))
+    )
+    labels = [label for label in POSE_LABELS if label in found]
+    labels += [label for label in found if label not in labels]
+
+    samples = []
+    for index, label in enumerate(labels):
+        for root, _, files in os.walk(os.path.join(data_dir, label)):
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    samples.append((os.path.join(root, name), index))
+    return labels, samples
+
+
+def file_key(path):
+    """Cache key that changes whenever the file is replaced or edited"""
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+
+def is_validation(path, fraction):
+    """Stable train/validation split: the same image always lands on the same side"""
+    bucket = int(hashlib.sha256(path.encode('utf-8')).hexdigest()[:8], 16)
+    return bucket % 1000 < fraction * 1000
+
+
+def image_dataset(paths, batch_size, target_size=(224, 224)):
+    """Stream preprocessed image batches, decoding in parallel with prefetch"""
+    import tensorflow as tf
+    from image_processor import ImageProcessor
+
+    processor = ImageProcessor()
+
+    def load(path):
+        batch = processor.preprocess_images([path.decode('utf-8')], target_size)
+        if batch is None:
+            # Keep the batch shape; the caller drops unreadable images by index
+            return np.full((target_size[1], target_size[0], 3), -1.0, dtype=np.float32)
+        return batch[0]
+
+    def decode(path):
+        image = tf.numpy_function(load, [path], tf.float32)
+        image.set_shape((target_size[1], target_size[0], 3))
+        return image
+
+    return (
+        tf.data.Dataset.from_tensor_slices(list(paths))
+        .map(decode, num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
+        .batch(batch_size)
+        .prefetch(tf.data.AUTOTUNE)
+    )
+
+
+def load_bottleneck_cache(path):
+    if not os.path.exists(path):
+        return {}
+    data = np.load(path, allow_pickle=False)
+    return dict(zip(data['keys'].tolist(), data['features']))
+
+
+def save_bottleneck_cache(path, cache):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    keys = sorted(cache)
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, keys=np.array(keys), features=np.stack([cache[key] for key in keys]))
+    os.replace(tmp_path, path)
+
+
+def bottleneck_features(backbone, paths, batch_size=32, cache_path=BOTTLENECK_CACHE):
+    """Pooled backbone features for paths, computing only those missing from the cache
+
+    Returns (features, readable) where readable marks the images that decoded.
+    """
+    cache = load_bottleneck_cache(cache_path)
+    keys = [file_key(path) for path in paths]
+    missing = [path for path, key in zip(paths, keys) if key not in cache]
+    print(f"Bottleneck features: {len(paths) - len(missing)} cached, {len(missing)} to compute")
+
+    if missing:
+        start = time.perf_counter()
+        offset = 0
+        for batch in image_dataset(missing, batch_size):
+            features = np.asarray(backbone.predict_on_batch(batch))
+            unreadable = np.asarray(batch)[:, 0, 0, 0] < 0
+            for row, (path, feature) in enumerate(zip(missing[offset:offset + len(features)], features)):
+                if unreadable[row]:
+                    print(f"Skipping unreadable image {path}")
+                else:
+                    cache[file_key(path)] = feature
+            offset += len(features)
+        print(f"Computed {len(missing)} bottlenecks in {time.perf_counter() - start:.1f}s")
+        save_bottleneck_cache(cache_path, cache)
+
+    readable = np.array([key in cache for key in keys])
+    if not readable.any():
+        raise ValueError("No readable training images")
+    width = len(next(iter(cache.values())))
+    features = np.stack([cache[key] if key in cache else np.zeros(width, np.float32) for key in keys])
+    return features, readable
+
+
+def split_model(model):
+    """Split the default model into (frozen backbone + pooling, trainable head)"""
+    import tensorflow as tf
+
+    backbone = tf.keras.Sequential(model.layers[:2], name='bottleneck')
+    head_input = tf.keras.Input(shape=(backbone.output_shape[-1],))
+    x = head_input
+    for layer in model.layers[2:]:
+        x = layer(x)
+    # The head shares its layers with model, so training it trains model
+    return backbone, tf.keras.Model(head_input, x, name='head')
+
+
+def feature_dataset(features, labels, batch_size, shuffle):
+    import tensorflow as tf
+
+    dataset = tf.data.Dataset.from_tensor_slices((features, labels)).cache()
+    if shuffle:
+        dataset = dataset.shuffle(len(features), reshuffle_each_iteration=True)
+    return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+
+def next_version_dir(output_dir):
+    versions = [
+        int(name[1:]) for name in os.listdir(output_dir)
+        if name.startswith('v') and name[1:].isdigit()
+    ] if os.path.isdir(output_dir) else []
+    return os.path.join(output_dir, f"v{max(versions, default=0) + 1}")
+
+
+def train(data_dir, output_dir='models', epochs=30, batch_size=32, learning_rate=1e-3,
+          val_fraction=0.2, cache_path=BOTTLENECK_CACHE, install=False):
+    """Train the classifier head and write a versioned model with its label map"""
+    import tensorflow as tf
+
+    labels, samples = list_labeled_images(data_dir)
+    if len(labels) < 2:
+        raise ValueError(f"Need at least two label directories in {data_dir}")
+    print(f"{len(samples)} images across {len(labels)} labels")
+
+    model = create_default_model(num_classes=len(labels))
+    backbone, head = split_model(model)
+
+    paths = [path for path, _ in samples]
+    targets = np.array([label for _, label in samples], dtype=np.int32)
+    features, readable = bottleneck_features(backbone, paths, batch_size, cache_path)
+    validation = np.array([is_validation(path, val_fraction) for path in paths])
+    train_mask, val_mask = readable & ~validation, readable & validation
+
+    head.compile(
+        optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate),
+        loss='sparse_categorical_crossentropy',
+        metrics=['accuracy']
+    )
+    val_data = None
+    callbacks = []
+    if val_mask.any():
+        val_data = feature_dataset(features[val_mask], targets[val_mask], batch_size, shuffle=False)
+        callbacks.append(tf.keras.callbacks.EarlyStopping(patience=5, restore_best_weights=True))
+    history = head.fit(
+        feature_dataset(features[train_mask], targets[train_mask], batch_size, shuffle=True),
+        validation_data=val_data,
+        epochs=epochs,
+        callbacks=callbacks,
+        verbose=2
+    )
+
+    metrics = {name: float(values[-1]) for name, values in history.history.items()}
+    if val_data is not None:
+        metrics['val_loss'], metrics['val_accuracy'] = [float(v) for v in head.evaluate(val_data, verbose=0)]
+
+    version_dir = next_version_dir(output_dir)
+    os.makedirs(version_dir)
+    model_path = os.path.join(version_dir, MODEL_PATH)
+    labels_path = os.path.join(version_dir, LABELS_PATH)
+    model.save(model_path)
+    with open(labels_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'version': os.path.basename(version_dir),
+            'labels': labels,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'train_images': int(train_mask.sum()),
+            'validation_images': int(val_mask.sum()),
+            'metrics': metrics,
+        }, f, indent=2)
+    print(f"Saved {model_path} with {labels_path}: {metrics}")
+
+    if install:
+        shutil.copyfile(model_path, MODEL_PATH)
+        shutil.copyfile(labels_path, LABELS_PATH)
+        print(f"Installed as {MODEL_PATH} and {LABELS_PATH}")
+        if os.path.exists(TFLITE_PATH):
+            # The app prefers the TFLite export, which still holds the old model
+            os.remove(TFLITE_PATH)
+            if os.path.exists(export_metadata_path(TFLITE_PATH)):
+                os.remove(export_metadata_path(TFLITE_PATH))
+            print(f"Removed the outdated {TFLITE_PATH}; re-run model_export.py to export the new model")
+    return version_dir
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='yoga-train', description="Train the local pose classifier")
+    parser.add_argument('data_dir', help="Directory with one subdirectory of images per pose label")
+    parser.add_argument('--output-dir', default='models', help="Versioned models are written under this directory")
+    parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--learning-rate', type=float, default=1e-3)
+    parser.add_argument('--val-fraction', type=float, default=0.2, help="Share of images held out for validation")
+    parser.add_argument('--bottleneck-cache', default=BOTTLENECK_CACHE, help="Cached backbone features file")
+    parser.add_argument('--install', action='store_true', help="Copy the trained model and labels to where the app loads them")
+    args = parser.parse_args(argv)
+
+    train(
+        args.data_dir,
+        output_dir=args.output_dir,
+        epochs=args.epochs,
+        batch_size=args.batch_size,
+        learning_rate=args.learning_rate,
+        val_fraction=args.val_fraction,
+        cache_path=args.bottleneck_cache,
+        install=args.install,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
+class PoseFrameAnalyzer:
+    """Classify sampled video frames and request feedback once a pose is held
+
+    Frames are sampled so classification keeps up with target_fps: when the
+    classifier takes longer than the frame budget, the next sample is pushed
+    back by the measured inference time instead. Gemini feedback is requested
+    only after the same pose has been classified for stable_frames samples in
+    a row.
+    """
+
+    def __init__(self, yoga_analysis, target_fps=5, stable_frames=8, min_confidence=0.5,
+                 feedback_in_background=True, on_feedback=None):
+        self.yoga_analysis = yoga_analysis
+        self.target_fps = target_fps
+        self.stable_frames = stable_frames
+        self.min_confidence = min_confidence
+        self.feedback_in_background = feedback_in_background
+        self.on_feedback = on_feedback
+
+        self.recent_labels = deque(maxlen=stable_frames)
+        self.next_sample_time = None
+        self.inference_seconds = 0.0
+        self.frames_seen = 0
+        self.frames_classified = 0
+        self.current_pose = None
+        self.current_confidence = 0.0
+        self.alignment = None
+        self.stable_pose = None
+        self.feedback_pose = None
+        self.feedback = None
+        self._feedback_thread = None
+        self._lock = threading.Lock()
+
+    def should_sample(self, timestamp):
+        """True if the frame at timestamp should be classified"""
+        # The tolerance keeps float error from skipping a frame due exactly at the next sample time
+        return self.next_sample_time is None or timestamp >= self.next_sample_time - 1e-3
+
+    def process_array(self, rgb_array, timestamp=None):
+        """Feed one RGB frame; returns the current state snapshot"""
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        self.frames_seen += 1
+        if not self.yoga_analysis.is_ready() or not self.should_sample(timestamp):
+            return self.get_state()
+
+        start = time.perf_counter()
+        label, confidence = self.yoga_analysis.classify_batch([rgb_array], top_k=1)[0][0]
+        # Keypoint scoring is part of the per-frame cost, so it counts toward the sampling budget
+        alignment = self.yoga_analysis.score_alignment(self.yoga_analysis.detect_keypoints(rgb_array), label)
+        elapsed = time.perf_counter() - start
+        # Smooth the inference cost so one slow frame does not stall sampling;
+        # the first call includes graph tracing, so it is left out
+        if self.frames_classified == 1:
+            self.inference_seconds = elapsed
+        elif self.frames_classified > 1:
+            self.inference_seconds = 0.8 * self.inference_seconds + 0.2 * elapsed
+        self.next_sample_time = timestamp + max(1.0 / self.target_fps, self.inference_seconds)
+        self.frames_classified += 1
+
+        with self._lock:
+            self.current_pose = label
+            self.current_confidence = confidence
+            self.alignment = alignment
+            self.recent_labels.append(label if confidence >= self.min_confidence else None)
+            stable = (
+                len(self.recent_labels) == self.stable_frames
+                and self.recent_labels[0] is not None
+                and all(l == self.recent_labels[0] for l in self.recent_labels)
+            )
+            self.stable_pose = label if stable else None
+            busy = self._feedback_thread is not None and self._feedback_thread.is_alive()
+            trigger = stable and label != self.feedback_pose and not busy
+            if trigger:
+                self.feedback_pose = label
+
+        if trigger:
+            self.request_feedback(rgb_array, label)
+        return self.get_state()
+
+    def request_feedback(self, rgb_array, pose_label):
+        """Ask the vision model for detailed feedback on a held pose"""
+        frame = np.ascontiguousarray(rgb_array)
+
+        def run():
+            import PIL.Image
+            result = self.yoga_analysis.analyze_image(PIL.Image.fromarray(frame))
+            with self._lock:
+                self.feedback = {'pose': pose_label, 'result': result}
+            if self.on_feedback:
+                self.on_feedback(pose_label, result)
+
+        if self.feedback_in_background:
+            self._feedback_thread = threading.Thread(target=run, name="pose-feedback", daemon=True)
+            self._feedback_thread.start()
+        else:
+            run()
+
+    def get_state(self):
+        """Snapshot of the latest classification and feedback"""
+        with self._lock:
+            return {
+                'pose': self.current_pose,
+                'confidence': self.current_confidence,
+                'stable_pose': self.stable_pose,
+                'alignment': self.alignment,
+                'feedback': self.feedback,
+                'frames_seen': self.frames_seen,
+                'frames_classified': self.frames_classified,
+                'inference_ms': self.inference_seconds * 1000,
+            }
+
+
+class PoseVideoProcessor:
+    """streamlit-webrtc video processor that overlays the live pose classification"""
+
+    def __init__(self, analyzer):
+        self.analyzer = analyzer
+
+    def annotate(self, bgr_image, state):
+        """Draw the current pose label onto the frame"""
+        # Imported on first use so loading the app does not load OpenCV
+        import cv2
+        if state['pose']:
+            text = f"{state['pose']} ({state['confidence']:.0%})"
+            color = (0, 200, 0) if state['stable_pose'] else (0, 200, 255)
+            cv2.putText(bgr_image, text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
+        if state.get('alignment'):
+            alignment = state['alignment']
+            text = f"Alignment {alignment['score']:.0f}/100"
+            cv2.putText(bgr_image, text, (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+            for i, correction in enumerate(alignment['corrections'][:2]):
+                cv2.putText(bgr_image, correction.replace('°', ''), (10, 90 + 25 * i),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.55, (0, 200, 255), 1)
+        return bgr_image
+
+    def recv(self, frame):
+        bgr_image = frame.to_ndarray(format="bgr24")
+        state = self.analyzer.process_array(bgr_image[:, :, ::-1])
+        bgr_image = self.annotate(bgr_image, state)
+        return type(frame).from_ndarray(bgr_image, format="bgr24")
+
+
+def analyze_video_file(video_path, yoga_analysis, **analyzer_options):
+    """Run a recorded video through the same frame analyzer offline
+
+    Frames are timed by their position in the video rather than the wall
+    clock, and feedback runs inline, so results are repeatable. Returns the
+    list of states for the frames that were classified.
+    """
+    import cv2
+    analyzer_options.setdefault('feedback_in_background', False)
+    analyzer = PoseFrameAnalyzer(yoga_analysis, **analyzer_options)
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise ValueError(f"Unable to open video file: {video_path}")
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+
+    states = []
+    frame_index = 0
+    try:
+        while True:
+            ok, bgr_image = capture.read()
+            if not ok:
+                break
+            classified_before = analyzer.frames_classified
+            state = analyzer.process_array(bgr_image[:, :, ::-1], timestamp=frame_index / fps)
+            if analyzer.frames_classified > classified_before:
+                states.append(dict(state, timestamp=frame_index / fps))
+            frame_index += 1
+    finally:
+        capture.release()
+    return states
+
+
+def render_live_camera(yoga_analysis, key="live-pose"):
+    """Render the live camera widget with the current pose and feedback"""
+    import streamlit as st
+    from streamlit_webrtc import webrtc_streamer
+
+    ctx = webrtc_streamer(
+        key=key,
+        video_processor_factory=lambda: PoseVideoProcessor(PoseFrameAnalyzer(yoga_analysis)),
+        media_stream_constraints={"video": True, "audio": False},
+        async_processing=True,
+    )
+    if not ctx.video_processor:
+        st.caption("Start the camera to analyze your pose in real time.")
+        return
+
+    # Frames are processed off the script thread; refresh to pick up new results
+    st.button("🔄 Refresh live results")
+    state = ctx.video_processor.analyzer.get_state()
+    if state['pose']:
+        st.metric(label="Live Pose", value=state['pose'], delta=f"{state['confidence']:.0%} confidence")
+    if state['alignment']:
+        st.metric(label="Alignment Score", value=f"{state['alignment']['score']:.0f}/100")
+        for correction in state['alignment']['corrections']:
+            st.markdown(f"- {correction}")
+    if state['feedback']:
+        with st.expander(f"📝 Feedback for {state['feedback']['pose']}"):
+            st.markdown(state['feedback']['result']['full_analysis'])
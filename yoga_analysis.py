@@ -1,77 +1,623 @@
-import tensorflow as tf
-import google.generativeai as genai
-import os
-import PIL.Image
-from dotenv import load_dotenv
-import re
-
-class YogaPoseAnalysis:
-    def __init__(self):
-        load_dotenv()
-        self.setup_apis()
-        self.load_models()
-
-    def setup_apis(self):
-        self.GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-        if self.GEMINI_API_KEY:
-            genai.configure(api_key=self.GEMINI_API_KEY)
-            self.gemini_vision_model = genai.GenerativeModel('gemini-1.5-flash')
-
-    def load_models(self):
-        try:
-            self.pose_classifier = tf.keras.models.load_model('yoga_pose_model.h5')
-        except:
-            from model_generation import create_default_model
-            self.pose_classifier = create_default_model()
-            self.pose_classifier.save('yoga_pose_model.h5')
-
-    def extract_pose_name(self, analysis_text):
-        """Extract pose name from the analysis text"""
-        try:
-            # Look for pose name in the first few lines of analysis
-            first_paragraph = analysis_text.split('\n')[0:5]
-            for line in first_paragraph:
-                # Look for common patterns in pose identification
-                if any(x in line.lower() for x in ['pose:', 'asana:', 'position:', 'identified as']):
-                    # Extract the pose name, typically following these markers
-                    pose_name = line.split(':')[-1].strip()
-                    return pose_name
-            # If no specific markers found, take the first sentence that might contain pose name
-            for line in first_paragraph:
-                if 'pose' in line.lower() or 'asana' in line.lower():
-                    return line.strip()
-            return "Pose name not identified"
-        except:
-            return "Pose name not identified"
-
-    def analyze_image(self, image_path):
-        try:
-            img = PIL.Image.open(image_path)
-            
-            prompt = """
-            You are a professional yoga instructor and alignment specialist. Analyze this yoga pose 
-            and provide a detailed assessment including:
-            1. Pose Identification and Classification (Start with 'Pose:' followed by the pose name)
-            2. Alignment Analysis
-            3. Suggested Adjustments and Corrections
-            4. Safety Considerations and Precautions
-            5. Benefits of the Pose
-            6. Common Mistakes to Avoid
-            
-            Use a supportive and encouraging tone while maintaining professional accuracy.
-            Emphasize proper form and safety in practice.
-            """
-
-            response = self.gemini_vision_model.generate_content([prompt, img])
-            analysis_text = response.text if response and response.text else "Unable to generate pose analysis."
-            
-            return {
-                'full_analysis': analysis_text,
-                'pose_name': self.extract_pose_name(analysis_text)
-            }
-            
-        except Exception as e:
-            return {
-                'full_analysis': f"Analysis error: {e}",
-                'pose_name': "Analysis Failed"
-            }
\ No newline at end of file
+import numpy as np
+import os
+from dotenv import load_dotenv
+import re
+import threading
+import time
+from alignment import AlignmentScorer, describe_alignment, load_keypoint_detector
+from analysis_cache import AnalysisCache, content_digest, source_digest
+from image_processor import ImageProcessor
+from model_generation import LABELS_PATH, MODEL_PATH, POSE_LABELS, load_pose_labels
+from providers import ProviderTimeout, build_vision_providers, policy_from_env
+from scheduler import scheduler
+from telemetry import span, telemetry
+
+ANALYSIS_PROMPT = """
+            You are a professional yoga instructor and alignment specialist. Analyze this yoga pose 
+            and provide a detailed assessment including:
+            1. Pose Identification and Classification (Start with 'Pose:' followed by the pose name)
+            2. Alignment Analysis
+            3. Suggested Adjustments and Corrections
+            4. Safety Considerations and Precautions
+            5. Benefits of the Pose
+            6. Common Mistakes to Avoid
+            
+            Use a supportive and encouraging tone while maintaining professional accuracy.
+            Emphasize proper form and safety in practice.
+            """
+
+# (key, display title, heading keywords) in the order the prompt requests them
+ANALYSIS_SECTIONS = [
+    ('identification', "Pose Identification", ['identification', 'classification']),
+    ('alignment', "Alignment Analysis", ['alignment']),
+    ('adjustments', "Suggested Adjustments", ['adjustment', 'correction']),
+    ('safety', "Safety Considerations", ['safety', 'precaution']),
+    ('benefits', "Benefits", ['benefit']),
+    ('mistakes', "Common Mistakes", ['mistake']),
+]
+
+POSE_NAME_MARKERS = ['pose:', 'asana:', 'position:', 'identified as']
+
+
+def marker_pose_name(line):
+    """Return the pose name following a marker such as 'Pose:' on line, or None
+
+    A marker with nothing after it, as in "Here's an analysis of the pose:",
+    does not name a pose.
+    """
+    if not any(x in line.lower() for x in POSE_NAME_MARKERS):
+        return None
+    return line.split(':')[-1].strip().strip('*_').strip() or None
+
+
+def extract_pose_name(analysis_text):
+    """Extract pose name from the analysis text"""
+    try:
+        # Look for pose name in the first few lines of analysis
+        first_paragraph = analysis_text.split('\n')[0:5]
+        for line in first_paragraph:
+            # Look for common patterns in pose identification
+            pose_name = marker_pose_name(line)
+            if pose_name:
+                return pose_name
+        # If no specific markers found, take the first sentence that might contain pose name
+        for line in first_paragraph:
+            if 'pose' in line.lower() or 'asana' in line.lower():
+                return line.strip()
+        return "Pose name not identified"
+    except:
+        return "Pose name not identified"
+
+
+def match_section_heading(line, next_index):
+    """Return the index of the section a heading line opens, or None
+
+    A heading is numbered with the section's number, a markdown heading
+    naming any section not reached yet (so a skipped section does not merge
+    the rest into the current one), or a bold line naming the next expected
+    section. Numbered lists and bold phrases inside a section are therefore
+    not mistaken for headings.
+    """
+    raw = line.strip()
+    stripped = raw.lstrip('#*_ ').strip()
+    title = stripped.split(':', 1)[0]
+    if not title or len(title.split()) > 10:
+        return None
+    number = re.match(r'(\d)[.)]\s', stripped)
+    markdown_heading = raw.startswith('#')
+    bold = raw.startswith('**')
+    lowered = title.lower()
+    for index in range(next_index, len(ANALYSIS_SECTIONS)):
+        if not any(keyword in lowered for keyword in ANALYSIS_SECTIONS[index][2]):
+            continue
+        if number is not None:
+            if int(number.group(1)) == index + 1:
+                return index
+        elif markdown_heading or (bold and index == next_index):
+            return index
+    return None
+
+
+def heading_remainder(line):
+    """Return any text that follows the heading on the same line"""
+    if ':' not in line:
+        return ""
+    return line.split(':', 1)[1].strip().lstrip('*_ ').strip()
+
+
+def parse_sections(analysis_text):
+    """Split the analysis text into a dict of section key -> section text"""
+    parser = AnalysisStreamParser()
+    parser.feed(analysis_text)
+    parser.finish()
+    return parser.sections
+
+
+class AnalysisStreamParser:
+    """Incrementally parse streamed analysis text into the pose name and sections
+
+    feed() and finish() return lists of events: ('pose_name', name) once the
+    pose is identified and ('section', key, text) as each section completes.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.sections = {}
+        self.pose_name = None
+        self._pending = ""
+        self._lines_seen = 0
+        self._current = 0
+        self._current_lines = []
+        self._heading_seen = False
+
+    def feed(self, chunk):
+        """Consume a chunk of text and return events for every completed line"""
+        self.text += chunk
+        self._pending += chunk
+        events = []
+        while '\n' in self._pending:
+            line, self._pending = self._pending.split('\n', 1)
+            events.extend(self._consume_line(line))
+        return events
+
+    def finish(self):
+        """Flush the trailing line and the last open section"""
+        events = []
+        if self._pending:
+            events.extend(self._consume_line(self._pending))
+            self._pending = ""
+        events.extend(self._close_section())
+        if self.pose_name is None:
+            self.pose_name = extract_pose_name(self.text)
+            events.append(('pose_name', self.pose_name))
+        return events
+
+    def _consume_line(self, line):
+        events = []
+        self._lines_seen += 1
+        if self.pose_name is None and self._lines_seen <= 5:
+            pose_name = marker_pose_name(line)
+            if pose_name:
+                self.pose_name = pose_name
+                events.append(('pose_name', self.pose_name))
+            elif self._lines_seen == 5:
+                # No explicit marker in the first lines: fall back to the full rules
+                self.pose_name = extract_pose_name(self.text)
+                events.append(('pose_name', self.pose_name))
+
+        # Until the first heading, section 1's own heading may still follow a preamble
+        heading = match_section_heading(line, self._current + 1 if self._heading_seen else 0)
+        if heading is None:
+            self._current_lines.append(line)
+            return events
+
+        if heading == 0 and not self._heading_seen:
+            # Lines before the first heading were a preamble, not identification text
+            self._current_lines = []
+        else:
+            events.extend(self._close_section())
+        self._heading_seen = True
+        self._current = heading
+        self._current_lines = []
+        remainder = heading_remainder(line)
+        if remainder:
+            self._current_lines.append(remainder)
+        return events
+
+    def _close_section(self):
+        text = '\n'.join(self._current_lines).strip()
+        key = ANALYSIS_SECTIONS[self._current][0]
+        if not text or key in self.sections:
+            return []
+        self.sections[key] = text
+        return [('section', key, text)]
+
+
+class YogaPoseAnalysis:
+    def __init__(self, image_processor=None, load_in_background=False, load_classifier=True):
+        load_dotenv()
+        self.image_processor = image_processor or ImageProcessor()
+        self.pose_labels = POSE_LABELS
+        self.analysis_cache = AnalysisCache()
+        telemetry.register_collector("analysis_cache", self.analysis_cache.stats)
+        self.pose_classifier = None
+        self._embedding_model = None
+        self._pose_index = None
+        self.alignment_scorer = AlignmentScorer()
+        self._keypoint_detector = None
+        self._detector_loaded = False
+        self.model_error = None
+        self.model_ready = threading.Event()
+        self._load_lock = threading.Lock()
+        self._load_started = False
+        self.setup_apis()
+        if not load_classifier:
+            # Remote-only callers skip TensorFlow; classify_batch still loads on demand
+            return
+        if load_in_background:
+            # Let the UI render while TensorFlow and the classifier load
+            self._load_started = True
+            threading.Thread(target=self.load_models, name="pose-model-loader", daemon=True).start()
+        else:
+            self.load_models()
+
+    def setup_apis(self):
+        self.GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+        self.vision_providers = build_vision_providers(self.GEMINI_API_KEY)
+        self.vision_policy = policy_from_env("YOGA_VISION", timeout=30)
+        # Cached analyses are only reused for the same models and prompt
+        self.analysis_identity = content_digest(
+            ",".join(provider.model_id() for provider in self.vision_providers) + "|" + ANALYSIS_PROMPT
+        )
+        # Shared with the chat handler: coalescing, rate limits and priorities
+        self.scheduler = scheduler
+        # Answer from the local classifier when the vision model misses its deadline
+        self.local_fallback = True
+        # Reuse reference guidance instead of calling the vision model for close matches
+        threshold = os.getenv("YOGA_REFERENCE_THRESHOLD")
+        self.reference_threshold = float(threshold) if threshold else None
+
+    def load_models(self):
+        self._load_started = True
+        try:
+            with span("model_load"):
+                from model_export import TFLITE_PATH, TFLiteClassifier, is_current_export
+                tflite_path = os.getenv("YOGA_TFLITE_MODEL", TFLITE_PATH)
+                labels_path = os.getenv("YOGA_LABELS_PATH", LABELS_PATH)
+                if tflite_path and os.path.exists(tflite_path) and not is_current_export(
+                        tflite_path, MODEL_PATH, labels_path):
+                    # Not exported from the installed model: it may pair old weights with new labels
+                    print(f"Ignoring {tflite_path}: not exported from the installed model; re-run model_export.py")
+                    tflite_path = None
+                if tflite_path and os.path.exists(tflite_path):
+                    # Exported inference graph (see model_export.py): no Keras in memory
+                    num_threads = os.getenv("YOGA_TFLITE_THREADS")
+                    self.pose_classifier = TFLiteClassifier(
+                        tflite_path, num_threads=int(num_threads) if num_threads else None
+                    )
+                else:
+                    import tensorflow as tf
+                    try:
+                        self.pose_classifier = tf.keras.models.load_model(MODEL_PATH)
+                    except:
+                        from model_generation import create_default_model
+                        self.pose_classifier = create_default_model()
+                        self.pose_classifier.save(MODEL_PATH)
+                labels = load_pose_labels(labels_path)
+                num_outputs = self.pose_classifier.output_shape[-1]
+                if num_outputs != len(labels):
+                    self.pose_classifier = None
+                    raise ValueError(f"Classifier has {num_outputs} outputs but the label map has {len(labels)} labels")
+                self.pose_labels = labels
+        except Exception as e:
+            self.model_error = e
+            print(f"Error loading pose classifier: {e}")
+        finally:
+            self.model_ready.set()
+
+    def is_ready(self):
+        """True once the local classifier has finished loading"""
+        return self.model_ready.is_set() and self.pose_classifier is not None
+
+    def wait_until_ready(self, timeout=None):
+        """Block until the classifier is loaded; raise if loading failed"""
+        with self._load_lock:
+            if not self._load_started:
+                self.load_models()
+        if not self.model_ready.wait(timeout):
+            raise TimeoutError("Pose classifier is still loading")
+        if self.pose_classifier is None:
+            raise RuntimeError(f"Pose classifier failed to load: {self.model_error}")
+        return self.pose_classifier
+
+    def warmup(self):
+        """Load the classifier and SDK clients and run one inference so the first request is fast"""
+        self.wait_until_ready()
+        for provider in self.vision_providers:
+            provider.warmup()
+        self.classify_batch([np.zeros((224, 224, 3), dtype=np.uint8)], top_k=1)
+
+    def classify_batch(self, paths_or_arrays, top_k=3, batch_size=32):
+        """Classify images with the local pose classifier
+
+        Returns one list of (pose_label, confidence) pairs per input image,
+        ordered by decreasing confidence.
+        """
+        pose_classifier = self.wait_until_ready()
+        top_k = min(top_k, len(self.pose_labels))
+        results = []
+        for start in range(0, len(paths_or_arrays), batch_size):
+            batch = self.image_processor.preprocess_images(paths_or_arrays[start:start + batch_size])
+            if batch is None:
+                raise ValueError("Unable to preprocess image batch")
+            # Chunks already fit one batch, so skip predict()'s per-call dataset setup
+            with span("predict", batch_size=len(batch)):
+                probabilities = np.asarray(pose_classifier.predict_on_batch(batch))
+            # Top-k over the whole batch at once, then sort only the k candidates
+            top_indices = np.argpartition(-probabilities, top_k - 1, axis=1)[:, :top_k]
+            top_scores = np.take_along_axis(probabilities, top_indices, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            top_indices = np.take_along_axis(top_indices, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+            for indices, scores in zip(top_indices, top_scores):
+                results.append([
+                    (self.pose_labels[i], float(score)) for i, score in zip(indices, scores)
+                ])
+        return results
+
+    def embedding_model(self):
+        """MobileNetV2 + pooling, sharing weights with the classifier when it is a Keras model"""
+        if self._load_started:
+            self.model_ready.wait()
+        with self._load_lock:
+            if self._embedding_model is None:
+                import tensorflow as tf
+                model = self.pose_classifier
+                if not hasattr(model, 'layers'):
+                    # TFLite exports only expose probabilities; the frozen backbone is plain ImageNet
+                    from model_generation import create_default_model
+                    model = create_default_model()
+                self._embedding_model = tf.keras.Sequential(model.layers[:2], name='pose_embedding')
+        return self._embedding_model
+
+    def embed_batch(self, paths_or_arrays, batch_size=32):
+        """Pooled backbone embeddings, one row per image, for the reference pose index"""
+        embedding_model = self.embedding_model()
+        rows = []
+        for start in range(0, len(paths_or_arrays), batch_size):
+            batch = self.image_processor.preprocess_images(paths_or_arrays[start:start + batch_size])
+            if batch is None:
+                raise ValueError("Unable to preprocess image batch")
+            with span("embed", batch_size=len(batch)):
+                rows.append(np.asarray(embedding_model.predict_on_batch(batch), dtype=np.float32))
+        return np.concatenate(rows)
+
+    def pose_index(self):
+        """The reference pose index from YOGA_POSE_INDEX, or None if none was built"""
+        if self._pose_index is None:
+            from pose_index import INDEX_DIR, PoseIndex
+            index = PoseIndex(os.getenv("YOGA_POSE_INDEX", INDEX_DIR))
+            if not len(index):
+                return None
+            self._pose_index = index
+        return self._pose_index
+
+    def match_reference(self, image, top_k=5):
+        """Nearest reference poses for an image, or None without an index
+
+        Returns {'pose_name', 'similarity', 'matches', 'guidance'} where
+        guidance is the stored reference text for the pose, if any.
+        """
+        index = self.pose_index()
+        if index is None:
+            return None
+        with span("reference_search"):
+            matches = index.search(self.embed_batch([image]), top_k=top_k)[0]
+        pose_name, similarity = index.vote(matches)
+        return {
+            'pose_name': pose_name,
+            'similarity': similarity,
+            'matches': matches,
+            'guidance': index.guidance.get(pose_name),
+        }
+
+    def reference_result(self, image_blob):
+        """Analysis built from reference guidance when the image closely matches a reference"""
+        if self.reference_threshold is None:
+            return None
+        match = self.match_reference(image_blob['data'])
+        if match is None or match['guidance'] is None or match['similarity'] < self.reference_threshold:
+            return None
+        telemetry.increment("reference_matches_total")
+        analysis_text = (
+            f"Pose: {match['pose_name']}\n"
+            f"Matched the reference library ({match['similarity']:.0%} similarity).\n\n"
+            f"{match['guidance']}"
+        )
+        return self.build_result(analysis_text, pose_name=match['pose_name'])
+
+    def keypoint_detector(self):
+        """The keypoint detector, or None when no keypoint model is installed"""
+        with self._load_lock:
+            if not self._detector_loaded:
+                num_threads = os.getenv("YOGA_TFLITE_THREADS")
+                self._keypoint_detector = load_keypoint_detector(num_threads=int(num_threads) if num_threads else None)
+                self._detector_loaded = True
+        return self._keypoint_detector
+
+    def detect_keypoints(self, image):
+        """(17, 3) body keypoints for an image or RGB array, or None without a detector
+
+        Alignment is supplementary, so detection errors are recorded rather
+        than failing the analysis.
+        """
+        detector = self.keypoint_detector()
+        if detector is None:
+            return None
+        try:
+            if not isinstance(image, np.ndarray):
+                image = np.asarray(self.image_processor.load_image(image).convert("RGB"))
+            with span("keypoints"):
+                return detector.detect(image)
+        except Exception as e:
+            print(f"Error detecting keypoints: {e}")
+            telemetry.record_error("keypoints", e)
+            return None
+
+    def score_alignment(self, keypoints, pose_name=None):
+        """Structured alignment feedback for detected keypoints (see AlignmentScorer.score)"""
+        if keypoints is None:
+            return None
+        with span("alignment_score"):
+            return self.alignment_scorer.score(keypoints, pose_name)
+
+    def attach_alignment(self, result, keypoints):
+        """Add alignment feedback scored against the identified pose to a result"""
+        alignment = self.score_alignment(keypoints, result['pose_name'])
+        if alignment is not None:
+            result['alignment'] = alignment
+        return result
+
+    def analysis_prompt(self, alignment=None):
+        """The analysis prompt, with measured alignment for the model to phrase"""
+        if alignment is None:
+            return ANALYSIS_PROMPT
+        return f"{ANALYSIS_PROMPT}\n{describe_alignment(alignment)}"
+
+    def extract_pose_name(self, analysis_text):
+        """Extract pose name from the analysis text"""
+        with span("extract_pose_name"):
+            return extract_pose_name(analysis_text)
+
+    def build_result(self, analysis_text, pose_name=None, sections=None):
+        """Build the structured analysis result from the generated text"""
+        if sections is None:
+            sections = parse_sections(analysis_text)
+        return {
+            'full_analysis': analysis_text,
+            'pose_name': pose_name or self.extract_pose_name(analysis_text),
+            'sections': sections
+        }
+
+    def local_fallback_result(self, image_blob):
+        """Identify the pose with the local classifier when the vision model is too slow"""
+        if not (self.local_fallback and self.is_ready()):
+            return None
+        pose_name, confidence = self.classify_batch([image_blob['data']], top_k=1)[0][0]
+        identification = (
+            f"Pose: {pose_name}\n"
+            f"Identified by the local classifier ({confidence:.0%} confidence)."
+        )
+        return {
+            'full_analysis': (
+                f"{identification}\n\n"
+                "Detailed feedback is unavailable because the vision model did not respond in time. "
+                "Please try again shortly."
+            ),
+            'pose_name': pose_name,
+            'sections': {'identification': identification}
+        }
+
+    def generate_analysis(self, image_blob, alignment=None):
+        """Get the analysis text from the vision providers under the call policy"""
+        prompt = self.analysis_prompt(alignment)
+        with span("vision_generate"):
+            return self.scheduler.run(
+                self.vision_policy, self.vision_providers,
+                lambda provider: provider.generate(prompt, image_blob)
+            )
+
+    def analysis_cache_key(self, image):
+        """Cache key for an image's analysis: its source bytes plus the providers, models and prompt"""
+        return content_digest(f"{source_digest(image)}|{self.analysis_identity}")
+
+    def analyze_image(self, image):
+        """Analyze a pose image given as a path, bytes, file-like buffer or PIL image"""
+        try:
+            with span("analyze"):
+                # Keyed on the source bytes so a hit skips decoding and normalizing
+                cache_key = self.analysis_cache_key(image)
+                cached = self.analysis_cache.get(cache_key)
+                if cached is not None:
+                    return cached
+                # The same image already being analyzed is answered once for everyone
+                return self.scheduler.coalesce(('analysis', cache_key), lambda: self.analyze_source(image, cache_key))
+            
+        except Exception as e:
+            return {
+                'full_analysis': f"Analysis error: {e}",
+                'pose_name': "Analysis Failed",
+                'sections': {}
+            }
+
+    def analyze_source(self, image, cache_key):
+        """Analyze an image that missed the cache"""
+        # Send a compact, downscaled JPEG instead of the original upload
+        blob, _ = self.image_processor.normalize_image(image)
+        keypoints = self.detect_keypoints(blob['data'])
+        reference = self.reference_result(blob)
+        if reference is not None:
+            return self.attach_alignment(reference, keypoints)
+
+        try:
+            generated = self.generate_analysis(blob, self.score_alignment(keypoints))
+        except ProviderTimeout:
+            fallback = self.local_fallback_result(blob)
+            if fallback is None:
+                raise
+            telemetry.increment("local_fallbacks_total")
+            return self.attach_alignment(fallback, keypoints)
+        analysis_text = generated or "Unable to generate pose analysis."
+
+        result = self.attach_alignment(self.build_result(analysis_text), keypoints)
+        # Only successful analyses are cached so failures are retried
+        if generated:
+            self.analysis_cache.set(cache_key, result)
+        return result
+
+    def replay_result(self, result):
+        """Yield the stream events for an already finished result"""
+        yield ('pose_name', result['pose_name'])
+        for key, text in result.get('sections', {}).items():
+            yield ('section', key, text)
+        yield ('result', result)
+
+    def stream_analysis(self, image):
+        """Yield analysis events while Gemini is still generating
+
+        Yields ('pose_name', name) as soon as the pose line arrives,
+        ('section', key, text) as each numbered section completes, and finally
+        ('result', result) with the same structure analyze_image returns.
+        """
+        try:
+            cache_key = self.analysis_cache_key(image)
+            cached = self.analysis_cache.get(cache_key)
+            if cached is not None:
+                yield from self.replay_result(cached)
+                return
+            with self.scheduler.flight(('analysis', cache_key)) as (flight, leader):
+                if not leader:
+                    # Someone is already analyzing this image: wait and replay their result
+                    shared = self.scheduler.shared_result(flight)
+                    if shared is not None:
+                        yield from self.replay_result(shared)
+                        return
+                blob, _ = self.image_processor.normalize_image(image)
+                result = yield from self.stream_blob(blob, cache_key)
+                if leader:
+                    flight.set_result(result)
+
+        except Exception as e:
+            telemetry.record_error("stream_analysis", e)
+            yield ('result', {
+                'full_analysis': f"Analysis error: {e}",
+                'pose_name': "Analysis Failed",
+                'sections': {}
+            })
+
+    def stream_blob(self, blob, cache_key):
+        """Stream the analysis of a normalized image that missed the cache; returns the result"""
+        keypoints = self.detect_keypoints(blob['data'])
+        reference = self.reference_result(blob)
+        if reference is not None:
+            self.attach_alignment(reference, keypoints)
+            yield from self.replay_result(reference)
+            return reference
+
+        parser = AnalysisStreamParser()
+        prompt = self.analysis_prompt(self.score_alignment(keypoints))
+        start = time.perf_counter()
+        try:
+            chunks = self.scheduler.run(
+                self.vision_policy, self.vision_providers,
+                lambda provider: provider.stream(prompt, blob),
+                stream=True
+            )
+        except ProviderTimeout:
+            fallback = self.local_fallback_result(blob)
+            if fallback is None:
+                raise
+            telemetry.increment("local_fallbacks_total")
+            self.attach_alignment(fallback, keypoints)
+            yield ('pose_name', fallback['pose_name'])
+            yield ('section', 'identification', fallback['sections']['identification'])
+            yield ('result', fallback)
+            return fallback
+        for chunk_text in chunks:
+            for event in parser.feed(chunk_text):
+                if event[0] == 'pose_name':
+                    # What the user waits for before seeing anything useful
+                    telemetry.record_duration("vision_stream_first_pose", time.perf_counter() - start)
+                yield event
+        for event in parser.finish():
+            yield event
+        telemetry.record_duration("vision_stream", time.perf_counter() - start)
+
+        if not parser.text.strip():
+            result = self.build_result("Unable to generate pose analysis.")
+            yield ('result', result)
+            return result
+        result = self.attach_alignment(self.build_result(parser.text, parser.pose_name, parser.sections), keypoints)
+        self.analysis_cache.set(cache_key, result)
+        yield ('result', result)
+        return result
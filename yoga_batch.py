@@ -0,0 +1,230 @@
+"""Offline batch analysis of yoga pose images.
+
+Usage:
+    python yoga_batch.py IMAGES_DIR_OR_MANIFEST --output results.jsonl [--remote]
+
+Local classification is spread over a process pool, remote Gemini analysis
+over a bounded thread pool. Results are appended to a JSONL file as they
+finish, and a rerun with the same output file skips images that already
+succeeded, so an interrupted run resumes where it stopped. Each record notes
+its mode; a --remote rerun redoes images that only have a local result.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from model_generation import MODEL_PATH
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp')
+
+_worker_analysis = None
+
+
+def is_url(item):
+    return item.startswith('http://') or item.startswith('https://')
+
+
+def list_images(source):
+    """Return image paths from a directory, or paths/URLs from a manifest file
+
+    A manifest is either plain text with one path or URL per line, or JSONL
+    with a "path" (or "url") field per line.
+    """
+    if os.path.isdir(source):
+        images = []
+        for root, _, files in os.walk(source):
+            for name in files:
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    images.append(os.path.join(root, name))
+        return sorted(images)
+
+    images = []
+    with open(source, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('{'):
+                entry = json.loads(line)
+                line = entry.get('path') or entry.get('url')
+            images.append(line)
+    return images
+
+
+def load_completed(output_path, remote=False):
+    """Return the ids that already have a successful record in the output file
+
+    With remote set, only records that include the remote analysis count,
+    so rerunning a local-only output with --remote fills that in.
+    """
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Partial last line from a crash; that image is simply redone
+                continue
+            if record.get('status') == 'ok' and (not remote or 'remote' in record):
+                completed.add(record['id'])
+    return completed
+
+
+class ResultWriter:
+    """Append JSONL records from several threads, flushing each one to disk"""
+
+    def __init__(self, output_path):
+        self.file = open(output_path, 'a', encoding='utf-8')
+        self.lock = threading.Lock()
+        self.written = 0
+
+    def write(self, record):
+        with self.lock:
+            self.file.write(json.dumps(record) + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.written += 1
+
+    def close(self):
+        self.file.close()
+
+
+def _init_worker():
+    """Load the classifier once per worker process"""
+    global _worker_analysis
+    from yoga_analysis import YogaPoseAnalysis
+    _worker_analysis = YogaPoseAnalysis()
+
+
+def _classify_chunk(items, top_k):
+    """Classify a chunk of images inside a worker process"""
+    loaded, results = [], {}
+    for item in items:
+        try:
+            if is_url(item):
+                image = _worker_analysis.image_processor.download_image_bytes(item)
+                if image is None:
+                    raise ValueError("download failed")
+            else:
+                with open(item, 'rb') as f:
+                    image = f.read()
+            loaded.append((item, image))
+        except Exception as e:
+            results[item] = {'error': f"Unable to load image: {e}"}
+
+    try:
+        predictions = _worker_analysis.classify_batch([image for _, image in loaded], top_k=top_k)
+    except Exception:
+        # One unreadable image fails the whole batch; retry one by one to isolate it
+        predictions = []
+        for item, image in loaded:
+            try:
+                predictions.append(_worker_analysis.classify_batch([image], top_k=top_k)[0])
+            except Exception as e:
+                predictions.append(e)
+
+    for (item, _), prediction in zip(loaded, predictions):
+        if isinstance(prediction, Exception):
+            results[item] = {'error': f"Classification failed: {prediction}"}
+        else:
+            results[item] = {'local': [[label, confidence] for label, confidence in prediction]}
+    return results
+
+
+def run_batch(images, output_path, workers=2, chunk_size=32, top_k=3,
+              remote=False, remote_concurrency=4):
+    """Classify (and optionally remotely analyze) images, resuming from output_path"""
+    completed = load_completed(output_path, remote)
+    pending = [item for item in images if item not in completed]
+    print(f"{len(completed)} already done, {len(pending)} to process")
+    if not pending:
+        return 0
+
+    # Build the default model once up front so workers don't race to create it,
+    # unless they will load a current TFLite export instead
+    from model_export import TFLITE_PATH, is_current_export
+    tflite_path = os.getenv("YOGA_TFLITE_MODEL", TFLITE_PATH)
+    if not os.path.exists(MODEL_PATH) and not (os.path.exists(tflite_path) and is_current_export(tflite_path)):
+        from model_generation import save_default_model
+        save_default_model()
+
+    remote_analysis = None
+    if remote:
+        from scheduler import BATCH
+        from yoga_analysis import YogaPoseAnalysis
+        remote_analysis = YogaPoseAnalysis(load_classifier=False)
+
+    def analyze_remote(item, record):
+        try:
+            source = item
+            if is_url(item):
+                source = remote_analysis.image_processor.download_image_bytes(item)
+            # Queued behind interactive requests sharing the same API keys
+            with remote_analysis.scheduler.priority(BATCH):
+                result = remote_analysis.analyze_image(source)
+            record['remote'] = result
+            if result['pose_name'] == "Analysis Failed":
+                record['status'] = 'error'
+                record['error'] = result['full_analysis']
+        except Exception as e:
+            record['status'] = 'error'
+            record['error'] = f"Remote analysis failed: {e}"
+        writer.write(record)
+
+    writer = ResultWriter(output_path)
+    # Spawn rather than fork so each worker starts TensorFlow cleanly
+    context = multiprocessing.get_context('spawn')
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker) as local_pool, \
+                ThreadPoolExecutor(max_workers=remote_concurrency) as remote_pool:
+            chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+            local_futures = [local_pool.submit(_classify_chunk, chunk, top_k) for chunk in chunks]
+            remote_futures = []
+            for future in as_completed(local_futures):
+                for item, outcome in future.result().items():
+                    record = {'id': item, 'status': 'error' if 'error' in outcome else 'ok',
+                              'mode': 'remote' if remote else 'local'}
+                    record.update(outcome)
+                    if remote and record['status'] == 'ok':
+                        remote_futures.append(remote_pool.submit(analyze_remote, item, record))
+                    else:
+                        writer.write(record)
+            for future in as_completed(remote_futures):
+                future.result()
+    finally:
+        writer.close()
+    print(f"Wrote {writer.written} records to {output_path}")
+    return writer.written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='yoga-batch', description="Batch yoga pose analysis")
+    parser.add_argument('source', help="Image directory or manifest file of paths/URLs")
+    parser.add_argument('--output', default='yoga_batch_results.jsonl', help="JSONL results file (appended, used to resume)")
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="Local classification worker processes")
+    parser.add_argument('--chunk-size', type=int, default=32, help="Images per classification batch")
+    parser.add_argument('--top-k', type=int, default=3, help="Pose labels to keep per image")
+    parser.add_argument('--remote', action='store_true', help="Also run the Gemini analysis for each image")
+    parser.add_argument('--remote-concurrency', type=int, default=4, help="Concurrent remote analysis requests")
+    args = parser.parse_args(argv)
+
+    images = list_images(args.source)
+    run_batch(
+        images,
+        args.output,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        top_k=args.top_k,
+        remote=args.remote,
+        remote_concurrency=args.remote_concurrency,
+    )
+
+
+if __name__ == '__main__':
+    main()